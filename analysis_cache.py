@@ -0,0 +1,133 @@
+# analysis_cache.py
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+HASH_CHUNK_SIZE = 1 << 20
+
+# Part of every cache key. Bump it whenever decoding, the STFT or peak
+# picking change their results or dtypes, so entries written by older code
+# are never served (they age out through eviction).
+#   2: float32 block STFT and separable float32 peak picking
+CACHE_VERSION = 2
+
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 hex digest of a file's contents"""
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class AnalysisCache:
+    """Content-addressed on-disk cache of decoded audio, spectrograms and peaks.
+
+    Entries are .npz files named after the SHA-256 of the file's contents
+    plus the kind of result and the analysis parameters that produced it,
+    so renamed or re-uploaded copies of a file share entries and changing
+    any parameter, or CACHE_VERSION, misses. Once the directory grows past `max_bytes` the
+    least recently used entries are deleted.
+    """
+
+    def __init__(self, cache_dir: str = ".analysis_cache", max_bytes: int = 1 << 30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        # (path, size, mtime) -> content hash, so a file is only hashed once
+        self._file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+    def file_hash(self, file_path: str) -> str:
+        """SHA-256 of the file's contents"""
+        stat = os.stat(file_path)
+        stamp = (os.path.realpath(file_path), stat.st_size, stat.st_mtime_ns)
+        digest = self._file_hashes.get(stamp)
+        if digest is None:
+            digest = file_sha256(file_path)
+            self._file_hashes[stamp] = digest
+        return digest
+
+    def key(self, file_path: str, kind: str, **params) -> str:
+        """Cache key for one kind of result of analyzing a file with `params`"""
+        description = json.dumps(
+            {
+                "version": CACHE_VERSION,
+                "file": self.file_hash(file_path),
+                "kind": kind,
+                "params": params,
+            },
+            sort_keys=True,
+        )
+        return f"{kind}-{hashlib.sha256(description.encode()).hexdigest()}"
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """Cached arrays for `key`, or None on a miss"""
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                arrays = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Discarding unreadable cache entry {path}: {e}")
+            self._remove(path)
+            return None
+
+        # Mark the entry as recently used for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return arrays
+
+    def put(self, key: str, **arrays: np.ndarray):
+        """Store arrays under `key`, then evict old entries over the size limit"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits max_bytes"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".npz"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(os.path.join(self.cache_dir, name))
+            total -= size
+
+    def clear(self):
+        """Delete every cache entry"""
+        for name in os.listdir(self.cache_dir):
+            if name.endswith((".npz", ".tmp")):
+                self._remove(os.path.join(self.cache_dir, name))
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
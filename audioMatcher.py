@@ -1,55 +1,536 @@
-from typing import List, Tuple, Dict
-import sqlite3
-from collections import defaultdict, Counter
+from typing import List, Tuple, Dict, Optional
+import numpy as np
 from audio_database import AudioDatabase
+from fingerprint_index import expand_ranges
+
+# Time deltas are biased into the low 32 bits of a (song_id, delta) vote key
+DELTA_BIAS = 1 << 31
+DELTA_MASK = (1 << 32) - 1
+
+
+def posting_votes(
+    query_hashes: np.ndarray,
+    query_times: np.ndarray,
+    posting_hashes: np.ndarray,
+    posting_songs: np.ndarray,
+    posting_times: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Pair postings with query fingerprints; returns (song_ids, time_deltas, query_times).
+
+    Each posting is paired with every query fingerprint sharing its hash, so
+    hashes repeated in the query all vote.
+    """
+    query_hashes = np.asarray(query_hashes, dtype=np.int64)
+    query_times = np.asarray(query_times, dtype=np.int64)
+
+    # Sort the query by hash so each posting finds its query range by bisection
+    order = np.argsort(query_hashes, kind="stable")
+    sorted_hashes = query_hashes[order]
+    sorted_times = query_times[order]
+    begins = np.searchsorted(sorted_hashes, posting_hashes, side="left")
+    ends = np.searchsorted(sorted_hashes, posting_hashes, side="right")
+
+    query_idx = expand_ranges(begins, ends)
+    posting_idx = np.repeat(np.arange(len(posting_hashes)), ends - begins)
+
+    songs = np.asarray(posting_songs, dtype=np.int64)[posting_idx]
+    times = sorted_times[query_idx]
+    deltas = np.asarray(posting_times, dtype=np.int64)[posting_idx] - times
+    return songs, deltas, times
+
+
+def posting_deltas(
+    query_hashes: np.ndarray,
+    query_times: np.ndarray,
+    posting_hashes: np.ndarray,
+    posting_songs: np.ndarray,
+    posting_times: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """posting_votes without the query offsets: (song_ids, time_deltas)"""
+    songs, deltas, _ = posting_votes(
+        query_hashes, query_times, posting_hashes, posting_songs, posting_times
+    )
+    return songs, deltas
+
+
+def peak_alignments(
+    songs: np.ndarray, deltas: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Histogram (song_id, time_delta) votes and find each song's peak bin.
+
+    Returns per-song arrays (song_ids, aligned_counts, total_counts,
+    best_deltas), where aligned_counts is the height of the tallest bin.
+    """
+    if len(songs) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty
+
+    # One sort over packed (song_id, delta) keys gives every histogram bin
+    keys = (songs << 32) | ((deltas + DELTA_BIAS) & DELTA_MASK)
+    bins, counts = np.unique(keys, return_counts=True)
+    return reduce_bins(bins, counts)
+
+
+def reduce_bins(
+    bins: np.ndarray, counts: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Reduce sorted packed (song_id, delta) histogram bins to per-song peaks"""
+    if len(bins) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty, empty
+    bin_songs = bins >> 32
+
+    # Bins are grouped by song; reduce each group to its peak bin
+    song_starts = np.flatnonzero(np.r_[True, bin_songs[1:] != bin_songs[:-1]])
+    aligned_counts = np.maximum.reduceat(counts, song_starts)
+    total_counts = np.add.reduceat(counts, song_starts)
+    peak_bins = np.lexsort((-counts, bin_songs))[song_starts]
+    best_deltas = (bins[peak_bins] & DELTA_MASK) - DELTA_BIAS
+
+    return bin_songs[song_starts], aligned_counts, total_counts, best_deltas
+
+
+def vote_time_offsets(
+    query_hashes: np.ndarray,
+    query_times: np.ndarray,
+    posting_hashes: np.ndarray,
+    posting_songs: np.ndarray,
+    posting_times: np.ndarray,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Histogram time deltas of every (song, db_offset, query_offset) triple.
+
+    Returns per-song arrays (song_ids, aligned_counts, total_counts,
+    best_deltas); see posting_deltas and peak_alignments.
+    """
+    songs, deltas = posting_deltas(
+        query_hashes, query_times, posting_hashes, posting_songs, posting_times
+    )
+    return peak_alignments(songs, deltas)
+
+
+def ranked_results(
+    database,
+    rankings: List[Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]],
+    top_n: Optional[int],
+) -> List[List[Tuple[Dict, float, int]]]:
+    """The best `top_n` songs of each (song_ids, confidences, aligned_counts) ranking.
+
+    Songs without metadata, e.g. removed after an index snapshot was taken,
+    are skipped and the next candidates take their place; metadata is
+    fetched in one call per round, for the first `top_n` candidates and
+    then twice as many until every list is full or exhausted.
+    """
+    songs = {}
+    limit = top_n
+    while True:
+        wanted = {
+            int(song_id)
+            for ranked in rankings
+            if ranked is not None
+            for song_id in ranked[0][:limit]
+        }
+        missing = sorted(wanted - songs.keys())
+        if missing:
+            found = database.get_songs_by_ids(missing)
+            songs.update((song_id, found.get(song_id)) for song_id in missing)
+
+        results = []
+        complete = True
+        for ranked in rankings:
+            matches = []
+            if ranked is not None:
+                for song_id, confidence, aligned_count in zip(*ranked):
+                    song_info = songs.get(int(song_id))
+                    if song_info:
+                        matches.append((song_info, float(confidence), int(aligned_count)))
+                        if len(matches) == top_n:
+                            break
+                if limit is not None and len(matches) < top_n and len(ranked[0]) > limit:
+                    complete = False
+            results.append(matches)
+
+        if complete:
+            return results
+        limit *= 2
 
 
 class AudioMatcher:
-    """Matches audio fingerprints and identifies songs"""
+    """Matches audio fingerprints and identifies songs.
+
+    `database` can be an AudioDatabase or any backend exposing the same
+    query_postings/get_songs_by_ids methods, such as
+    fingerprint_index.InMemoryFingerprintIndex.
+    """
 
     def __init__(self, database: AudioDatabase):
         self.database = database
 
     def match_audio(
-        self, query_fingerprints: List[Tuple[str, int]], min_matches: int = 5
+        self,
+        query_fingerprints: List[Tuple[int, int]],
+        min_matches: int = 5,
+        top_n: Optional[int] = None,
     ) -> List[Tuple[Dict, float, int]]:
         """Match query fingerprints against database"""
-        query_hashes = [fp[0] for fp in query_fingerprints]
-        query_times = {fp[0]: fp[1] for fp in query_fingerprints}
+        if not query_fingerprints:
+            return []
+        query_hashes, query_times = zip(*query_fingerprints)
+        return self.match_arrays(
+            np.array(query_hashes, dtype=np.int64),
+            np.array(query_times, dtype=np.int64),
+            min_matches,
+            top_n,
+        )
 
-        # Query database
-        db_matches = self.database.query_fingerprints(query_hashes)
+    def match_arrays(
+        self,
+        query_hashes: np.ndarray,
+        query_times: np.ndarray,
+        min_matches: int = 5,
+        top_n: Optional[int] = None,
+    ) -> List[Tuple[Dict, float, int]]:
+        """Match parallel query hash/offset arrays against database.
 
-        if not db_matches:
+        Only the best `top_n` songs (all if None) have their metadata fetched;
+        see ranked_results. Runs lookup(), rank() and resolve() in turn.
+        """
+        if len(query_hashes) == 0:
             return []
 
-        # Calculate time alignment for each song
-        song_scores = defaultdict(list)
-        for song_id, db_fingerprints in db_matches.items():
-            for db_hash, db_time in db_fingerprints:
-                if db_hash in query_times:
-                    query_time = query_times[db_hash]
-                    time_delta = db_time - query_time
-                    song_scores[song_id].append(time_delta)
-
-        # Find the best match for each song
-        final_matches = {}
-        for song_id, time_deltas in song_scores.items():
-            if len(time_deltas) >= min_matches:
-                time_delta_counts = Counter(time_deltas)
-                best_alignment, alignment_count = time_delta_counts.most_common(1)[0]
-
-                # Calculate confidence score
-                confidence = alignment_count / len(query_fingerprints)
-                final_matches[song_id] = (confidence, alignment_count)
-
-        # Sort by confidence and return results
-        results = []
-        for song_id, (confidence, match_count) in sorted(
-            final_matches.items(), key=lambda x: x[1][0], reverse=True
+        postings = self.lookup(query_hashes)
+        if len(postings[0]) == 0:
+            return []
+
+        ranked = self.rank(query_hashes, query_times, postings, min_matches)
+        return self.resolve(ranked, top_n)
+
+    def lookup(self, query_hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """First stage of match_arrays: (hashes, song_ids, time_offsets) postings
+        of the query's unique hashes"""
+        return self.database.query_postings(np.unique(query_hashes))
+
+    def rank(
+        self,
+        query_hashes: np.ndarray,
+        query_times: np.ndarray,
+        postings: Tuple[np.ndarray, np.ndarray, np.ndarray],
+        min_matches: int = 5,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Second stage: vote on time offsets and rank the songs with at least
+        `min_matches` matches as (song_ids, confidences, aligned_counts), best first"""
+        song_ids, aligned_counts, total_counts, _ = vote_time_offsets(
+            query_hashes, query_times, *postings
+        )
+        return self._rank(
+            song_ids, aligned_counts, total_counts, max(1, len(query_hashes)), min_matches
+        )
+
+    def resolve(
+        self, ranked: Tuple[np.ndarray, np.ndarray, np.ndarray], top_n: Optional[int] = None
+    ) -> List[Tuple[Dict, float, int]]:
+        """Last stage: the best `top_n` ranked songs with their metadata"""
+        return ranked_results(self.database, [ranked], top_n)[0]
+
+    def match_batch(
+        self,
+        queries: List[Tuple[np.ndarray, np.ndarray]],
+        min_matches: int = 5,
+        top_n: Optional[int] = None,
+    ) -> List[List[Tuple[Dict, float, int]]]:
+        """match_arrays for many (query_hashes, query_times) pairs at once.
+
+        The unique hashes of all queries are looked up together, the postings
+        are sorted by hash once and each query votes on its own slice of
+        them. Song metadata for every query is fetched in one call too.
+        """
+        if not queries:
+            return []
+        query_hashes = [np.asarray(hashes, dtype=np.int64) for hashes, _ in queries]
+        all_hashes = np.unique(np.concatenate(query_hashes))
+        if len(all_hashes) == 0:
+            return [[] for _ in queries]
+
+        posting_hashes, posting_songs, posting_times = self.database.query_postings(
+            all_hashes
+        )
+        order = np.argsort(posting_hashes, kind="stable")
+        posting_hashes = posting_hashes[order]
+        posting_songs = posting_songs[order]
+        posting_times = posting_times[order]
+
+        rankings = []
+        for hashes, (_, times) in zip(query_hashes, queries):
+            if len(hashes) == 0:
+                rankings.append(None)
+                continue
+
+            # This query's postings are the ranges of its unique hashes
+            unique_hashes = np.unique(hashes)
+            rows = expand_ranges(
+                np.searchsorted(posting_hashes, unique_hashes, side="left"),
+                np.searchsorted(posting_hashes, unique_hashes, side="right"),
+            )
+            song_ids, aligned_counts, total_counts, _ = vote_time_offsets(
+                hashes,
+                times,
+                posting_hashes[rows],
+                posting_songs[rows],
+                posting_times[rows],
+            )
+            rankings.append(
+                self._rank(song_ids, aligned_counts, total_counts, len(hashes), min_matches)
+            )
+
+        # Metadata for every query is fetched together
+        return ranked_results(self.database, rankings, top_n)
+
+    @staticmethod
+    def _rank(
+        song_ids: np.ndarray,
+        aligned_counts: np.ndarray,
+        total_counts: np.ndarray,
+        query_count: int,
+        min_matches: int,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Songs with enough matches, best first: (song_ids, confidences, aligned_counts)"""
+        # Keep songs with enough matches and calculate confidence scores
+        keep = total_counts >= min_matches
+        song_ids = song_ids[keep]
+        aligned_counts = aligned_counts[keep]
+        confidences = aligned_counts / query_count
+
+        ranking = np.argsort(-confidences, kind="stable")
+        return song_ids[ranking], confidences[ranking], aligned_counts[ranking]
+
+
+class IncrementalMatcher:
+    """Matches fingerprints arriving in batches and detects an early winner.
+
+    Each add_batch() looks up only the new hashes and merges their votes
+    into running per-song time-offset histograms. is_confident() reports
+    when the leading song's aligned count is at least `min_aligned` and
+    beats the runner-up by `min_margin` votes and by a factor of
+    `min_ratio`, so callers can stop fingerprinting and querying early.
+    """
+
+    def __init__(
+        self,
+        database: AudioDatabase,
+        min_matches: int = 5,
+        min_aligned: int = 20,
+        min_margin: int = 10,
+        min_ratio: float = 2.0,
+    ):
+        self.database = database
+        self.min_matches = min_matches
+        self.min_aligned = min_aligned
+        self.min_margin = min_margin
+        self.min_ratio = min_ratio
+
+        self.query_count = 0
+        self.bins = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+
+    def add_batch(self, query_hashes: np.ndarray, query_times: np.ndarray):
+        """Look up a batch of query fingerprints and add their votes"""
+        self.query_count += len(query_hashes)
+        if len(query_hashes) == 0:
+            return
+
+        posting_hashes, posting_songs, posting_times = self.database.query_postings(
+            np.unique(query_hashes)
+        )
+        songs, deltas = posting_deltas(
+            query_hashes, query_times, posting_hashes, posting_songs, posting_times
+        )
+        if len(songs) == 0:
+            return
+
+        # Merge the batch histogram into the running one
+        keys = (songs << 32) | ((deltas + DELTA_BIAS) & DELTA_MASK)
+        bins, inverse = np.unique(
+            np.concatenate((self.bins, keys)), return_inverse=True
+        )
+        weights = np.concatenate((self.counts, np.ones(len(keys), dtype=np.int64)))
+        self.bins = bins
+        self.counts = np.bincount(inverse, weights=weights).astype(np.int64)
+
+    def standings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """(song_ids, aligned_counts, total_counts), best song first"""
+        song_ids, aligned_counts, total_counts, _ = reduce_bins(self.bins, self.counts)
+        order = np.argsort(-aligned_counts, kind="stable")
+        return song_ids[order], aligned_counts[order], total_counts[order]
+
+    def is_confident(self) -> bool:
+        """True once the leader is clearly separated from the runner-up"""
+        _, aligned_counts, _ = self.standings()
+        if len(aligned_counts) == 0:
+            return False
+
+        leader = int(aligned_counts[0])
+        runner_up = int(aligned_counts[1]) if len(aligned_counts) > 1 else 0
+        return (
+            leader >= self.min_aligned
+            and leader - runner_up >= self.min_margin
+            and leader >= self.min_ratio * runner_up
+        )
+
+    def results(self, top_n: Optional[int] = None) -> List[Tuple[Dict, float, int]]:
+        """Current ranking in AudioMatcher.match_audio's format"""
+        song_ids, aligned_counts, total_counts = self.standings()
+        keep = total_counts >= self.min_matches
+        song_ids = song_ids[keep]
+        aligned_counts = aligned_counts[keep]
+        ranked = (song_ids, aligned_counts / self.query_count, aligned_counts)
+        return ranked_results(self.database, [ranked], top_n)[0]
+
+
+class RecordingMonitor:
+    """Finds every catalog song playing in a long recording, in one pass.
+
+    Fingerprint chunks are fed in recording order with add_batch(). Each
+    chunk's hashes are looked up once and its (song, time_delta) votes are
+    buffered with their query offsets until no window needs them any more.
+    Windows of `window` frames advancing by `hop` frames vote on the
+    buffered postings, so overlapping windows never query again.
+
+    A song whose tallest bin in a window reaches `min_aligned` votes is
+    detected at that alignment. Detections of the same song at the same
+    alignment (within `delta_tolerance` frames) extend one segment, which
+    closes once `max_gap` frames (default: one window) pass without one.
+    All offsets are in fingerprint frames.
+    """
+
+    def __init__(
+        self,
+        database: AudioDatabase,
+        window: int = 215,
+        hop: int = 108,
+        min_aligned: int = 20,
+        delta_tolerance: int = 2,
+        max_gap: Optional[int] = None,
+    ):
+        if not 0 < hop <= window:
+            raise ValueError("hop must be between 1 and window")
+        self.database = database
+        self.window = window
+        self.hop = hop
+        self.min_aligned = min_aligned
+        self.delta_tolerance = delta_tolerance
+        self.max_gap = window if max_gap is None else max_gap
+
+        self.window_start = 0
+        self.scanned_until = 0
+        # Buffered votes, and the offsets of every buffered query hash
+        self.songs = np.empty(0, dtype=np.int64)
+        self.deltas = np.empty(0, dtype=np.int64)
+        self.times = np.empty(0, dtype=np.int64)
+        self.hash_times = np.empty(0, dtype=np.int64)
+        self.open_segments = []
+        self.segments = []
+
+    def add_batch(self, query_hashes: np.ndarray, query_times: np.ndarray):
+        """Look up the next chunk of fingerprints and scan every window it completes"""
+        if len(query_hashes) == 0:
+            return
+        query_times = np.asarray(query_times, dtype=np.int64)
+
+        posting_hashes, posting_songs, posting_times = self.database.query_postings(
+            np.unique(query_hashes)
+        )
+        songs, deltas, times = posting_votes(
+            query_hashes, query_times, posting_hashes, posting_songs, posting_times
+        )
+        self.songs = np.concatenate((self.songs, songs))
+        self.deltas = np.concatenate((self.deltas, deltas))
+        self.times = np.concatenate((self.times, times))
+        self.hash_times = np.concatenate((self.hash_times, query_times))
+
+        newest = int(query_times.max())
+        while self.window_start + self.window <= newest:
+            self._scan_window(self.window_start, self.window_start + self.window)
+            self.window_start += self.hop
+            self._discard_before(self.window_start)
+
+    def finish(self) -> List[Dict]:
+        """Scan the trailing partial window and return every segment, by start.
+
+        Segments are dicts of song_id, start, end (query offsets), delta
+        (song offset minus query offset), aligned votes and query_count, the
+        number of query hashes in the windows that voted for it.
+        """
+        if len(self.hash_times) and self.hash_times.max() >= self.scanned_until:
+            self._scan_window(self.window_start, int(self.hash_times.max()) + 1)
+        self.segments.extend(self.open_segments)
+        self.open_segments = []
+        for segment in self.segments:
+            segment.pop("last_detected", None)
+        return sorted(self.segments, key=lambda segment: segment["start"])
+
+    def _discard_before(self, start: int):
+        keep = self.times >= start
+        self.songs = self.songs[keep]
+        self.deltas = self.deltas[keep]
+        self.times = self.times[keep]
+        self.hash_times = self.hash_times[self.hash_times >= start]
+
+    def _scan_window(self, start: int, end: int):
+        in_window = (self.times >= start) & (self.times < end)
+        songs = self.songs[in_window]
+        deltas = self.deltas[in_window]
+        times = self.times[in_window]
+
+        # Votes and hashes not already counted by the previous, overlapping window
+        fresh_from = max(start, self.scanned_until)
+        self.scanned_until = end
+        fresh_hashes = int(
+            np.count_nonzero((self.hash_times >= fresh_from) & (self.hash_times < end))
+        )
+
+        song_ids, aligned_counts, _, best_deltas = peak_alignments(songs, deltas)
+        for song_id, aligned_count, delta in zip(
+            song_ids.tolist(), aligned_counts.tolist(), best_deltas.tolist()
         ):
-            song_info = self.database.get_song_by_id(song_id)
-            if song_info:
-                results.append((song_info, confidence, match_count))
+            if aligned_count < self.min_aligned:
+                continue
+            aligned = (songs == song_id) & (np.abs(deltas - delta) <= self.delta_tolerance)
+            aligned_times = times[aligned]
+
+            segment = self._find_segment(song_id, delta)
+            if segment is None:
+                segment = {
+                    "song_id": song_id,
+                    "start": int(aligned_times.min()),
+                    "end": int(aligned_times.max()),
+                    "delta": delta,
+                    "aligned": len(aligned_times),
+                    "query_count": int(
+                        np.count_nonzero(
+                            (self.hash_times >= start) & (self.hash_times < end)
+                        )
+                    ),
+                }
+                self.open_segments.append(segment)
+            else:
+                segment["end"] = max(segment["end"], int(aligned_times.max()))
+                segment["aligned"] += int(np.count_nonzero(aligned_times >= fresh_from))
+                segment["query_count"] += fresh_hashes
+            segment["last_detected"] = end
+
+        # Close segments that went undetected for longer than max_gap
+        still_open = []
+        for segment in self.open_segments:
+            if end - segment["last_detected"] > self.max_gap:
+                self.segments.append(segment)
+            else:
+                still_open.append(segment)
+        self.open_segments = still_open
 
-        return results
+    def _find_segment(self, song_id: int, delta: int) -> Optional[Dict]:
+        for segment in self.open_segments:
+            if (
+                segment["song_id"] == song_id
+                and abs(segment["delta"] - delta) <= self.delta_tolerance
+            ):
+                return segment
+        return None
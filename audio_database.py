@@ -1,13 +1,168 @@
+import argparse
+import heapq
 import sqlite3
 import os
-from typing import List, Tuple, Dict
-from collections import defaultdict, Counter
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import numpy as np
+from typing import List, Tuple, Dict, Optional
+from collections import defaultdict, Counter, OrderedDict
+from connection_pool import ConnectionPool, WriteQueue, connect
+
+# Schema version stored in PRAGMA user_version.
+#   1: fingerprints.hash is the 40-char SHA-1 hex digest (TEXT)
+#   2: fingerprints.hash is the packed integer hash (INTEGER)
+SCHEMA_VERSION = 2
+LEGACY_SCHEMA_VERSION = 1
+
+FINGERPRINTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS fingerprints (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        song_id INTEGER,
+        hash INTEGER,
+        time_offset INTEGER,
+        FOREIGN KEY (song_id) REFERENCES songs (id)
+    )
+"""
+
+# Covering index: hash lookups are answered from the index alone
+FINGERPRINTS_HASH_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_fingerprints_hash
+    ON fingerprints (hash, song_id, time_offset)
+"""
+
+# Lets a song's postings be deleted or replaced without a table scan
+FINGERPRINTS_SONG_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_fingerprints_song
+    ON fingerprints (song_id)
+"""
+FINGERPRINT_INDEXES = ("idx_fingerprints_hash", "idx_fingerprints_song")
+
+# Removed or re-fingerprinted songs, so indexes derived from an earlier
+# snapshot of the fingerprints (fingerprint_index) can skip their postings
+TOMBSTONES_TABLE = """
+    CREATE TABLE IF NOT EXISTS tombstones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        song_id INTEGER NOT NULL,
+        removed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# Free pages returned to the filesystem per compact() step
+VACUUM_STEP_PAGES = 2048
+
+# Fingerprints ingested per hash, kept next to each fingerprints table.
+# Hashes of silence, drum loops or tonal pads collect thousands of postings
+# that cost a lot to fetch and vote on but barely tell songs apart; these
+# counts find them for the stop list (see prune_common_hashes)
+HASH_STATS_TABLE = """
+    CREATE TABLE IF NOT EXISTS hash_stats (
+        hash INTEGER PRIMARY KEY,
+        postings INTEGER NOT NULL
+    )
+"""
+
+
+# Lets ingestion find an already stored copy of a file by its SHA-256
+SONGS_CONTENT_HASH_INDEX = """
+    CREATE INDEX IF NOT EXISTS idx_songs_content_hash
+    ON songs (content_hash)
+"""
+
+# Per-connection scratch table holding the hashes of the current query
+QUERY_HASHES_TABLE = """
+    CREATE TEMP TABLE IF NOT EXISTS query_hashes (
+        hash INTEGER PRIMARY KEY
+    )
+"""
+QUERY_FETCH_SIZE = 10000
+
+# Max values per "IN (...)" lookup, well under SQLite's variable limit
+SONG_BATCH_SIZE = 500
+
+# Key/value settings of the central database, e.g. the shard count
+META_TABLE = """
+    CREATE TABLE IF NOT EXISTS meta (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+"""
+
+# Fibonacci hashing multiplier; mixes the packed fields before taking a prefix
+SHARD_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shard_of(hashes: np.ndarray, num_shards: int) -> np.ndarray:
+    """Shard index of each packed hash, taken from the top bits of its mixed value.
+
+    Packed hashes lead with the anchor frequency, which is heavily skewed
+    toward low bins, so the raw prefix would overload a few shards.
+    """
+    mixed = np.asarray(hashes, dtype=np.int64).astype(np.uint64) * SHARD_MIX
+    return ((mixed >> np.uint64(32)) % np.uint64(num_shards)).astype(np.int64)
+
+
+def shard_path(db_name: str, index: int) -> str:
+    """File holding shard `index` of a sharded database, e.g. songs.shard0.db"""
+    return f"{os.path.splitext(db_name)[0]}.shard{index}.db"
 
 
 class AudioDatabase:
-    def __init__(self, db_name="songs.db"):
-        self.conn = sqlite3.connect(db_name)
+    """SQLite store of song metadata and fingerprints.
+
+    With num_shards > 1 the fingerprints are partitioned over shard files
+    next to `db_name` by shard_of(hash), while songs and settings stay in
+    `db_name`. Lookups fan out to the shards on a thread pool, one
+    connection per shard. The shard count is fixed when the database is
+    created; use reshard() (or `python audio_database.py reshard`) to
+    change it.
+
+    The database is safe to share between threads. Files are kept in WAL
+    mode; reads run on up to `pool_size` per-thread connection sets from a
+    ConnectionPool, so lookups proceed in parallel with each other and
+    with an ingest, while every write is serialized through one writer
+    thread that owns `conn` and `fingerprint_conns`.
+
+    Lookups skip query hashes with more than `max_postings` postings, as
+    counted in hash_stats. The stop list set by prune_common_hashes()
+    instead keeps such hashes out of the database altogether.
+    """
+
+    def __init__(
+        self,
+        db_name="songs.db",
+        song_cache_size: int = 1024,
+        num_shards: Optional[int] = None,
+        pool_size: int = 4,
+        max_postings: Optional[int] = None,
+    ):
+        if db_name == ":memory:":
+            raise ValueError("AudioDatabase needs a database file; :memory: cannot be shared")
+        self.db_name = db_name
+        self.pool_size = pool_size
+        # Incremental vacuum applies to new files; compact() converts older ones
+        self.conn = connect(db_name, incremental_vacuum=True)
+        self.num_shards = self._init_shard_count(num_shards)
+        self.max_postings = max_postings
+        threshold = self._get_meta("stop_list_threshold")
+        self.stop_list_threshold = int(threshold) if threshold is not None else None
         self.create_table()
+        self.schema_version = self.get_schema_version()
+        self._writer = WriteQueue()
+        self._open_shards()
+
+        # Bounded LRU cache of song metadata dicts, keyed by song id
+        self.song_cache_size = song_cache_size
+        self._song_cache = OrderedDict()
+        self._song_cache_lock = threading.Lock()
+
+        # Set while a bulk_load() session owns the open transaction
+        self._bulk_loading = False
+        # Thread running that session; writes from other threads wait on
+        # _bulk_done until it ends instead of joining its transaction
+        self._bulk_owner = None
+        self._bulk_done = threading.Condition()
 
     def create_table(self):
         # For normal app use:
@@ -19,26 +174,42 @@ class AudioDatabase:
             genre TEXT,
             file_path TEXT NOT NULL,
             duration REAL,
-            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            date_added TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            content_hash TEXT
         );
         """
         self.conn.execute(query)
+
+        # Databases from before duplicate detection lack the content hash column
+        columns = [column[1] for column in self.conn.execute("PRAGMA table_info(songs)")]
+        if "content_hash" not in columns:
+            self.conn.execute("ALTER TABLE songs ADD COLUMN content_hash TEXT")
+        self.conn.execute(SONGS_CONTENT_HASH_INDEX)
+        self.conn.execute(TOMBSTONES_TABLE)
         self.conn.commit()
 
-        # Create fingerprints table
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS fingerprints (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                song_id INTEGER,
-                hash TEXT,
-                time_offset INTEGER,
-                FOREIGN KEY (song_id) REFERENCES songs (id)
+        # Databases created before the schema was versioned have user_version 0;
+        # record them as legacy so they are never mixed with the integer format
+        if self.get_schema_version() == 0:
+            if self._fingerprint_hash_type() == "TEXT":
+                self._set_schema_version(LEGACY_SCHEMA_VERSION)
+            else:
+                self._set_schema_version(SCHEMA_VERSION)
+
+        version = self.get_schema_version()
+        if version > SCHEMA_VERSION:
+            raise ValueError(
+                f"Database schema version {version} is newer than supported "
+                f"version {SCHEMA_VERSION}"
             )
-        """
-        )
-        self.conn.commit()
+
+        # Create fingerprints table and its lookup index (existing databases
+        # get the index on first open); sharded databases keep them in the shards
+        if version == SCHEMA_VERSION and self.num_shards == 1:
+            self.conn.execute(FINGERPRINTS_TABLE)
+            self._create_fingerprint_indexes(self.conn)
+            self._create_hash_stats(self.conn)
+            self.conn.commit()
 
         # ----- Optional one-time drop during dev -----
         # Uncomment only once if you want a fresh table:
@@ -46,94 +217,893 @@ class AudioDatabase:
         # self.conn.execute(query)
         # self.conn.commit()
 
+    def _get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+        self.conn.commit()
+
+    def _init_shard_count(self, requested: Optional[int]) -> int:
+        """Shard count recorded in the database, recording `requested` if new"""
+        self.conn.execute(META_TABLE)
+        stored = self._get_meta("num_shards")
+        if stored is not None:
+            if requested is not None and requested != int(stored):
+                raise ValueError(
+                    f"{self.db_name} has {stored} fingerprint shards, not {requested}; "
+                    f"change it with `python audio_database.py reshard`"
+                )
+            return int(stored)
+
+        num_shards = requested or 1
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        if num_shards > 1 and self._fingerprint_hash_type() is not None:
+            raise ValueError(
+                f"{self.db_name} already stores fingerprints; "
+                f"shard it with `python audio_database.py reshard`"
+            )
+        self._set_meta("num_shards", num_shards)
+        return num_shards
+
+    def _connect_shard(self, path: str) -> sqlite3.Connection:
+        conn = connect(path, incremental_vacuum=True)
+        conn.execute(FINGERPRINTS_TABLE)
+        self._create_fingerprint_indexes(conn)
+        self._create_hash_stats(conn)
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        conn.commit()
+        return conn
+
+    @staticmethod
+    def _create_fingerprint_indexes(conn: sqlite3.Connection):
+        conn.execute(FINGERPRINTS_HASH_INDEX)
+        conn.execute(FINGERPRINTS_SONG_INDEX)
+
+    @staticmethod
+    def _create_hash_stats(conn: sqlite3.Connection):
+        """Create hash_stats, counting the postings of databases that predate it"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'hash_stats'"
+        ).fetchone()
+        if exists:
+            return
+        conn.execute(HASH_STATS_TABLE)
+        conn.execute(
+            """
+            INSERT INTO hash_stats (hash, postings)
+            SELECT hash, COUNT(*) FROM fingerprints GROUP BY hash
+        """
+        )
+
+    def _open_shards(self):
+        """Writer connections holding the fingerprints table, one per shard,
+        and the read pool over the same files"""
+        if self.num_shards == 1:
+            self.fingerprint_conns = [self.conn]
+            self._executor = None
+            paths = [self.db_name]
+        else:
+            paths = [shard_path(self.db_name, i) for i in range(self.num_shards)]
+            self.fingerprint_conns = [self._connect_shard(path) for path in paths]
+            # Enough workers for every pooled reader to fan out at once
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.num_shards * self.pool_size, thread_name_prefix="shard"
+            )
+            paths = [self.db_name] + paths
+        self._pool = ConnectionPool(paths, self.pool_size)
+
+    def _close_shards(self):
+        self._pool.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+        for conn in self.fingerprint_conns:
+            if conn is not self.conn:
+                conn.close()
+
+    @contextmanager
+    def _reader(self):
+        """Pooled read connections as (songs_conn, fingerprint_conns)"""
+        with self._pool.connections() as conns:
+            yield conns[0], conns[1:] if self.num_shards > 1 else conns
+
+    def get_schema_version(self) -> int:
+        """Return the fingerprint schema version recorded in the database"""
+        return self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+    def _set_schema_version(self, version: int):
+        self.conn.execute(f"PRAGMA user_version = {int(version)}")
+        self.conn.commit()
+
+    def _fingerprint_hash_type(self) -> str:
+        """Declared type of fingerprints.hash, or None if the table is missing"""
+        for column in self.conn.execute("PRAGMA table_info(fingerprints)"):
+            if column[1] == "hash":
+                return column[2].upper()
+        return None
+
+    def needs_migration(self) -> bool:
+        """True if the stored fingerprints use an older hash format"""
+        return self.schema_version < SCHEMA_VERSION
+
+    def _check_schema(self):
+        if self.needs_migration():
+            raise ValueError(
+                f"Database uses fingerprint schema version {self.schema_version}, "
+                f"expected {SCHEMA_VERSION}; run FingerprintSystem.migrate_database()"
+            )
+
+    def migrate_fingerprints(self):
+        """Drop legacy fingerprints and recreate the table in the current format.
+
+        SHA-1 digests cannot be converted to packed hashes, so songs must be
+        re-fingerprinted afterwards (see FingerprintSystem.migrate_database).
+        """
+        self._write(self._migrate_fingerprints)
+
+    def _migrate_fingerprints(self):
+        self.conn.execute("DROP TABLE IF EXISTS fingerprints")
+        self.conn.execute("DROP TABLE IF EXISTS hash_stats")
+        self.conn.execute(FINGERPRINTS_TABLE)
+        self._create_fingerprint_indexes(self.conn)
+        self._create_hash_stats(self.conn)
+        self.conn.commit()
+        self._set_schema_version(SCHEMA_VERSION)
+        self.schema_version = SCHEMA_VERSION
+
+    def _commit(self, conn: Optional[sqlite3.Connection] = None):
+        """Commit unless a bulk_load() session is batching writes"""
+        if not self._bulk_loading:
+            (conn or self.conn).commit()
+
+    def _write(self, func, *args):
+        """Run func on the writer thread, after any other thread's bulk load"""
+        with self._bulk_done:
+            while self._bulk_owner not in (None, threading.get_ident()):
+                self._bulk_done.wait()
+            return self._writer.run(func, *args)
+
+    def _in_bulk_load(self) -> bool:
+        """True if the calling thread has a bulk_load() session open"""
+        return self._bulk_owner == threading.get_ident()
+
+    def _all_conns(self) -> List[sqlite3.Connection]:
+        return [self.conn] + [c for c in self.fingerprint_conns if c is not self.conn]
+
+    @contextmanager
+    def bulk_load(self):
+        """Session for loading many songs with one transaction and few fsyncs.
+
+        Switches to synchronous=OFF, drops the fingerprint indexes so inserts
+        don't maintain them, and defers every commit until the block exits. The
+        index is rebuilt and the previous synchronous setting restored
+        afterwards; an exception rolls the whole load back. The index drops
+        happen inside the load's transaction, so concurrent readers keep
+        using the indexed snapshot from before the load until it commits.
+
+        The session belongs to the thread that opened it: nested bulk_load()
+        calls on that thread join it, while writes and bulk loads from other
+        threads wait until it has committed or rolled back.
+
+            with database.bulk_load():
+                for ...:
+                    song_id = database.add_song(...)
+                    database.add_fingerprints(song_id, fingerprints)
+        """
+        with self._bulk_done:
+            nested = self._in_bulk_load()
+            if not nested:
+                while self._bulk_owner is not None:
+                    self._bulk_done.wait()
+                self._bulk_owner = threading.get_ident()
+        if nested:
+            yield self
+            return
+
+        try:
+            settings = self._write(self._begin_bulk_load)
+            try:
+                yield self
+            except BaseException:
+                self._write(self._end_bulk_load, settings, False)
+                raise
+            self._write(self._end_bulk_load, settings, True)
+        finally:
+            with self._bulk_done:
+                self._bulk_owner = None
+                self._bulk_done.notify_all()
+
+    def _begin_bulk_load(self) -> List[int]:
+        settings = []
+        for conn in self._all_conns():
+            conn.commit()
+            settings.append(conn.execute("PRAGMA synchronous").fetchone()[0])
+            conn.execute("PRAGMA synchronous = OFF")
+            conn.execute("BEGIN")
+        for conn in self.fingerprint_conns:
+            for index in FINGERPRINT_INDEXES:
+                conn.execute(f"DROP INDEX IF EXISTS {index}")
+        self._bulk_loading = True
+        return settings
+
+    def _end_bulk_load(self, settings: List[int], succeeded: bool):
+        self._bulk_loading = False
+        conns = self._all_conns()
+        if succeeded:
+            for conn in self.fingerprint_conns:
+                self._create_fingerprint_indexes(conn)
+                # Hashes the load pushed over the stop list threshold
+                if self.stop_list_threshold is not None:
+                    self._delete_common_postings(conn, self.stop_list_threshold)
+            for conn in conns:
+                conn.commit()
+        else:
+            # Rolling back also restores the dropped indexes
+            for conn in conns:
+                conn.rollback()
+        for conn, synchronous in zip(conns, settings):
+            conn.execute(f"PRAGMA synchronous = {int(synchronous)}")
+
     def add_song(
-        self, title: str, artist: str, genre: str, path: str, duration: float
+        self,
+        title: str,
+        artist: str,
+        genre: str,
+        path: str,
+        duration: float,
+        content_hash: Optional[str] = None,
     ) -> int:
-        query = "INSERT INTO songs (title, artist, genre, file_path, duration) VALUES (?, ?, ?, ?, ?);"
+        song_id = self._write(
+            self._insert_song, (title, artist, genre, path, duration, content_hash)
+        )
+        with self._song_cache_lock:
+            self._song_cache.clear()
+        return song_id
+
+    def _insert_song(self, values: Tuple) -> int:
+        query = "INSERT INTO songs (title, artist, genre, file_path, duration, content_hash) VALUES (?, ?, ?, ?, ?, ?);"
         cursor = self.conn.cursor()
-        cursor.execute(query, (title, artist, genre, path, duration))
-        self.conn.commit()
+        cursor.execute(query, values)
+        self._commit()
         return cursor.lastrowid
 
     def get_all_songs(self):
         query = "SELECT id, title, artist, genre, file_path, duration, date_added FROM songs;"
-        return self.conn.execute(query).fetchall()
+        with self._reader() as (conn, _):
+            return conn.execute(query).fetchall()
+
+    def count_songs(self) -> int:
+        """Number of songs in the catalog"""
+        with self._reader() as (conn, _):
+            return conn.execute("SELECT COUNT(*) FROM songs").fetchone()[0]
+
+    def find_song_by_content_hash(self, content_hash: str) -> Optional[Dict]:
+        """Song stored from a file with the given SHA-256, if any"""
+        with self._reader() as (conn, _):
+            row = conn.execute(
+                "SELECT id FROM songs WHERE content_hash = ? ORDER BY id LIMIT 1",
+                (content_hash,),
+            ).fetchone()
+        return self.get_song_by_id(row[0]) if row else None
 
-    def add_fingerprints(self, song_id: int, fingerprints: List[Tuple[str, int]]):
+    def add_fingerprints(self, song_id: int, fingerprints: List[Tuple[int, int]]):
         """Add fingerprints for a song"""
-        # Create fingerprints table if it doesn't exist
-        cursor = self.conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS fingerprints (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                song_id INTEGER,
-                hash TEXT,
-                time_offset INTEGER,
-                FOREIGN KEY (song_id) REFERENCES songs (id)
-            )
-        """
-        )
+        self._check_schema()
 
         fingerprint_data = [
-            (song_id, str(hash_val), int(time_offset))
+            (song_id, int(hash_val), int(time_offset))
             for hash_val, time_offset in fingerprints
         ]
 
-        cursor.executemany(
+        if self.num_shards == 1:
+            self._write(self._insert_fingerprints, 0, fingerprint_data)
+            return
+
+        self._write(self._insert_partitions, self._partition(fingerprint_data))
+
+    def _partition(
+        self, rows: List[Tuple[int, int, int]]
+    ) -> List[Tuple[int, List[Tuple[int, int, int]]]]:
+        """(shard, rows) for every shard, splitting (song_id, hash, offset) rows by hash"""
+        if self.num_shards == 1:
+            return [(0, rows)]
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1, 3)
+        shards = shard_of(rows[:, 1], self.num_shards)
+        # One sort groups the rows by shard; split them at the shard boundaries
+        order = np.argsort(shards, kind="stable")
+        bounds = np.searchsorted(shards[order], np.arange(1, self.num_shards))
+        return [
+            (shard, part.tolist())
+            for shard, part in enumerate(np.split(rows[order], bounds))
+        ]
+
+    def _insert_partitions(self, partitions: List[Tuple[int, List[Tuple[int, int, int]]]]):
+        for shard, rows in partitions:
+            if rows:
+                self._insert_fingerprints(shard, rows)
+
+    def _insert_fingerprints(self, shard: int, rows: List[Tuple[int, int, int]]):
+        conn = self.fingerprint_conns[shard]
+        hashes, counts = np.unique(
+            np.array([row[1] for row in rows], dtype=np.int64), return_counts=True
+        )
+
+        crossed = []
+        threshold = self.stop_list_threshold
+        if threshold is not None:
+            # Stop-listed hashes are counted but their postings are not stored
+            before = self._posting_counts(conn, hashes)
+            common = hashes[before + counts > threshold]
+            if len(common):
+                common = set(common.tolist())
+                rows = [row for row in rows if row[1] not in common]
+                crossed = hashes[(before <= threshold) & (before + counts > threshold)]
+
+        conn.executemany(
+            """
+            INSERT INTO hash_stats (hash, postings) VALUES (?, ?)
+            ON CONFLICT (hash) DO UPDATE SET postings = postings + excluded.postings
+        """,
+            zip(hashes.tolist(), counts.tolist()),
+        )
+        conn.executemany(
             """
             INSERT INTO fingerprints (song_id, hash, time_offset)
             VALUES (?, ?, ?)
         """,
-            fingerprint_data,
+            rows,
         )
+        # Hashes that just became common lose the postings stored before;
+        # a bulk load does this once its hash index is rebuilt
+        if len(crossed) and not self._bulk_loading:
+            conn.executemany(
+                "DELETE FROM fingerprints WHERE hash = ?", ((h,) for h in crossed.tolist())
+            )
+        self._commit(conn)
 
-        self.conn.commit()
+    @staticmethod
+    def _posting_counts(conn: sqlite3.Connection, hashes: np.ndarray) -> np.ndarray:
+        """hash_stats postings of each hash, 0 for hashes never ingested"""
+        hashes = hashes.tolist()
+        counts = {}
+        for i in range(0, len(hashes), SONG_BATCH_SIZE):
+            batch = hashes[i : i + SONG_BATCH_SIZE]
+            placeholders = ",".join(["?"] * len(batch))
+            counts.update(
+                conn.execute(
+                    f"SELECT hash, postings FROM hash_stats WHERE hash IN ({placeholders})",
+                    batch,
+                ).fetchall()
+            )
+        return np.array([counts.get(h, 0) for h in hashes], dtype=np.int64)
 
-    def query_fingerprints(
-        self, query_hashes: List[str]
-    ) -> Dict[int, List[Tuple[str, int]]]:
-        """Query database for matching fingerprints"""
-        if not query_hashes:
-            return {}
+    def _iter_matching_rows(self, conn: sqlite3.Connection, query_hashes):
+        """Yield batches of (song_id, hash, time_offset) rows matching query_hashes"""
+        cursor = conn.cursor()
 
-        cursor = self.conn.cursor()
+        # Stage the query hashes in an indexed temp table and join against it,
+        # so query size is not bound by SQLite's variable limit
+        cursor.execute(QUERY_HASHES_TABLE)
+        cursor.execute("DELETE FROM temp.query_hashes")
+        cursor.executemany(
+            "INSERT OR IGNORE INTO temp.query_hashes (hash) VALUES (?)",
+            ((int(h),) for h in query_hashes),
+        )
+        if self.max_postings is not None:
+            # One hash_stats probe per query hash instead of fetching its postings
+            cursor.execute(
+                """
+                DELETE FROM temp.query_hashes
+                WHERE (SELECT postings FROM hash_stats AS s WHERE s.hash = query_hashes.hash) > ?
+            """,
+                (self.max_postings,),
+            )
 
-        # Create placeholders for the IN clause
-        placeholders = ",".join(["?"] * len(query_hashes))
-        query = f"""
-            SELECT song_id, hash, time_offset
-            FROM fingerprints
-            WHERE hash IN ({placeholders})
+        # CROSS JOIN keeps query_hashes as the outer loop, probing the hash index
+        cursor.execute(
+            """
+            SELECT f.song_id, f.hash, f.time_offset
+            FROM temp.query_hashes AS q
+            CROSS JOIN fingerprints AS f ON f.hash = q.hash
         """
+        )
+
+        # Stream rows in fixed-size batches
+        try:
+            for rows in iter(lambda: cursor.fetchmany(QUERY_FETCH_SIZE), []):
+                yield rows
+        finally:
+            cursor.execute("DELETE FROM temp.query_hashes")
+            conn.commit()
+
+    def _shard_postings(self, conn: sqlite3.Connection, query_hashes) -> np.ndarray:
+        """(song_id, hash, time_offset) rows of one shard as an (n, 3) array"""
+        batches = [
+            np.array(rows, dtype=np.int64)
+            for rows in self._iter_matching_rows(conn, query_hashes)
+        ]
+        return np.concatenate(batches) if batches else np.empty((0, 3), dtype=np.int64)
 
-        cursor.execute(query, query_hashes)
-        results = cursor.fetchall()
+    def query_fingerprints(
+        self, query_hashes: List[int]
+    ) -> Dict[int, List[Tuple[int, int]]]:
+        """Query database for matching fingerprints"""
+        if len(query_hashes) == 0:
+            return {}
+        posting_hashes, song_ids, time_offsets = self.query_postings(query_hashes)
 
         # Group results by song_id
         matches = defaultdict(list)
-        for song_id, hash_val, time_offset in results:
+        for song_id, hash_val, time_offset in zip(
+            song_ids.tolist(), posting_hashes.tolist(), time_offsets.tolist()
+        ):
             matches[song_id].append((hash_val, time_offset))
 
         return dict(matches)
 
+    def query_postings(
+        self, query_hashes: List[int]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Query matching fingerprints as parallel (hashes, song_ids, time_offsets) arrays"""
+        self._check_schema()
+        if len(query_hashes) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        with self._reader() as (_, conns):
+            if self.num_shards == 1:
+                postings = self._shard_postings(conns[0], query_hashes)
+            else:
+                # Send each shard only its own hashes and query them concurrently
+                query_hashes = np.asarray(query_hashes, dtype=np.int64)
+                shards = shard_of(query_hashes, self.num_shards)
+                per_shard = [
+                    query_hashes[shards == shard] for shard in range(self.num_shards)
+                ]
+                postings = np.concatenate(
+                    list(self._executor.map(self._shard_postings, conns, per_shard))
+                )
+
+        return postings[:, 1], postings[:, 0], postings[:, 2]
+
+    def iter_fingerprints(self, batch_size: int = QUERY_FETCH_SIZE):
+        """Yield batches of (hash, song_id, time_offset) rows ordered by hash"""
+        self._check_schema()
+        with self._reader() as (_, conns):
+            if self.num_shards == 1:
+                yield from self._iter_shard_fingerprints(conns[0], batch_size)
+                return
+
+            # Every shard is ordered by hash, so a k-way merge keeps global order
+            merged = heapq.merge(
+                *(self._iter_shard_rows(conn, batch_size) for conn in conns)
+            )
+            batch = []
+            for row in merged:
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+
+    def _iter_shard_fingerprints(self, conn: sqlite3.Connection, batch_size: int):
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT hash, song_id, time_offset
+            FROM fingerprints
+            ORDER BY hash
+        """
+        )
+        for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+            yield rows
+
+    def _iter_shard_rows(self, conn: sqlite3.Connection, batch_size: int):
+        for rows in self._iter_shard_fingerprints(conn, batch_size):
+            yield from rows
+
     def get_song_by_id(self, song_id: int) -> Dict:
         """Get song information by song ID"""
-        cursor = self.conn.cursor()
-        cursor.execute(
-            "SELECT id, title, artist, file_path, duration FROM songs WHERE id = ?",
+        return self.get_songs_by_ids([song_id]).get(song_id)
+
+    def get_songs_by_ids(self, song_ids: List[int]) -> Dict[int, Dict]:
+        """Get song information for many song IDs, served from the LRU cache when possible"""
+        songs = {}
+        missing = []
+        with self._song_cache_lock:
+            for song_id in dict.fromkeys(int(i) for i in song_ids):
+                if song_id in self._song_cache:
+                    self._song_cache.move_to_end(song_id)
+                    songs[song_id] = self._song_cache[song_id]
+                else:
+                    missing.append(song_id)
+        if not missing:
+            return songs
+
+        rows = []
+        with self._reader() as (conn, _):
+            for i in range(0, len(missing), SONG_BATCH_SIZE):
+                batch = missing[i : i + SONG_BATCH_SIZE]
+                placeholders = ",".join(["?"] * len(batch))
+                rows += conn.execute(
+                    f"SELECT id, title, artist, file_path, duration FROM songs WHERE id IN ({placeholders})",
+                    batch,
+                ).fetchall()
+
+        for result in rows:
+            songs[result[0]] = self._cache_song(
+                {
+                    "id": result[0],
+                    "title": result[1],
+                    "artist": result[2],
+                    "file_path": result[3],
+                    "duration": result[4],
+                }
+            )
+
+        return songs
+
+    def _cache_song(self, song_info: Dict) -> Dict:
+        if self.song_cache_size > 0:
+            with self._song_cache_lock:
+                self._song_cache[song_info["id"]] = song_info
+                self._song_cache.move_to_end(song_info["id"])
+                while len(self._song_cache) > self.song_cache_size:
+                    self._song_cache.popitem(last=False)
+        return song_info
+
+    def remove_song(self, song_id: int) -> bool:
+        """Delete a song and its fingerprints; False if there is no such song.
+
+        Postings are found through idx_fingerprints_song, and a tombstone
+        records the removal for fingerprint indexes built before it. The
+        freed pages are only returned to the filesystem by compact().
+        """
+        removed = self._write(self._delete_song, int(song_id))
+        with self._song_cache_lock:
+            self._song_cache.pop(int(song_id), None)
+        return removed
+
+    def _delete_song(self, song_id: int) -> bool:
+        cursor = self.conn.execute("DELETE FROM songs WHERE id = ?", (song_id,))
+        if cursor.rowcount == 0:
+            # Close the transaction the DELETE opened
+            self._commit()
+            return False
+        self.conn.execute("INSERT INTO tombstones (song_id) VALUES (?)", (song_id,))
+        if self.num_shards > 1:
+            self._commit()
+        for conn in self.fingerprint_conns:
+            self._delete_song_postings(conn, song_id)
+            self._commit(conn)
+        return True
+
+    @staticmethod
+    def _delete_song_postings(conn: sqlite3.Connection, song_id: int):
+        """Delete a song's postings from one fingerprints table and uncount them.
+
+        Postings of stop-listed hashes were never stored, so those hashes
+        keep their counts and stay on the stop list.
+        """
+        counts = conn.execute(
+            "SELECT hash, COUNT(*) FROM fingerprints WHERE song_id = ? GROUP BY hash",
             (song_id,),
+        ).fetchall()
+        conn.executemany(
+            "UPDATE hash_stats SET postings = postings - ? WHERE hash = ?",
+            ((count, hash_val) for hash_val, count in counts),
         )
-        result = cursor.fetchone()
-        if result:
-            return {
-                "id": result[0],
-                "title": result[1],
-                "artist": result[2],
-                "file_path": result[3],
-                "duration": result[4],
-            }
-        return None
+        conn.executemany(
+            "DELETE FROM hash_stats WHERE hash = ? AND postings <= 0",
+            ((hash_val,) for hash_val, _ in counts),
+        )
+        conn.execute("DELETE FROM fingerprints WHERE song_id = ?", (song_id,))
+
+    def replace_fingerprints(
+        self,
+        song_id: int,
+        fingerprints: List[Tuple[int, int]],
+        duration: Optional[float] = None,
+        content_hash: Optional[str] = None,
+        file_path: Optional[str] = None,
+    ):
+        """Swap a song's fingerprints for new ones, keeping its id and metadata.
+
+        duration, content_hash and file_path are updated when given. The
+        song is tombstoned too, so fingerprint indexes built earlier stop
+        returning its outdated postings until they are rebuilt.
+        """
+        self._check_schema()
+        rows = [
+            (int(song_id), int(hash_val), int(time_offset))
+            for hash_val, time_offset in fingerprints
+        ]
+        self._write(
+            self._replace_fingerprints,
+            int(song_id),
+            self._partition(rows),
+            (duration, content_hash, file_path),
+        )
+        with self._song_cache_lock:
+            self._song_cache.pop(int(song_id), None)
+
+    def _replace_fingerprints(
+        self,
+        song_id: int,
+        partitions: List[Tuple[int, List[Tuple[int, int, int]]]],
+        metadata: Tuple[Optional[float], Optional[str], Optional[str]],
+    ):
+        self.conn.execute(
+            """
+            UPDATE songs
+            SET duration = COALESCE(?, duration),
+                content_hash = COALESCE(?, content_hash),
+                file_path = COALESCE(?, file_path)
+            WHERE id = ?
+        """,
+            (*metadata, song_id),
+        )
+        self.conn.execute("INSERT INTO tombstones (song_id) VALUES (?)", (song_id,))
+        if self.num_shards > 1:
+            self._commit()
+        # Each fingerprints table swaps the postings in one transaction, which
+        # unsharded also covers the metadata update and the tombstone
+        for shard, rows in partitions:
+            self._delete_song_postings(self.fingerprint_conns[shard], song_id)
+            self._insert_fingerprints(shard, rows)
+
+    def tombstone_watermark(self) -> int:
+        """Id of the newest tombstone, 0 if there is none"""
+        with self._reader() as (conn, _):
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM tombstones").fetchone()[0]
+
+    def get_tombstoned_songs(self, after: int = 0) -> List[int]:
+        """Ids of songs removed or re-fingerprinted since tombstone `after`"""
+        with self._reader() as (conn, _):
+            rows = conn.execute(
+                "SELECT DISTINCT song_id FROM tombstones WHERE id > ?", (after,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def prune_tombstones(self, up_to: int):
+        """Forget tombstones every derived index already reflects"""
+        self._write(self._prune_tombstones, up_to)
+
+    def _prune_tombstones(self, up_to: int):
+        self.conn.execute("DELETE FROM tombstones WHERE id <= ?", (up_to,))
+        self._commit()
+
+    def hash_posting_counts(self) -> np.ndarray:
+        """Postings ingested for every distinct hash (unordered), from hash_stats"""
+        self._check_schema()
+        counts = [np.array(rows, dtype=np.int64)[:, 1] for rows in self._iter_hash_stats()]
+        return np.concatenate(counts) if counts else np.empty(0, dtype=np.int64)
+
+    def prune_common_hashes(self, max_postings: int) -> int:
+        """Stop-list hashes with more than `max_postings` postings; returns rows deleted.
+
+        Their stored postings are deleted now, and the threshold is kept in
+        the database so later ingests count such hashes without storing
+        them. Lowering the threshold prunes further; postings deleted
+        earlier only come back by re-fingerprinting their songs. Run
+        compact() afterwards to return the space to the filesystem.
+        """
+        self._check_schema()
+        if max_postings < 1:
+            raise ValueError("max_postings must be at least 1")
+        if self._in_bulk_load():
+            raise ValueError("Cannot prune during bulk_load()")
+        return self._write(self._prune_common_hashes, int(max_postings))
+
+    def _prune_common_hashes(self, max_postings: int) -> int:
+        self._set_meta("stop_list_threshold", max_postings)
+        self.stop_list_threshold = max_postings
+        deleted = 0
+        for conn in self.fingerprint_conns:
+            deleted += self._delete_common_postings(conn, max_postings)
+            conn.commit()
+        return deleted
+
+    @staticmethod
+    def _delete_common_postings(conn: sqlite3.Connection, max_postings: int) -> int:
+        cursor = conn.execute(
+            """
+            DELETE FROM fingerprints
+            WHERE hash IN (SELECT hash FROM hash_stats WHERE postings > ?)
+        """,
+            (max_postings,),
+        )
+        return cursor.rowcount
+
+    def compact(self, step_pages: int = VACUUM_STEP_PAGES) -> int:
+        """Return free pages to the filesystem; returns the bytes reclaimed.
+
+        Runs as many small incremental_vacuum steps on the writer thread,
+        so writes queued meanwhile interleave with it and WAL readers are
+        never blocked. Files created before incremental auto-vacuum was
+        enabled are converted by one full VACUUM first.
+        """
+        if self._in_bulk_load():
+            raise ValueError("Cannot compact during bulk_load()")
+        reclaimed = 0
+        for conn in self._all_conns():
+            size_before = self._write(self._file_size, conn)
+            if self._write(self._pragma, conn, "auto_vacuum") != 2:
+                self._write(self._convert_to_incremental_vacuum, conn)
+            while self._write(self._pragma, conn, "freelist_count") > 0:
+                self._write(self._vacuum_step, conn, step_pages)
+            self._write(self._pragma, conn, "wal_checkpoint(PASSIVE)")
+            reclaimed += size_before - self._write(self._file_size, conn)
+        return reclaimed
+
+    @staticmethod
+    def _pragma(conn: sqlite3.Connection, pragma: str):
+        # fetchall() resets the statement, which would otherwise block a checkpoint
+        return conn.execute(f"PRAGMA {pragma}").fetchall()[0][0]
+
+    def _file_size(self, conn: sqlite3.Connection) -> int:
+        return self._pragma(conn, "page_count") * self._pragma(conn, "page_size")
+
+    @staticmethod
+    def _convert_to_incremental_vacuum(conn: sqlite3.Connection):
+        conn.commit()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+
+    @staticmethod
+    def _vacuum_step(conn: sqlite3.Connection, pages: int):
+        conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+        conn.commit()
+
+    def reshard(self, num_shards: int) -> int:
+        """Redistribute every fingerprint over `num_shards` shards; returns rows moved.
+
+        The new layout is written to temporary files and swapped in at the
+        end. Nothing else may use the database while this runs.
+        """
+        self._check_schema()
+        if num_shards < 1:
+            raise ValueError("num_shards must be at least 1")
+        if num_shards == self.num_shards:
+            return 0
+        return self._write(self._reshard, num_shards)
+
+    def _reshard(self, num_shards: int) -> int:
+        if num_shards == 1:
+            self.conn.execute(FINGERPRINTS_TABLE)
+            self.conn.execute(HASH_STATS_TABLE)
+            targets = [self.conn]
+        else:
+            # A reshard interrupted earlier may have left temp files behind;
+            # reusing them would copy every row in twice
+            for i in range(num_shards):
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(f"{shard_path(self.db_name, i)}.tmp{suffix}"):
+                        os.remove(f"{shard_path(self.db_name, i)}.tmp{suffix}")
+            targets = [
+                sqlite3.connect(f"{shard_path(self.db_name, i)}.tmp")
+                for i in range(num_shards)
+            ]
+            for conn in targets:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute(FINGERPRINTS_TABLE)
+                conn.execute(HASH_STATS_TABLE)
+                conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        moved = 0
+        for rows in self.iter_fingerprints():
+            rows = np.array(rows, dtype=np.int64)
+            shards = shard_of(rows[:, 0], num_shards)
+            for shard, conn in enumerate(targets):
+                selected = rows[shards == shard]
+                conn.executemany(
+                    "INSERT INTO fingerprints (song_id, hash, time_offset) VALUES (?, ?, ?)",
+                    selected[:, [1, 0, 2]].tolist(),
+                )
+            moved += len(rows)
+        # Counts move with their hashes, including those of stop-listed hashes
+        for rows in self._iter_hash_stats():
+            rows = np.array(rows, dtype=np.int64)
+            shards = shard_of(rows[:, 0], num_shards)
+            for shard, conn in enumerate(targets):
+                conn.executemany(
+                    "INSERT INTO hash_stats (hash, postings) VALUES (?, ?)",
+                    rows[shards == shard].tolist(),
+                )
+        for conn in targets:
+            self._create_fingerprint_indexes(conn)
+            conn.commit()
+
+        # Swap the new layout in
+        old_num_shards = self.num_shards
+        self._close_shards()
+        if num_shards > 1:
+            for i, conn in enumerate(targets):
+                conn.close()
+                os.replace(f"{shard_path(self.db_name, i)}.tmp", shard_path(self.db_name, i))
+        if old_num_shards == 1:
+            self.conn.execute("DROP TABLE fingerprints")
+            self.conn.execute("DROP TABLE hash_stats")
+            self.conn.commit()
+            self.conn.execute("VACUUM")
+        else:
+            # Old shards beyond the new count (all of them when unsharding)
+            for i in range(num_shards if num_shards > 1 else 0, old_num_shards):
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(shard_path(self.db_name, i) + suffix):
+                        os.remove(shard_path(self.db_name, i) + suffix)
+
+        self._set_meta("num_shards", num_shards)
+        self.num_shards = num_shards
+        self._open_shards()
+        return moved
+
+    def _iter_hash_stats(self, batch_size: int = QUERY_FETCH_SIZE):
+        """Yield batches of (hash, postings) rows from every fingerprint file"""
+        with self._reader() as (_, conns):
+            for conn in conns:
+                cursor = conn.execute("SELECT hash, postings FROM hash_stats")
+                for rows in iter(lambda: cursor.fetchmany(batch_size), []):
+                    yield rows
 
     def close(self):
+        self._writer.close()
+        self._close_shards()
         self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint database tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    reshard = commands.add_parser(
+        "reshard", help="redistribute fingerprints over N shard files (1 = unsharded)"
+    )
+    reshard.add_argument("--db", default="songs.db")
+    reshard.add_argument("--shards", type=int, required=True)
+
+    compact = commands.add_parser(
+        "compact", help="return space freed by removed songs to the filesystem"
+    )
+    compact.add_argument("--db", default="songs.db")
+
+    prune = commands.add_parser(
+        "prune", help="stop-list hashes with more than N postings and delete them"
+    )
+    prune.add_argument("--db", default="songs.db")
+    prune.add_argument("--max-postings", type=int, required=True)
+
+    args = parser.parse_args()
+    if args.command == "reshard":
+        database = AudioDatabase(args.db)
+        try:
+            moved = database.reshard(args.shards)
+        finally:
+            database.close()
+        print(f"Moved {moved} fingerprints into {args.shards} shard(s)")
+    elif args.command == "compact":
+        database = AudioDatabase(args.db)
+        try:
+            reclaimed = database.compact()
+        finally:
+            database.close()
+        print(f"Reclaimed {reclaimed / 2**20:.1f} MiB")
+    elif args.command == "prune":
+        database = AudioDatabase(args.db)
+        try:
+            deleted = database.prune_common_hashes(args.max_postings)
+        finally:
+            database.close()
+        print(
+            f"Deleted {deleted} postings of hashes with more than "
+            f"{args.max_postings} postings; run `compact` to reclaim the space"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,169 @@
 # audio_processor.py
+import os
 import numpy as np
 import librosa
-from typing import Tuple, List  
+import soundfile as sf
+import soxr
+from typing import Tuple, List, Iterator, Optional
+from analysis_cache import AnalysisCache
+
 
 class AudioProcessor:
-    """Handles audio file loading and preprocessing"""
+    """Handles audio file loading and preprocessing.
+
+    With an AnalysisCache, decoded audio is reused across calls for files
+    with the same contents.
+    """
 
-    def __init__(self, sample_rate: int = 22050):
+    def __init__(self, sample_rate: int = 22050, cache: Optional[AnalysisCache] = None):
         self.sample_rate = sample_rate
+        self.cache = cache
+
+    def load_audio(self, file_path: str, use_cache: bool = True) -> Tuple[np.ndarray, int]:
+        key = None
+        if use_cache and self.cache is not None and os.path.isfile(file_path):
+            key = self.cache.key(file_path, "audio", sample_rate=self.sample_rate)
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached["audio"], self.sample_rate
 
-    def load_audio(self, file_path: str) -> Tuple[np.ndarray, int]:
         try:
             # Use librosa with audioread/ffmpeg support
             audio_data, sr = librosa.load(file_path, sr=self.sample_rate, mono=True)
-            return audio_data, sr
         except Exception as e_librosa:
             print(f"librosa failed: {e_librosa}")
             raise ValueError(f"Could not load audio file {file_path}: {e_librosa}")
 
-    def normalize_audio(self, audio_data: np.ndarray) -> np.ndarray:
-        """Normalize audio data to [-1, 1] range"""
-        max_val = np.max(np.abs(audio_data))
+        if key is not None:
+            self.cache.put(key, audio=audio_data)
+        return audio_data, sr
+
+    def stream_audio(
+        self, file_path: str, block_duration: float = 10.0
+    ) -> Iterator[np.ndarray]:
+        """Decode a file block by block as mono float32 at self.sample_rate.
+
+        Uses the same soundfile decode, channel averaging and soxr resampler
+        as librosa.load, streamed, so the concatenated blocks equal
+        load_audio's output while only one block is held in memory. Like
+        librosa.resample, the resampled total is padded or trimmed to
+        ceil(frames * ratio) in the last block.
+        """
+        try:
+            info = sf.info(file_path)
+        except Exception:
+            # Formats soundfile cannot read go through librosa's audioread fallback
+            audio_data, _ = self.load_audio(file_path)
+            block_size = max(1, int(block_duration * self.sample_rate))
+            for start in range(0, len(audio_data), block_size):
+                yield audio_data[start : start + block_size]
+            return
+
+        resampler = None
+        if info.samplerate != self.sample_rate:
+            resampler = soxr.ResampleStream(
+                info.samplerate, self.sample_rate, 1, dtype="float32", quality="HQ"
+            )
+
+        frames_in = 0
+        frames_out = 0
+
+        def to_mono(block: np.ndarray, last: bool) -> np.ndarray:
+            nonlocal frames_in, frames_out
+            block = block[:, 0] if block.shape[1] == 1 else np.mean(block, axis=1)
+            if resampler is not None:
+                frames_in += len(block)
+                block = resampler.resample_chunk(block, last=last)
+                if last:
+                    # Match librosa.resample's fix_length on the whole signal
+                    target = int(np.ceil(frames_in * self.sample_rate / info.samplerate))
+                    block = librosa.util.fix_length(block, size=target - frames_out)
+                frames_out += len(block)
+            return block
+
+        # Hold one block back so the resampler can be told which block is last.
+        # SoundFile.read truncates short MP3 reads, unlike sf.blocks, which
+        # pads the final block with stale buffer contents.
+        block_size = max(1, int(block_duration * info.samplerate))
+        with sf.SoundFile(file_path) as sound_file:
+            previous = sound_file.read(block_size, dtype="float32", always_2d=True)
+            while len(previous):
+                block = sound_file.read(block_size, dtype="float32", always_2d=True)
+                yield to_mono(previous, last=not len(block))
+                previous = block
+
+    def load_excerpts(
+        self, file_path: str, count: int = 3, excerpt_duration: float = 5.0
+    ) -> List[np.ndarray]:
+        """`count` evenly spaced excerpts of a file, seeking past the rest of it.
+
+        Files no longer than one excerpt come back whole. Formats soundfile
+        cannot seek go through librosa's offset/duration loading.
+        """
+        try:
+            info = sf.info(file_path)
+            total = info.frames / info.samplerate
+        except Exception:
+            info = None
+            total = librosa.get_duration(path=file_path)
+
+        if total <= excerpt_duration:
+            starts = [0.0]
+        else:
+            centers = [total * (i + 1) / (count + 1) for i in range(count)]
+            starts = [
+                min(max(center - excerpt_duration / 2, 0.0), total - excerpt_duration)
+                for center in centers
+            ]
+
+        if info is None:
+            return [
+                librosa.load(
+                    file_path,
+                    sr=self.sample_rate,
+                    mono=True,
+                    offset=start,
+                    duration=excerpt_duration,
+                )[0]
+                for start in starts
+            ]
+
+        excerpts = []
+        with sf.SoundFile(file_path) as sound_file:
+            for start in starts:
+                sound_file.seek(int(start * info.samplerate))
+                block = sound_file.read(
+                    int(excerpt_duration * info.samplerate), dtype="float32", always_2d=True
+                )
+                block = block[:, 0] if block.shape[1] == 1 else np.mean(block, axis=1)
+                if info.samplerate != self.sample_rate:
+                    block = soxr.resample(
+                        block, info.samplerate, self.sample_rate, quality="HQ"
+                    )
+                excerpts.append(block)
+        return excerpts
+
+    def scan_audio(self, file_path: str) -> Tuple[float, float]:
+        """Streaming pass returning (peak absolute amplitude, duration in seconds)"""
+        max_val = 0.0
+        num_samples = 0
+        for block in self.stream_audio(file_path):
+            if len(block):
+                max_val = max(max_val, float(np.max(np.abs(block))))
+            num_samples += len(block)
+        return max_val, num_samples / self.sample_rate
+
+    def normalize_audio(self, audio_data: np.ndarray, in_place: bool = False) -> np.ndarray:
+        """Normalize audio data to [-1, 1] range.
+
+        With in_place=True the caller's array is scaled instead of copied.
+        """
+        if len(audio_data) == 0:
+            return audio_data
+        # max(|x|) without allocating np.abs(audio_data)
+        max_val = max(audio_data.max(), -audio_data.min())
         if max_val > 0:
+            if in_place:
+                return np.divide(audio_data, max_val, out=audio_data)
             return audio_data / max_val
         return audio_data
-
@@ -0,0 +1,763 @@
+# benchmark.py
+"""
+Offline benchmarks for TuneTrace.
+
+Usage:
+    python benchmark.py query [--sizes 10000 100000 1000000] [--shards 4]
+    python benchmark.py ingest [--songs-dir Songs] [--workers 1 4 8]
+    python benchmark.py peaks [--songs-dir Songs] [--clips 3] [--snr 10]
+    python benchmark.py analysis [--songs-dir Songs] [--files 3]
+    python benchmark.py identify [--songs-dir Songs] [--workers 1 4] [--batch-sizes 1 16 64]
+    python benchmark.py stoplist [--db songs.db | --songs-dir Songs] [--thresholds 1000 100 20]
+    python benchmark.py accuracy [--songs-dir Songs] [--window-size 4096] [--out run.json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import signal
+from scipy.ndimage import maximum_filter
+
+from audio_database import AudioDatabase
+from spectrogram_utils import SpectrogramGenerator
+
+
+def _timed(func, repeats: int = 5) -> float:
+    """Median wall-clock seconds of func() over a few runs"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def _fill_database(db: AudioDatabase, num_fingerprints: int, num_songs: int = 100):
+    """Insert random packed hashes spread over num_songs songs"""
+    rng = np.random.default_rng(0)
+    per_song = max(1, num_fingerprints // num_songs)
+    for i in range(num_songs):
+        song_id = db.add_song(f"song {i}", "bench", "Other", f"song_{i}.mp3", 180.0)
+        hashes = rng.integers(0, 1 << 40, per_song)
+        offsets = rng.integers(0, 4000, per_song)
+        db.add_fingerprints(song_id, zip(hashes.tolist(), offsets.tolist()))
+
+
+def bench_query(sizes: List[int], query_size: int = 500, num_shards: int = 1):
+    """Query latency vs. catalog size, with and without the hash index"""
+    print(f"{num_shards} shard(s)")
+    print(f"{'fingerprints':>14} {'no index (ms)':>15} {'indexed (ms)':>14}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            db = AudioDatabase(os.path.join(tmp, "bench.db"), num_shards=num_shards)
+            _fill_database(db, size)
+
+            stored = []
+            for conn in db.fingerprint_conns:
+                stored += [
+                    row[0]
+                    for row in conn.execute(
+                        "SELECT hash FROM fingerprints ORDER BY RANDOM() LIMIT ?",
+                        (query_size // len(db.fingerprint_conns),),
+                    )
+                ]
+
+            indexed = _timed(lambda: db.query_fingerprints(stored))
+            for conn in db.fingerprint_conns:
+                conn.execute("DROP INDEX idx_fingerprints_hash")
+            unindexed = _timed(lambda: db.query_fingerprints(stored))
+            db.close()
+
+        print(f"{size:>14} {unindexed * 1000:>15.1f} {indexed * 1000:>14.1f}")
+
+
+def _songs_in_directory(songs_dir: str) -> List[dict]:
+    """songs_info entries for every audio file in a directory"""
+    songs_info = []
+    for name in sorted(os.listdir(songs_dir)):
+        if name.lower().endswith((".mp3", ".wav")):
+            songs_info.append(
+                {
+                    "file_path": os.path.join(songs_dir, name),
+                    "title": os.path.splitext(name)[0],
+                    "artist": "bench",
+                }
+            )
+    return songs_info
+
+
+def bench_ingest(songs_dir: str, worker_counts: List[int]):
+    """Catalog ingestion throughput (songs/minute) per worker count"""
+    from fingerprint_system import FingerprintSystem
+
+    songs_info = _songs_in_directory(songs_dir)
+    print(f"Ingesting {len(songs_info)} files from {songs_dir}")
+    print(f"{'workers':>8} {'added':>6} {'seconds':>9} {'songs/min':>10}")
+    for workers in worker_counts:
+        with tempfile.TemporaryDirectory() as tmp:
+            system = FingerprintSystem(os.path.join(tmp, "bench.db"))
+            start = time.perf_counter()
+            added = system.batch_add_songs(songs_info, workers=workers)
+            elapsed = time.perf_counter() - start
+            system.database.close()
+
+        print(f"{workers:>8} {added:>6} {elapsed:>9.1f} {added / elapsed * 60:>10.1f}")
+
+
+def _add_noise(clip: np.ndarray, snr_db: float, rng: np.random.Generator) -> np.ndarray:
+    """clip plus white noise at `snr_db` dB below the clip's power"""
+    noise = rng.standard_normal(len(clip)).astype(np.float32)
+    noise *= np.sqrt(np.mean(clip**2) / 10 ** (snr_db / 10))
+    return clip + noise
+
+
+class _ReferencePeakPicker(SpectrogramGenerator):
+    """The original full 2-D maximum_filter peak picking, for comparison"""
+
+    def find_peak_arrays(self, spectrogram, neighborhood_size=None, min_amplitude=None):
+        local_max = maximum_filter(spectrogram, size=self.neighborhood_size) == spectrogram
+        return np.where(local_max & (spectrogram > self.min_amplitude))
+
+
+# Peak picking settings compared by `benchmark.py peaks`
+PEAK_CONFIGS = {
+    "reference": _ReferencePeakPicker(),
+    "default": SpectrogramGenerator(),
+    "top-5": SpectrogramGenerator(peaks_per_frame=5),
+    "prominence-15": SpectrogramGenerator(peak_prominence=15.0),
+    "prom-15+top-5": SpectrogramGenerator(peak_prominence=15.0, peaks_per_frame=5),
+}
+
+
+def bench_peaks(
+    songs_dir: str, clips_per_song: int = 3, clip_seconds: float = 8.0, snr_db: float = 10.0
+):
+    """Peak picking speed, peak/hash volume and recall@1 per peak configuration"""
+    from audio_processor import AudioProcessor
+    from audioMatcher import AudioMatcher
+    from fingerPrintGenerator import FingerprintGenerator
+
+    audio_processor = AudioProcessor()
+    sample_rate = audio_processor.sample_rate
+    rng = np.random.default_rng(0)
+
+    songs_info = _songs_in_directory(songs_dir)
+    tracks, clips = [], []
+    for song_info in songs_info:
+        audio, _ = audio_processor.load_audio(song_info["file_path"])
+        audio = audio_processor.normalize_audio(audio, in_place=True)
+        _, _, spectrogram = PEAK_CONFIGS["default"].generate_spectrogram(audio, sample_rate)
+        tracks.append((song_info, len(audio) / sample_rate, spectrogram))
+
+        # Noisy excerpts of the track, labelled with its catalog position
+        clip_length = min(len(audio), int(clip_seconds * sample_rate))
+        for _ in range(clips_per_song):
+            start = rng.integers(0, len(audio) - clip_length + 1)
+            clip = audio[start : start + clip_length]
+            clips.append((len(tracks) - 1, _add_noise(clip, snr_db, rng)))
+
+    total_seconds = sum(duration for _, duration, _ in tracks)
+    print(
+        f"{len(tracks)} files ({total_seconds:.0f} s of audio), "
+        f"{len(clips)} clips of {clip_seconds:.0f} s at {snr_db:.0f} dB SNR"
+    )
+    print(
+        f"{'config':>14} {'pick (ms)':>10} {'Mbins/s':>8} {'peaks/s':>8} "
+        f"{'hashes':>8} {'recall@1':>9}"
+    )
+    for name, spec_gen in PEAK_CONFIGS.items():
+        fingerprint_generator = FingerprintGenerator(spectrogram_generator=spec_gen)
+
+        start = time.perf_counter()
+        peaks = [spec_gen.find_peak_arrays(spectrogram) for _, _, spectrogram in tracks]
+        pick_seconds = time.perf_counter() - start
+        num_bins = sum(spectrogram.size for _, _, spectrogram in tracks)
+        num_peaks = sum(len(freq_bins) for freq_bins, _ in peaks)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            db = AudioDatabase(os.path.join(tmp, "bench.db"))
+            song_ids, num_hashes = [], 0
+            for (song_info, duration, _), (freq_bins, time_bins) in zip(tracks, peaks):
+                song_id = db.add_song(
+                    song_info["title"], "bench", "Other", song_info["file_path"], duration
+                )
+                hashes, offsets = fingerprint_generator.generate_hash_arrays(
+                    freq_bins, time_bins
+                )
+                db.add_fingerprints(song_id, zip(hashes.tolist(), offsets.tolist()))
+                song_ids.append(song_id)
+                num_hashes += len(hashes)
+
+            matcher = AudioMatcher(db)
+            correct = 0
+            for track, clip in clips:
+                query_hashes, query_times = fingerprint_generator.generate_fingerprint_arrays(
+                    audio_processor.normalize_audio(clip, in_place=True), sample_rate
+                )
+                matches = matcher.match_arrays(query_hashes, query_times, top_n=1)
+                correct += bool(matches) and matches[0][0]["id"] == song_ids[track]
+            db.close()
+
+        print(
+            f"{name:>14} {pick_seconds * 1000:>10.0f} "
+            f"{num_bins / pick_seconds / 1e6:>8.1f} {num_peaks / total_seconds:>8.1f} "
+            f"{num_hashes:>8} {correct / max(1, len(clips)):>9.2%}"
+        )
+
+
+def _analyze_file(file_path: str, legacy: bool) -> Tuple[float, float, float, int]:
+    """Decode, normalize, transform and pick peaks in this process.
+
+    Returns (seconds, peak RSS MB, peak RSS growth MB, number of peaks).
+    legacy=True runs the previous path: copying normalize_audio,
+    scipy.signal.spectrogram with an out-of-place dB conversion, and the
+    full 2-D maximum_filter.
+    """
+    from audio_processor import AudioProcessor
+
+    audio_processor = AudioProcessor()
+    spec_gen = _ReferencePeakPicker() if legacy else SpectrogramGenerator()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    audio, sr = audio_processor.load_audio(file_path)
+    if legacy:
+        audio = audio / np.max(np.abs(audio))
+        _, _, Sxx = signal.spectrogram(
+            audio,
+            fs=sr,
+            window="hann",
+            nperseg=spec_gen.window_size,
+            noverlap=spec_gen.window_size - spec_gen.hop_size,
+            scaling="spectrum",
+        )
+        spectrogram = 10 * np.log10(Sxx + 1e-12)
+    else:
+        audio = audio_processor.normalize_audio(audio, in_place=True)
+        _, _, spectrogram = spec_gen.generate_spectrogram(audio, sr)
+    freq_bins, _ = spec_gen.find_peak_arrays(spectrogram)
+    elapsed = time.perf_counter() - start
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return elapsed, peak_rss / 1024, (peak_rss - baseline) / 1024, len(freq_bins)
+
+
+def bench_analysis(songs_dir: str, num_files: int = 3):
+    """Peak RSS and wall time of the analysis path on the longest files"""
+    import librosa
+
+    songs_info = _songs_in_directory(songs_dir)
+    durations = {
+        song_info["file_path"]: librosa.get_duration(path=song_info["file_path"])
+        for song_info in songs_info
+    }
+    longest = sorted(durations, key=durations.get, reverse=True)[:num_files]
+
+    print(
+        f"{'file':>28} {'sec':>6} {'path':>7} {'wall (s)':>9} "
+        f"{'peak RSS (MB)':>14} {'growth (MB)':>12} {'peaks':>7}"
+    )
+    # A fresh interpreter per run keeps one run's peak RSS out of the next
+    spawn = multiprocessing.get_context("spawn")
+    for file_path in longest:
+        for legacy in (True, False):
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as executor:
+                elapsed, peak_rss, growth, num_peaks = executor.submit(
+                    _analyze_file, file_path, legacy
+                ).result()
+            print(
+                f"{os.path.basename(file_path)[:28]:>28} {durations[file_path]:>6.0f} "
+                f"{'legacy' if legacy else 'float32':>7} {elapsed:>9.2f} "
+                f"{peak_rss:>14.0f} {growth:>12.0f} {num_peaks:>7}"
+            )
+
+
+def _write_clips(
+    songs_info: List[dict],
+    out_dir: str,
+    clips_per_song: int = 3,
+    clip_seconds: float = 8.0,
+    noise_level: float = 0.05,
+) -> List[Tuple[str, str]]:
+    """Write noisy excerpts of each song as WAV files; returns (clip_path, song file_path)"""
+    import soundfile as sf
+    from audio_processor import AudioProcessor
+
+    audio_processor = AudioProcessor()
+    rng = np.random.default_rng(0)
+    clips = []
+    for song_info in songs_info:
+        audio, sr = audio_processor.load_audio(song_info["file_path"])
+        clip_length = min(len(audio), int(clip_seconds * sr))
+        for i in range(clips_per_song):
+            start = rng.integers(0, len(audio) - clip_length + 1)
+            clip = audio[start : start + clip_length]
+            clip = clip + noise_level * rng.standard_normal(clip_length).astype(np.float32)
+            clip_path = os.path.join(out_dir, f"clip_{len(clips)}.wav")
+            sf.write(clip_path, clip, sr)
+            clips.append((clip_path, song_info["file_path"]))
+    return clips
+
+
+def bench_identify(songs_dir: str, worker_counts: List[int], batch_sizes: List[int]):
+    """identify_batch throughput (queries/second) per worker count and batch size"""
+    from fingerprint_system import FingerprintSystem
+
+    songs_info = _songs_in_directory(songs_dir)
+    with tempfile.TemporaryDirectory() as tmp:
+        system = FingerprintSystem(os.path.join(tmp, "bench.db"))
+        system.batch_add_songs(songs_info)
+        clips = _write_clips(songs_info, tmp)
+        clip_paths = [clip_path for clip_path, _ in clips]
+
+        start = time.perf_counter()
+        for clip_path in clip_paths:
+            system.identify_audio(clip_path)
+        baseline = len(clip_paths) / (time.perf_counter() - start)
+
+        print(f"{len(clip_paths)} clips against {len(songs_info)} songs")
+        print(f"{'identify_audio loop':>24} {baseline:>8.1f} queries/s")
+        print(f"{'workers':>8} {'batch':>6} {'queries/s':>10}")
+        for workers in worker_counts:
+            for batch_size in batch_sizes:
+                start = time.perf_counter()
+                system.identify_batch(clip_paths, workers=workers, batch_size=batch_size)
+                elapsed = time.perf_counter() - start
+                print(f"{workers:>8} {batch_size:>6} {len(clip_paths) / elapsed:>10.1f}")
+        system.database.close()
+
+
+def bench_stop_list(
+    songs_dir: str, thresholds: List[int], db_path: str = None, clips_per_song: int = 3
+):
+    """Index size, lookup latency and recall@1 with common hashes stop-listed.
+
+    Each threshold is applied as the backends' query-time max_postings,
+    which skips exactly the postings prune_common_hashes would delete, so
+    one catalog serves every row. Every count comes from hash_stats, and
+    the index size is that of an index file built after such a prune.
+    Uses the catalog in `db_path` if given, otherwise one built from
+    `songs_dir`.
+    """
+    from audioMatcher import AudioMatcher
+    from fingerprint_index import INDEX_HEADER, InMemoryFingerprintIndex
+    from fingerprint_system import FingerprintSystem, try_fingerprint_file
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if db_path:
+            system = FingerprintSystem(db_path)
+        else:
+            system = FingerprintSystem(os.path.join(tmp, "bench.db"))
+            system.batch_add_songs(_songs_in_directory(songs_dir))
+        db = system.database
+
+        songs_info = [
+            {"file_path": row[4], "title": row[1]}
+            for row in db.get_all_songs()
+            if os.path.exists(row[4])
+        ]
+        queries = []
+        for clip_path, song_path in _write_clips(songs_info, tmp, clips_per_song):
+            fingerprints = try_fingerprint_file(system.fingerprint_generator, clip_path)
+            if fingerprints is not None:
+                queries.append((fingerprints, song_path))
+
+        index = InMemoryFingerprintIndex.from_database(db)
+        stats = db.hash_posting_counts()
+        # Hashes the database's own stop list already keeps out of the index
+        stored = (
+            stats <= db.stop_list_threshold
+            if db.stop_list_threshold is not None
+            else np.ones(len(stats), dtype=bool)
+        )
+        print(
+            f"{len(stats)} hashes ({len(index.keys)} stored), {len(index)} postings, "
+            f"{len(queries)} clips; "
+            f"postings per hash p50 {np.percentile(stats, 50):.0f}, "
+            f"p99 {np.percentile(stats, 99):.0f}, p99.9 {np.percentile(stats, 99.9):.0f}, "
+            f"max {stats.max()}"
+        )
+        print(
+            f"{'max postings':>12} {'stop-listed':>11} {'postings':>9} {'index MB':>9} "
+            f"{'fetched/q':>10} {'sqlite ms':>10} {'memory ms':>10} {'recall@1':>9}"
+        )
+        for threshold in [None] + sorted(thresholds, reverse=True):
+            kept = stored & (stats <= threshold) if threshold else stored
+            num_keys, num_postings = int(kept.sum()), int(stats[kept].sum())
+            index_bytes = INDEX_HEADER.size + 8 * (2 * num_keys + 1) + 8 * num_postings
+
+            db.max_postings = index.max_postings = threshold
+            fetched = np.mean(
+                [len(index.query_postings(hashes)[0]) for (hashes, _), _ in queries]
+            )
+            latencies, correct = {}, 0
+            for name, backend in (("sqlite", db), ("memory", index)):
+                matcher = AudioMatcher(backend)
+                start = time.perf_counter()
+                for (hashes, times), song_path in queries:
+                    matches = matcher.match_arrays(hashes, times, top_n=1)
+                    if name == "sqlite":
+                        correct += bool(matches) and matches[0][0]["file_path"] == song_path
+                latencies[name] = (time.perf_counter() - start) / max(1, len(queries))
+
+            print(
+                f"{threshold or 'none':>12} {len(stats) - num_keys:>11} {num_postings:>9} "
+                f"{index_bytes / 2**20:>9.2f} {fetched:>10.0f} "
+                f"{latencies['sqlite'] * 1000:>10.2f} {latencies['memory'] * 1000:>10.2f} "
+                f"{correct / max(1, len(queries)):>9.2%}"
+            )
+        db.close()
+
+
+# Query stages timed by `benchmark.py accuracy`, in pipeline order
+ACCURACY_STAGES = ("spectrogram", "peaks", "hashing", "lookup", "voting")
+
+
+def _distortions(
+    snr_db: float, gain_db: float, band_hz: Tuple[float, float], sample_rate: int
+) -> Dict:
+    """Distortions applied by `benchmark.py accuracy`: name -> f(clip, rng).
+
+    "time_shift" is not listed: it is a clip cut half a hop later, so
+    that its frames fall between the catalog's.
+    """
+    band_pass = signal.butter(4, band_hz, btype="bandpass", fs=sample_rate, output="sos")
+    return {
+        "clean": lambda clip, rng: clip,
+        "noise": lambda clip, rng: _add_noise(clip, snr_db, rng),
+        # Amplified into the clipping of a saturated input
+        "gain": lambda clip, rng: np.clip(clip * 10 ** (gain_db / 20), -1.0, 1.0),
+        "band_pass": lambda clip, rng: signal.sosfilt(band_pass, clip).astype(np.float32),
+    }
+
+
+def _percentiles(seconds: List[float]) -> Dict[str, float]:
+    p50, p90, p99 = np.percentile(np.array(seconds) * 1000, [50, 90, 99])
+    return {"p50": float(p50), "p90": float(p90), "p99": float(p99)}
+
+
+def bench_accuracy(
+    songs_dir: str,
+    params: Dict,
+    clips_per_song: int = 5,
+    clip_seconds: float = 8.0,
+    holdout: int = 2,
+    min_aligned: int = 20,
+    min_matches: int = 5,
+    snr_db: float = 5.0,
+    gain_db: float = 12.0,
+    band_hz: Tuple[float, float] = (300.0, 3400.0),
+    backend: str = "sqlite",
+    seed: int = 0,
+) -> Dict:
+    """Recall@1, false positives and per-stage latency for one parameter set.
+
+    The tracks in `songs_dir`, except `holdout` of them, are fingerprinted
+    into a fresh catalog. Clips cut at random frame-aligned offsets of every
+    track are distorted (see _distortions) and identified through
+    AudioMatcher's lookup/rank/resolve stages with `min_matches`; an answer
+    counts when its top song has at least `min_aligned` aligned hashes. Clips of
+    held-out tracks measure the false positive rate. Everything random
+    derives from `seed`, so runs differ only by `params` (SpectrogramGenerator
+    and FingerprintGenerator arguments). Returns a JSON-ready dict.
+    """
+    from audioMatcher import AudioMatcher
+    from audio_processor import AudioProcessor
+    from fingerPrintGenerator import FingerprintGenerator
+    from fingerprint_index import InMemoryFingerprintIndex, build_index_file
+
+    spec_params = {k: v for k, v in params.items() if k != "target_zone_length"}
+    spec_gen = SpectrogramGenerator(**spec_params)
+    fingerprint_generator = FingerprintGenerator(
+        target_zone_length=params.get("target_zone_length", 5),
+        spectrogram_generator=spec_gen,
+    )
+    audio_processor = AudioProcessor()
+    sample_rate = audio_processor.sample_rate
+    rng = np.random.default_rng(seed)
+
+    songs_info = _songs_in_directory(songs_dir)
+    holdout = min(holdout, len(songs_info) - 1)
+    held_out = set(rng.choice(len(songs_info), holdout, replace=False).tolist())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = AudioDatabase(os.path.join(tmp, "bench.db"))
+        audio_seconds = fingerprint_seconds = num_hashes = 0
+        tracks = []
+        with db.bulk_load():
+            for i, song_info in enumerate(songs_info):
+                audio, _ = audio_processor.load_audio(song_info["file_path"])
+                audio = audio_processor.normalize_audio(audio, in_place=True)
+                song_id = None
+                if i not in held_out:
+                    start = time.perf_counter()
+                    hashes, offsets = fingerprint_generator.generate_fingerprint_arrays(
+                        audio, sample_rate
+                    )
+                    fingerprint_seconds += time.perf_counter() - start
+                    if len(hashes) == 0:
+                        continue
+                    audio_seconds += len(audio) / sample_rate
+                    num_hashes += len(hashes)
+                    song_id = db.add_song(
+                        song_info["title"],
+                        "bench",
+                        "Other",
+                        song_info["file_path"],
+                        len(audio) / sample_rate,
+                    )
+                    db.add_fingerprints(song_id, zip(hashes.tolist(), offsets.tolist()))
+                tracks.append((song_id, audio))
+
+        index_path = os.path.join(tmp, "bench.idx")
+        build_index_file(db, index_path)
+        catalog = {
+            "songs": len(tracks) - len(held_out),
+            "held_out": len(held_out),
+            "audio_seconds": audio_seconds,
+            "hashes": num_hashes,
+            "hashes_per_second": num_hashes / max(fingerprint_seconds, 1e-9),
+            "sqlite_bytes": sum(
+                os.path.getsize(path)
+                for path in (db.db_name, db.db_name + "-wal")
+                if os.path.exists(path)
+            ),
+            "index_bytes": os.path.getsize(index_path),
+        }
+        matcher = AudioMatcher(
+            InMemoryFingerprintIndex.from_database(db) if backend == "memory" else db
+        )
+
+        # The same frame-aligned cuts serve every distortion
+        hop = spec_gen.hop_size
+        shift = hop // 2
+        cuts = []
+        for song_id, audio in tracks:
+            clip_length = min(len(audio) - shift, int(clip_seconds * sample_rate))
+            if clip_length <= spec_gen.window_size:
+                continue
+            for _ in range(clips_per_song):
+                frames = (len(audio) - shift - clip_length) // hop + 1
+                start = int(rng.integers(0, frames)) * hop
+                cuts.append((song_id, audio, start, clip_length))
+
+        distortions = _distortions(snr_db, gain_db, band_hz, sample_rate)
+        results = {}
+        for name in list(distortions) + ["time_shift"]:
+            distort = distortions.get(name, distortions["clean"])
+            offset = shift if name == "time_shift" else 0
+            stage_seconds = {stage: [] for stage in ACCURACY_STAGES + ("total",)}
+            correct = wrong = positives = false_positives = negatives = 0
+            query_hashes = 0
+            for song_id, audio, start, clip_length in cuts:
+                clip = distort(audio[start + offset : start + offset + clip_length], rng)
+                clip = audio_processor.normalize_audio(
+                    np.array(clip, dtype=np.float32), in_place=True
+                )
+
+                timings = [time.perf_counter()]
+                _, _, spectrogram = spec_gen.generate_spectrogram(clip, sample_rate)
+                timings.append(time.perf_counter())
+                freq_bins, time_bins = spec_gen.find_peak_arrays(spectrogram)
+                timings.append(time.perf_counter())
+                hashes, times = fingerprint_generator.generate_hash_arrays(
+                    freq_bins, time_bins
+                )
+                timings.append(time.perf_counter())
+                postings = matcher.lookup(hashes)
+                timings.append(time.perf_counter())
+                ranked = matcher.rank(hashes, times, postings, min_matches)
+                timings.append(time.perf_counter())
+                matches = matcher.resolve(ranked, top_n=1)
+
+                for stage, begin, end in zip(ACCURACY_STAGES, timings, timings[1:]):
+                    stage_seconds[stage].append(end - begin)
+                stage_seconds["total"].append(timings[-1] - timings[0])
+                query_hashes += len(hashes)
+
+                accepted = bool(matches) and matches[0][2] >= min_aligned
+                if song_id is None:
+                    negatives += 1
+                    false_positives += accepted
+                else:
+                    positives += 1
+                    if accepted and matches[0][0]["id"] == song_id:
+                        correct += 1
+                    elif accepted:
+                        wrong += 1
+
+            analysis_seconds = sum(
+                sum(stage_seconds[stage]) for stage in ("spectrogram", "peaks", "hashing")
+            )
+            results[name] = {
+                "queries": positives + negatives,
+                "recall_at_1": correct / max(1, positives),
+                "misidentified_rate": wrong / max(1, positives),
+                "false_positive_rate": false_positives / max(1, negatives),
+                "query_hashes_per_second": query_hashes / max(analysis_seconds, 1e-9),
+                "latency_ms": {
+                    stage: _percentiles(seconds) for stage, seconds in stage_seconds.items()
+                },
+            }
+        db.close()
+
+    return {
+        "params": {
+            "window_size": spec_gen.window_size,
+            "hop_size": spec_gen.hop_size,
+            "neighborhood_size": spec_gen.neighborhood_size,
+            "min_amplitude": spec_gen.min_amplitude,
+            "peak_prominence": spec_gen.peak_prominence,
+            "peaks_per_frame": spec_gen.peaks_per_frame,
+            "target_zone_length": fingerprint_generator.target_zone_length,
+        },
+        "setup": {
+            "songs_dir": songs_dir,
+            "clips_per_song": clips_per_song,
+            "clip_seconds": clip_seconds,
+            "min_aligned": min_aligned,
+            "min_matches": min_matches,
+            "snr_db": snr_db,
+            "gain_db": gain_db,
+            "band_hz": list(band_hz),
+            "time_shift_samples": shift,
+            "backend": backend,
+            "seed": seed,
+        },
+        "catalog": catalog,
+        "distortions": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TuneTrace benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query = commands.add_parser("query", help="fingerprint lookup latency")
+    query.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    query.add_argument("--query-size", type=int, default=500)
+    query.add_argument("--shards", type=int, default=1)
+
+    ingest = commands.add_parser("ingest", help="batch_add_songs throughput")
+    ingest.add_argument("--songs-dir", default="Songs")
+    ingest.add_argument(
+        "--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1]
+    )
+
+    peaks = commands.add_parser("peaks", help="peak picking speed and accuracy")
+    peaks.add_argument("--songs-dir", default="Songs")
+    peaks.add_argument("--clips", type=int, default=3, help="clips per song")
+    peaks.add_argument("--clip-seconds", type=float, default=8.0)
+    peaks.add_argument("--snr", type=float, default=10.0, help="clip SNR in dB")
+
+    analysis = commands.add_parser(
+        "analysis", help="peak RSS and wall time of decode + spectrogram + peaks"
+    )
+    analysis.add_argument("--songs-dir", default="Songs")
+    analysis.add_argument("--files", type=int, default=3, help="longest N files")
+
+    identify = commands.add_parser("identify", help="identify_batch throughput")
+    identify.add_argument("--songs-dir", default="Songs")
+    identify.add_argument(
+        "--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1]
+    )
+    identify.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 16, 64])
+
+    stop_list = commands.add_parser(
+        "stoplist", help="savings from stop-listing common hashes"
+    )
+    stop_list.add_argument("--db", help="existing catalog (default: build from --songs-dir)")
+    stop_list.add_argument("--songs-dir", default="Songs")
+    stop_list.add_argument(
+        "--thresholds", type=int, nargs="+", default=[1000, 300, 100, 30, 10]
+    )
+    stop_list.add_argument("--clips", type=int, default=3, help="clips per song")
+
+    accuracy = commands.add_parser(
+        "accuracy", help="recall, false positives and latency under distortions (JSON)"
+    )
+    accuracy.add_argument("--songs-dir", default="Songs")
+    accuracy.add_argument("--window-size", type=int, default=4096)
+    accuracy.add_argument("--hop-size", type=int, default=1024)
+    accuracy.add_argument("--neighborhood-size", type=int, default=20)
+    accuracy.add_argument("--min-amplitude", type=float, default=-40.0)
+    accuracy.add_argument(
+        "--peak-prominence", type=float, help="dB a peak must stand above its surroundings"
+    )
+    accuracy.add_argument(
+        "--peaks-per-frame", type=int, help="keep only the loudest peaks of each frame"
+    )
+    accuracy.add_argument("--target-zone-length", type=int, default=5)
+    accuracy.add_argument("--clips", type=int, default=5, help="clips per song")
+    accuracy.add_argument("--clip-seconds", type=float, default=8.0)
+    accuracy.add_argument(
+        "--holdout", type=int, default=2, help="songs left out of the catalog"
+    )
+    accuracy.add_argument(
+        "--min-aligned", type=int, default=20, help="aligned hashes to accept a match"
+    )
+    accuracy.add_argument(
+        "--min-matches", type=int, default=5, help="matching hashes to rank a song"
+    )
+    accuracy.add_argument("--snr", type=float, default=5.0, help="noise SNR in dB")
+    accuracy.add_argument("--gain", type=float, default=12.0, help="gain in dB")
+    accuracy.add_argument(
+        "--band", type=float, nargs=2, default=[300.0, 3400.0], help="band-pass Hz"
+    )
+    accuracy.add_argument("--backend", choices=["sqlite", "memory"], default="sqlite")
+    accuracy.add_argument("--seed", type=int, default=0)
+    accuracy.add_argument("--out", help="also write the JSON report to this file")
+
+    args = parser.parse_args()
+    if args.command == "query":
+        bench_query(args.sizes, args.query_size, args.shards)
+    elif args.command == "ingest":
+        bench_ingest(args.songs_dir, args.workers)
+    elif args.command == "peaks":
+        bench_peaks(args.songs_dir, args.clips, args.clip_seconds, args.snr)
+    elif args.command == "analysis":
+        bench_analysis(args.songs_dir, args.files)
+    elif args.command == "identify":
+        bench_identify(args.songs_dir, args.workers, args.batch_sizes)
+    elif args.command == "stoplist":
+        bench_stop_list(args.songs_dir, args.thresholds, args.db, args.clips)
+    elif args.command == "accuracy":
+        report = bench_accuracy(
+            args.songs_dir,
+            {
+                "window_size": args.window_size,
+                "hop_size": args.hop_size,
+                "neighborhood_size": args.neighborhood_size,
+                "min_amplitude": args.min_amplitude,
+                "peak_prominence": args.peak_prominence,
+                "peaks_per_frame": args.peaks_per_frame,
+                "target_zone_length": args.target_zone_length,
+            },
+            args.clips,
+            args.clip_seconds,
+            args.holdout,
+            args.min_aligned,
+            args.min_matches,
+            args.snr,
+            args.gain,
+            tuple(args.band),
+            args.backend,
+            args.seed,
+        )
+        print(json.dumps(report, indent=2))
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
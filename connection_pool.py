@@ -0,0 +1,124 @@
+# connection_pool.py
+import sqlite3
+import threading
+import queue
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Callable, Iterator, List
+
+# Seconds a connection waits on a locked database before raising
+BUSY_TIMEOUT = 30.0
+
+
+def connect(path: str, incremental_vacuum: bool = False) -> sqlite3.Connection:
+    """Connection usable from any thread, in WAL mode so readers never block the writer.
+
+    incremental_vacuum only affects new files: it has to be set before the
+    journal mode switch writes the file header.
+    """
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=False)
+    if incremental_vacuum:
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("PRAGMA journal_mode = WAL")
+    return conn
+
+
+class ConnectionPool:
+    """Read connections to a set of SQLite files, lent to one thread at a time.
+
+    A checkout hands the calling thread its own connection to every file
+    in `paths`, so reads on different threads run in parallel under WAL.
+    At most `size` connection sets exist; further readers wait for one to
+    be returned. Nested checkouts on the same thread reuse its set.
+    """
+
+    def __init__(self, paths: List[str], size: int = 4):
+        if size < 1:
+            raise ValueError("pool size must be at least 1")
+        self.paths = paths
+        self.size = size
+        self._slots = threading.Semaphore(size)
+        self._idle = []
+        self._idle_lock = threading.Lock()
+        self._local = threading.local()
+        self._closed = False
+
+    @contextmanager
+    def connections(self) -> Iterator[List[sqlite3.Connection]]:
+        """Check out one connection per path for the duration of the block"""
+        held = getattr(self._local, "conns", None)
+        if held is not None:
+            yield held
+            return
+
+        if self._closed:
+            raise ValueError("Connection pool is closed")
+        with self._slots:
+            with self._idle_lock:
+                conns = self._idle.pop() if self._idle else None
+            if conns is None:
+                conns = [connect(path) for path in self.paths]
+
+            self._local.conns = conns
+            try:
+                yield conns
+            finally:
+                self._local.conns = None
+                # Never return a set that still pins an old read snapshot
+                for conn in conns:
+                    if conn.in_transaction:
+                        conn.rollback()
+                with self._idle_lock:
+                    if self._closed:
+                        for conn in conns:
+                            conn.close()
+                    else:
+                        self._idle.append(conns)
+
+    def close(self):
+        """Close the idle connections; sets still checked out are closed on return"""
+        self._closed = True
+        with self._idle_lock:
+            for conns in self._idle:
+                for conn in conns:
+                    conn.close()
+            self._idle.clear()
+
+
+class WriteQueue:
+    """Runs every write on one dedicated thread, in submission order.
+
+    SQLite allows a single writer per file, so funnelling all writes
+    through one thread serializes them without "database is locked"
+    errors, while pooled readers keep working against WAL snapshots.
+    """
+
+    def __init__(self, name: str = "sqlite-writer"):
+        self._tasks = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def run(self, func: Callable, *args):
+        """Run func(*args) on the writer thread and return its result"""
+        if threading.current_thread() is self._thread:
+            return func(*args)
+        future = Future()
+        self._tasks.put((future, func, args))
+        return future.result()
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            future, func, args = task
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def close(self):
+        """Finish queued writes and stop the writer thread"""
+        if self._thread.is_alive():
+            self._tasks.put(None)
+            self._thread.join()
@@ -1,62 +1,202 @@
-from typing import List, Tuple
-import hashlib
+from typing import List, Tuple, Iterable, Iterator, Optional
 import numpy as np
-from spectrogram_utils import SpectrogramGenerator
+from spectrogram_utils import (
+    SpectrogramGenerator,
+    StreamingSpectrogram,
+    StreamingPeakFinder,
+)
+
+# Hash format version 2 packs (anchor_freq, target_freq, time_delta) into one
+# integer: 16 bits each, anchor in bits 32-47, target in 16-31, delta in 0-15.
+# Version 1 was the 40-char SHA-1 hex digest of "anchor|target|delta".
+HASH_FORMAT_VERSION = 2
+HASH_FIELD_BITS = 16
+HASH_FIELD_MASK = (1 << HASH_FIELD_BITS) - 1
+
+
+def pack_hash(anchor_freq: int, target_freq: int, time_delta: int) -> int:
+    """Pack an anchor/target pair into a single integer hash"""
+    return (
+        (int(anchor_freq) & HASH_FIELD_MASK) << (2 * HASH_FIELD_BITS)
+        | (int(target_freq) & HASH_FIELD_MASK) << HASH_FIELD_BITS
+        | (int(time_delta) & HASH_FIELD_MASK)
+    )
+
+
+def unpack_hash(fingerprint_hash: int) -> Tuple[int, int, int]:
+    """Split an integer hash back into (anchor_freq, target_freq, time_delta)"""
+    return (
+        (fingerprint_hash >> (2 * HASH_FIELD_BITS)) & HASH_FIELD_MASK,
+        (fingerprint_hash >> HASH_FIELD_BITS) & HASH_FIELD_MASK,
+        fingerprint_hash & HASH_FIELD_MASK,
+    )
+
+
+class StreamingHasher:
+    """Incremental generate_hash_arrays over peaks arriving in time order.
+
+    An anchor is hashed once its whole target zone has arrived; the peaks
+    that later anchors may still pair with are carried over.
+    """
+
+    def __init__(self, generator: "FingerprintGenerator"):
+        self.generator = generator
+        self.freqs = np.empty(0, dtype=np.int64)
+        self.times = np.empty(0, dtype=np.int64)
+
+    def push(
+        self, freq_bins: np.ndarray, time_bins: np.ndarray, final: bool = False
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Add peaks later than all earlier ones; returns the hashes now complete"""
+        order = np.argsort(time_bins, kind="stable")
+        self.freqs = np.concatenate(
+            (self.freqs, np.asarray(freq_bins, dtype=np.int64)[order])
+        )
+        self.times = np.concatenate(
+            (self.times, np.asarray(time_bins, dtype=np.int64)[order])
+        )
+
+        reach = self.generator.target_zone_start + self.generator.target_zone_length - 1
+        num_anchors = len(self.times) if final else max(0, len(self.times) - reach)
+        hashes, offsets = self.generator._hash_sorted_peaks(
+            self.freqs, self.times, num_anchors
+        )
+
+        self.freqs = self.freqs[num_anchors:]
+        self.times = self.times[num_anchors:]
+        return hashes, offsets
+
+    def flush(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Hash the remaining anchors at end of stream"""
+        return self.push(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), final=True)
 
 
 class FingerprintGenerator:
     """Generates audio fingerprints from constellation points"""
 
-    def __init__(self, target_zone_length: int = 5, target_zone_start: int = 1):
+    def __init__(
+        self,
+        target_zone_length: int = 5,
+        target_zone_start: int = 1,
+        spectrogram_generator: Optional[SpectrogramGenerator] = None,
+    ):
         self.target_zone_length = target_zone_length
         self.target_zone_start = target_zone_start
-
-    def generate_hashes(self, peaks: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
-        """Generate fingerprint hashes from constellation points"""
-        hashes = []
+        self.spectrogram_generator = spectrogram_generator or SpectrogramGenerator()
+
+    def generate_hash_arrays(
+        self, freq_bins: np.ndarray, time_bins: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Vectorized hashing of peak arrays into parallel (hashes, offsets) arrays.
+
+        Peaks are stably sorted by time, and each anchor is paired with the
+        peaks at positions [i + target_zone_start, i + target_zone_start +
+        target_zone_length); pairs with time_delta <= 0 are skipped. Output is
+        ordered by anchor, then target, like the original per-pair loop.
+        """
+        freq_bins = np.asarray(freq_bins, dtype=np.int64)
+        time_bins = np.asarray(time_bins, dtype=np.int64)
+        num_peaks = len(time_bins)
+        if num_peaks == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
 
         # Sort peaks by time
-        peaks = sorted(peaks, key=lambda x: x[1])
-
-        for i, anchor_peak in enumerate(peaks):
-            anchor_freq, anchor_time = anchor_peak
-
-            # Look for target peaks in the target zone
-            for j in range(
-                i + self.target_zone_start,
-                min(i + self.target_zone_start + self.target_zone_length, len(peaks)),
-            ):
-                target_freq, target_time = peaks[j]
-
-                # Calculate time difference
-                time_delta = target_time - anchor_time
+        order = np.argsort(time_bins, kind="stable")
+        return self._hash_sorted_peaks(freq_bins[order], time_bins[order], num_peaks)
+
+    def _hash_sorted_peaks(
+        self, freqs: np.ndarray, times: np.ndarray, num_anchors: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Hash the first num_anchors of time-sorted peaks against their target zones"""
+        # One row per anchor, one column per target zone slot
+        anchors = np.arange(num_anchors)[:, None]
+        zone = np.arange(
+            self.target_zone_start, self.target_zone_start + self.target_zone_length
+        )
+        targets = anchors + zone[None, :]
+        valid = targets < len(times)
+        targets = np.where(valid, targets, 0)
 
-                if time_delta <= 0:
-                    continue
+        time_deltas = times[targets] - times[anchors]
+        valid &= time_deltas > 0
 
-                # Create hash from frequency pair and time delta
-                hash_input = f"{anchor_freq}|{target_freq}|{time_delta}"
-                fingerprint_hash = hashlib.sha1(hash_input.encode()).hexdigest()
+        anchor_idx = np.broadcast_to(anchors, targets.shape)[valid]
+        target_idx = targets[valid]
 
-                # Store hash with anchor time offset
-                hashes.append((fingerprint_hash, anchor_time))
+        hashes = (
+            (freqs[anchor_idx] & HASH_FIELD_MASK) << (2 * HASH_FIELD_BITS)
+            | (freqs[target_idx] & HASH_FIELD_MASK) << HASH_FIELD_BITS
+            | (time_deltas[valid] & HASH_FIELD_MASK)
+        )
+        return hashes, times[anchor_idx]
 
-        return hashes
+    def generate_hashes(self, peaks: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+        """Generate fingerprint hashes from constellation points"""
+        if not peaks:
+            return []
+        freq_bins, time_bins = zip(*peaks)
+        hashes, offsets = self.generate_hash_arrays(freq_bins, time_bins)
+        return list(zip(hashes.tolist(), offsets.tolist()))
 
-    def generate_fingerprint(
+    def generate_fingerprint_arrays(
         self, audio_data: np.ndarray, sample_rate: int
-    ) -> List[Tuple[str, int]]:
-        """Complete fingerprint generation pipeline"""
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Fingerprint pipeline returning parallel (hashes, offsets) arrays"""
         # Generate spectrogram
-        spec_gen = SpectrogramGenerator()
+        spec_gen = self.spectrogram_generator
         frequencies, times, spectrogram = spec_gen.generate_spectrogram(
             audio_data, sample_rate
         )
 
         # Find peaks
-        peaks = spec_gen.find_peaks(spectrogram)
+        freq_bins, time_bins = spec_gen.find_peak_arrays(spectrogram)
 
         # Generate hashes
-        hashes = self.generate_hashes(peaks)
+        return self.generate_hash_arrays(freq_bins, time_bins)
+
+    def fingerprint_file(
+        self, file_path: str, use_cache: bool = True
+    ) -> Tuple[np.ndarray, np.ndarray, float]:
+        """Fingerprint a file from its (cached) peaks; returns (hashes, offsets, duration)"""
+        freq_bins, time_bins, duration = self.spectrogram_generator.file_peaks(
+            file_path, use_cache
+        )
+        hashes, offsets = self.generate_hash_arrays(freq_bins, time_bins)
+        return hashes, offsets, duration
+
+    def stream_fingerprint(
+        self, audio_blocks: Iterable[np.ndarray], sample_rate: int
+    ) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Streaming pipeline yielding (hashes, offsets) arrays block by block.
+
+        Memory stays bounded by the block size, and the concatenated output
+        equals generate_fingerprint_arrays on the concatenated audio.
+        """
+        spec_gen = self.spectrogram_generator
+        spectrogram = StreamingSpectrogram(spec_gen, sample_rate)
+        peak_finder = StreamingPeakFinder(spec_gen)
+        hasher = StreamingHasher(self)
+
+        for block in audio_blocks:
+            columns = spectrogram.push(block)
+            if columns.shape[1] == 0:
+                continue
+            hashes, offsets = hasher.push(*peak_finder.push(columns))
+            if len(hashes):
+                yield hashes, offsets
+
+        # Audio shorter than one window only produces its frame now
+        hashes, offsets = hasher.push(*peak_finder.push(spectrogram.flush()))
+        if len(hashes):
+            yield hashes, offsets
+
+        hashes, offsets = hasher.push(*peak_finder.flush(), final=True)
+        if len(hashes):
+            yield hashes, offsets
 
-        return hashes
+    def generate_fingerprint(
+        self, audio_data: np.ndarray, sample_rate: int
+    ) -> List[Tuple[int, int]]:
+        """Complete fingerprint generation pipeline"""
+        hashes, offsets = self.generate_fingerprint_arrays(audio_data, sample_rate)
+        return list(zip(hashes.tolist(), offsets.tolist()))
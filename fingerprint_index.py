@@ -0,0 +1,297 @@
+import argparse
+import os
+import struct
+from typing import List, Tuple, Dict, Optional
+from collections import defaultdict
+import numpy as np
+from audio_database import AudioDatabase, SCHEMA_VERSION
+
+# On-disk index layout (little endian):
+#   header: magic (8s), schema version (I), tombstone watermark (I), num_keys (Q), num_postings (Q)
+#   keys:         int64[num_keys]
+#   starts:       int64[num_keys + 1]
+#   song_ids:     int32[num_postings]
+#   time_offsets: int32[num_postings]
+INDEX_MAGIC = b"TTFPIDX\0"
+INDEX_HEADER = struct.Struct("<8sIIQQ")
+
+
+def expand_ranges(begins: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenate np.arange(b, e) for every (b, e) pair without a Python loop"""
+    lengths = ends - begins
+    total = int(lengths.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    # Offset of each range's first element within the output
+    range_starts = np.cumsum(lengths) - lengths
+    return np.repeat(begins - range_starts, lengths) + np.arange(total)
+
+
+class InMemoryFingerprintIndex:
+    """Read-only inverted index over the whole fingerprint catalog.
+
+    Postings are stored CSR-style: `keys` holds the sorted unique hashes and
+    the postings of keys[i] are song_ids/time_offsets[starts[i]:starts[i + 1]].
+    Exposes the same query_fingerprints/get_song_by_id interface as
+    AudioDatabase, so it can be handed to AudioMatcher directly.
+
+    `tombstone_watermark` is the newest database tombstone the snapshot
+    already reflects. Songs removed or re-fingerprinted later are passed
+    to remove_songs(), and their postings are filtered out of lookups.
+    Like AudioDatabase, lookups skip hashes with more than `max_postings`
+    postings, read straight off `starts`. When the snapshot is taken these
+    equal the database's hash_stats counts (stop-listed hashes have no
+    postings in either), but postings of songs removed or re-fingerprinted
+    later keep counting here until the index is rebuilt.
+    """
+
+    def __init__(
+        self,
+        keys: np.ndarray,
+        starts: np.ndarray,
+        song_ids: np.ndarray,
+        time_offsets: np.ndarray,
+        songs: Dict[int, Dict],
+        tombstone_watermark: int = 0,
+        max_postings: Optional[int] = None,
+    ):
+        self.keys = keys
+        self.starts = starts
+        self.song_ids = song_ids
+        self.time_offsets = time_offsets
+        self.songs = songs
+        self.tombstone_watermark = tombstone_watermark
+        self.tombstones = np.empty(0, dtype=np.int64)
+        self.max_postings = max_postings
+
+    @classmethod
+    def from_database(cls, database: AudioDatabase) -> "InMemoryFingerprintIndex":
+        """Load every fingerprint and song from the database once"""
+        # Read first: removals racing the load are then filtered, never missed
+        tombstone_watermark = database.tombstone_watermark()
+        hashes, song_ids, time_offsets = [], [], []
+        for rows in database.iter_fingerprints():
+            batch_hashes, batch_songs, batch_offsets = zip(*rows)
+            hashes.append(np.array(batch_hashes, dtype=np.int64))
+            song_ids.append(np.array(batch_songs, dtype=np.int32))
+            time_offsets.append(np.array(batch_offsets, dtype=np.int32))
+
+        if hashes:
+            hashes = np.concatenate(hashes)
+            song_ids = np.concatenate(song_ids)
+            time_offsets = np.concatenate(time_offsets)
+        else:
+            hashes = np.empty(0, dtype=np.int64)
+            song_ids = np.empty(0, dtype=np.int32)
+            time_offsets = np.empty(0, dtype=np.int32)
+
+        # Rows arrive sorted by hash, so each key's postings are contiguous
+        keys, first_rows = np.unique(hashes, return_index=True)
+        starts = np.append(first_rows, len(hashes)).astype(np.int64)
+
+        songs = {}
+        for song_id, title, artist, genre, file_path, duration, _ in database.get_all_songs():
+            songs[song_id] = {
+                "id": song_id,
+                "title": title,
+                "artist": artist,
+                "file_path": file_path,
+                "duration": duration,
+            }
+
+        return cls(
+            keys,
+            starts,
+            song_ids,
+            time_offsets,
+            songs,
+            tombstone_watermark,
+            database.max_postings,
+        )
+
+    def __len__(self) -> int:
+        return len(self.song_ids)
+
+    def remove_songs(self, song_ids: List[int]):
+        """Hide songs whose postings in this snapshot are outdated"""
+        self.tombstones = np.union1d(self.tombstones, np.asarray(song_ids, dtype=np.int64))
+        for song_id in song_ids:
+            self.songs.pop(int(song_id), None)
+
+    def lookup(self, query_hashes) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Matching unique hashes and their posting ranges [begins, ends)"""
+        if len(self.keys) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+
+        query = np.unique(np.asarray(query_hashes, dtype=np.int64))
+        positions = np.searchsorted(self.keys, query)
+        positions = np.minimum(positions, len(self.keys) - 1)
+        found = self.keys[positions] == query
+        if self.max_postings is not None:
+            counts = self.starts[positions + 1] - self.starts[positions]
+            found &= counts <= self.max_postings
+        positions = positions[found]
+        return query[found], self.starts[positions], self.starts[positions + 1]
+
+    def query_postings(
+        self, query_hashes: List[int]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Matching fingerprints as parallel (hashes, song_ids, time_offsets) arrays"""
+        matched, begins, ends = self.lookup(query_hashes)
+        rows = expand_ranges(begins, ends)
+        hashes = np.repeat(matched, ends - begins)
+        song_ids = self.song_ids[rows].astype(np.int64)
+        time_offsets = self.time_offsets[rows].astype(np.int64)
+        if len(self.tombstones):
+            live = ~np.isin(song_ids, self.tombstones)
+            hashes, song_ids, time_offsets = hashes[live], song_ids[live], time_offsets[live]
+        return hashes, song_ids, time_offsets
+
+    def query_fingerprints(
+        self, query_hashes: List[int]
+    ) -> Dict[int, List[Tuple[int, int]]]:
+        """Query the index for matching fingerprints"""
+        if len(query_hashes) == 0:
+            return {}
+
+        posting_hashes, song_ids, time_offsets = self.query_postings(query_hashes)
+
+        # Group results by song_id
+        matches = defaultdict(list)
+        for song_id, hash_val, time_offset in zip(
+            song_ids.tolist(), posting_hashes.tolist(), time_offsets.tolist()
+        ):
+            matches[song_id].append((hash_val, time_offset))
+
+        return dict(matches)
+
+    def get_song_by_id(self, song_id: int) -> Dict:
+        """Get song information by song ID"""
+        return self.songs.get(song_id)
+
+    def get_songs_by_ids(self, song_ids: List[int]) -> Dict[int, Dict]:
+        """Get song information for many song IDs"""
+        return {
+            int(i): self.songs[int(i)] for i in song_ids if int(i) in self.songs
+        }
+
+    def save(self, path: str):
+        """Write the postings as a flat binary index file.
+
+        The file is written next to `path` and renamed into place, so readers
+        that still map the previous version keep a consistent view.
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(
+                INDEX_HEADER.pack(
+                    INDEX_MAGIC,
+                    SCHEMA_VERSION,
+                    self.tombstone_watermark,
+                    len(self.keys),
+                    len(self.song_ids),
+                )
+            )
+            self.keys.astype("<i8").tofile(f)
+            self.starts.astype("<i8").tofile(f)
+            self.song_ids.astype("<i4").tofile(f)
+            self.time_offsets.astype("<i4").tofile(f)
+        os.replace(tmp_path, path)
+
+
+class MappedFingerprintIndex(InMemoryFingerprintIndex):
+    """Fingerprint index backed by a memory-mapped file written by save().
+
+    Opening only maps the file, so startup cost does not grow with the
+    catalog, and every process mapping the same file shares one page-cache
+    copy. Song metadata is read from the database, which stays the source
+    of truth for ingestion, and so are songs tombstoned after the file was
+    built.
+    """
+
+    def __init__(self, path: str, database: AudioDatabase):
+        with open(path, "rb") as f:
+            header = f.read(INDEX_HEADER.size)
+        if len(header) < INDEX_HEADER.size:
+            raise ValueError(f"Index file {path} is truncated")
+
+        magic, version, tombstone_watermark, num_keys, num_postings = INDEX_HEADER.unpack(
+            header
+        )
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{path} is not a fingerprint index file")
+        if version != SCHEMA_VERSION:
+            raise ValueError(
+                f"Index file {path} has schema version {version}, "
+                f"expected {SCHEMA_VERSION}; rebuild it"
+            )
+
+        offset = INDEX_HEADER.size
+        arrays = []
+        for dtype, count in (
+            ("<i8", num_keys),
+            ("<i8", num_keys + 1),
+            ("<i4", num_postings),
+            ("<i4", num_postings),
+        ):
+            if count:
+                arrays.append(
+                    np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(count,))
+                )
+            else:
+                arrays.append(np.empty(0, dtype=dtype))
+            offset += np.dtype(dtype).itemsize * count
+
+        keys, starts, song_ids, time_offsets = arrays
+        super().__init__(
+            keys,
+            starts,
+            song_ids,
+            time_offsets,
+            {},
+            tombstone_watermark,
+            database.max_postings,
+        )
+        self.path = path
+        self.database = database
+        self.remove_songs(database.get_tombstoned_songs(after=tombstone_watermark))
+
+    def get_song_by_id(self, song_id: int) -> Dict:
+        """Get song information by song ID"""
+        return self.database.get_song_by_id(song_id)
+
+    def get_songs_by_ids(self, song_ids: List[int]) -> Dict[int, Dict]:
+        """Get song information for many song IDs"""
+        return self.database.get_songs_by_ids(song_ids)
+
+
+def build_index_file(database: AudioDatabase, path: str) -> int:
+    """Rebuild the on-disk index from the database; returns the posting count"""
+    index = InMemoryFingerprintIndex.from_database(database)
+    index.save(path)
+    return len(index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fingerprint index tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser(
+        "build", help="rebuild/compact the memory-mapped index from SQLite"
+    )
+    build.add_argument("--db", default="songs.db")
+    build.add_argument("--out", default="songs.idx")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        database = AudioDatabase(args.db)
+        try:
+            count = build_index_file(database, args.out)
+        finally:
+            database.close()
+        print(f"Wrote {count} postings to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
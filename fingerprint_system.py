@@ -3,86 +3,499 @@ import sounddevice as sd
 import numpy as np
 import sqlite3
 import os
-from typing import List, Tuple, Dict, Optional
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import List, Tuple, Dict, Optional, Iterator
 from audio_processor import AudioProcessor
 from fingerPrintGenerator import FingerprintGenerator
-from audioMatcher import AudioMatcher
+from spectrogram_utils import SpectrogramGenerator
+from analysis_cache import AnalysisCache, file_sha256
+from audioMatcher import AudioMatcher, IncrementalMatcher, RecordingMonitor
 from audio_database import AudioDatabase
+from fingerprint_index import (
+    InMemoryFingerprintIndex,
+    MappedFingerprintIndex,
+    build_index_file,
+)
+
+# iter_batch_add uses a bulk load when the batch has at least this many
+# songs per song already stored; rebuilding the fingerprint indexes costs
+# time proportional to the whole catalog, so small batches keep them
+BULK_LOAD_FRACTION = 0.5
+
+
+def stream_fingerprint_file(
+    audio_processor: AudioProcessor,
+    fingerprint_generator: FingerprintGenerator,
+    file_path: str,
+    block_duration: float = 10.0,
+    max_val: Optional[float] = None,
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """Fingerprint a file of any length in constant memory.
+
+    A first streaming pass finds the peak amplitude so blocks can be
+    normalized exactly like normalize_audio does for the whole file; the
+    yielded (hashes, offsets) chunks concatenate to
+    FingerprintGenerator.fingerprint_file's output. Pass `max_val` if the
+    file has already been scanned.
+    """
+    if max_val is None:
+        max_val, _ = audio_processor.scan_audio(file_path)
+    blocks = audio_processor.stream_audio(file_path, block_duration)
+    if max_val > 0:
+        blocks = (block / max_val for block in blocks)
+    yield from fingerprint_generator.stream_fingerprint(
+        blocks, audio_processor.sample_rate
+    )
+
+
+def try_fingerprint_file(
+    fingerprint_generator: FingerprintGenerator, file_path: str
+) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """(hashes, offsets) of a query file, or None if it cannot be fingerprinted.
+
+    Query files are usually one-off clips, so they bypass the analysis cache.
+    """
+    try:
+        hashes, offsets, _ = fingerprint_generator.fingerprint_file(
+            file_path, use_cache=False
+        )
+        return hashes, offsets
+    except Exception as e:
+        print(f"Error fingerprinting {file_path}: {e}")
+        return None
+
+
+# Per-process generator used by parallel ingestion and query workers
+_worker_generator = None
+
+
+def _init_fingerprint_worker(cache: Optional[AnalysisCache] = None):
+    global _worker_generator
+    _worker_generator = FingerprintGenerator(
+        spectrogram_generator=SpectrogramGenerator(cache=cache)
+    )
+
+
+def _ingest_worker(file_path: str) -> Tuple[np.ndarray, np.ndarray, float]:
+    return _worker_generator.fingerprint_file(file_path)
+
+
+def _query_worker(file_path: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    return try_fingerprint_file(_worker_generator, file_path)
+
+
+def _bounded_map(
+    executor: ProcessPoolExecutor, fn, items: List, max_pending: int
+) -> Iterator:
+    """executor.map that keeps at most `max_pending` items submitted ahead"""
+    in_flight = deque()
+    for item in items:
+        in_flight.append(executor.submit(fn, item))
+        if len(in_flight) >= max_pending:
+            yield in_flight.popleft().result()
+    while in_flight:
+        yield in_flight.popleft().result()
 
 
 class FingerprintSystem:
     """Main system class that orchestrates all components"""
 
-    def __init__(self, db_name: str = "songs.db"):
-        self.audio_processor = AudioProcessor()
-        self.fingerprint_generator = FingerprintGenerator()
-        self.database = AudioDatabase(db_name)
+    def __init__(
+        self,
+        db_name: str = "songs.db",
+        index_path: Optional[str] = None,
+        cache: Optional[AnalysisCache] = None,
+        num_shards: Optional[int] = None,
+        pool_size: int = 4,
+        max_postings: Optional[int] = None,
+    ):
+        # An AnalysisCache lets every component reuse decodes and analyses
+        self.cache = cache
+        self.audio_processor = AudioProcessor(cache=cache)
+        self.fingerprint_generator = FingerprintGenerator(
+            spectrogram_generator=SpectrogramGenerator(cache=cache)
+        )
+        # Lookups skip hashes with more than max_postings postings
+        self.database = AudioDatabase(
+            db_name,
+            num_shards=num_shards,
+            pool_size=pool_size,
+            max_postings=max_postings,
+        )
         self.matcher = AudioMatcher(self.database)
 
+        # Identify from a memory-mapped index while ingestion keeps writing to SQLite
+        self.index_path = index_path
+        if index_path and os.path.exists(index_path):
+            self.matcher = AudioMatcher(MappedFingerprintIndex(index_path, self.database))
+
+    def use_memory_index(self) -> InMemoryFingerprintIndex:
+        """Serve identify_audio from an in-memory snapshot of the catalog.
+
+        Songs added afterwards are not visible until this is called again.
+        """
+        index = InMemoryFingerprintIndex.from_database(self.database)
+        self.matcher = AudioMatcher(index)
+        return index
+
+    def remove_song(self, song_id: int) -> bool:
+        """Remove a song and its fingerprints from the catalog.
+
+        A fingerprint index serving identify_audio hides the song at once;
+        indexes in other processes skip it through its tombstone (mapped
+        files) or once they are reloaded (in-memory snapshots).
+        """
+        removed = self.database.remove_song(song_id)
+        if removed:
+            self._hide_in_index([song_id])
+        else:
+            print(f"No song with id {song_id}")
+        return removed
+
+    def refingerprint_song(self, song_id: int, file_path: Optional[str] = None) -> bool:
+        """Fingerprint a stored song again and replace its postings in place.
+
+        Uses `file_path` if given (and records it), otherwise the song's
+        stored file, e.g. after fixing that file or changing analysis
+        parameters. The song keeps its id and metadata. An index serving
+        identify_audio stops returning the song until it is rebuilt with
+        rebuild_index() or use_memory_index().
+        """
+        song_info = self.database.get_song_by_id(song_id)
+        if not song_info:
+            print(f"No song with id {song_id}")
+            return False
+
+        source = file_path or song_info["file_path"]
+        try:
+            hashes, offsets, duration = self.fingerprint_generator.fingerprint_file(
+                source
+            )
+        except Exception as e:
+            print(f"Could not re-fingerprint '{song_info['title']}': {e}")
+            return False
+        if len(hashes) == 0:
+            print(f"Warning: No fingerprints generated for {song_info['title']}")
+            return False
+
+        self.database.replace_fingerprints(
+            song_id,
+            zip(hashes.tolist(), offsets.tolist()),
+            duration,
+            self._content_hash(source),
+            file_path,
+        )
+        self._hide_in_index([song_id])
+        print(f"Re-fingerprinted '{song_info['title']}' with {len(hashes)} fingerprints")
+        return True
+
+    def _hide_in_index(self, song_ids: List[int]):
+        index = self.matcher.database
+        if isinstance(index, InMemoryFingerprintIndex):
+            index.remove_songs(song_ids)
+
+    def prune_common_hashes(self, max_postings: int) -> int:
+        """Stop-list hashes with more than `max_postings` postings.
+
+        Deletes their postings from the database (see
+        AudioDatabase.prune_common_hashes), so later lookups no longer
+        fetch and vote on them, and rebuilds the index file if one is
+        configured. An in-memory index skips the same hashes from now on.
+        Returns the number of postings deleted.
+        """
+        deleted = self.database.prune_common_hashes(max_postings)
+        print(f"Pruned {deleted} postings of hashes with more than {max_postings}")
+        if self.index_path:
+            self.rebuild_index()
+        elif isinstance(self.matcher.database, InMemoryFingerprintIndex):
+            index = self.matcher.database
+            index.max_postings = min(index.max_postings or max_postings, max_postings)
+        return deleted
+
+    def compact(self) -> int:
+        """Reclaim the space of removed and re-fingerprinted songs.
+
+        Rebuilds the memory-mapped index (if one is configured), drops the
+        tombstones it now reflects and vacuums the database; returns the
+        bytes reclaimed from the database files. Identification keeps
+        running meanwhile: reads are served from WAL snapshots while the
+        writer vacuums in small steps, and the index file is replaced
+        atomically.
+        """
+        if self.index_path:
+            self.rebuild_index()
+            self.database.prune_tombstones(self.matcher.database.tombstone_watermark)
+        reclaimed = self.database.compact()
+        print(f"Compaction reclaimed {reclaimed / 2**20:.1f} MiB")
+        return reclaimed
+
+    def compact_in_background(self) -> threading.Thread:
+        """Run compact() on a daemon thread and return the thread"""
+        thread = threading.Thread(target=self.compact, name="compaction", daemon=True)
+        thread.start()
+        return thread
+
+    def rebuild_index(self, index_path: Optional[str] = None) -> int:
+        """Rebuild the memory-mapped index from SQLite and start using it"""
+        index_path = index_path or self.index_path
+        if not index_path:
+            raise ValueError("No index_path configured")
+
+        count = build_index_file(self.database, index_path)
+        self.index_path = index_path
+        self.matcher = AudioMatcher(MappedFingerprintIndex(index_path, self.database))
+        print(f"Rebuilt index {index_path} with {count} fingerprints")
+        return count
+
     def add_song_to_database(
-        self, file_path: str, title: str, artist: str = None, genre: str = "Unknown"
+        self,
+        file_path: str,
+        title: str,
+        artist: str = None,
+        genre: str = "Unknown",
+        streaming: bool = False,
     ) -> bool:
-        """Add a song to the fingerprint database"""
+        """Add a song to the fingerprint database; True only if it was added.
+
+        See ingest_song, which also reports why a song was skipped.
+        """
+        status = self.ingest_song(file_path, title, artist, genre, streaming)
+        return status["status"] == "added"
+
+    def ingest_song(
+        self,
+        file_path: str,
+        title: str,
+        artist: str = None,
+        genre: str = "Unknown",
+        streaming: bool = False,
+        allow_near_duplicates: bool = False,
+        content_hash: Optional[str] = None,
+    ) -> Dict:
+        """Add a song to the fingerprint database unless it is already there.
+
+        A file whose contents are already stored is skipped without being
+        decoded. Before the whole file is fingerprinted, a few sampled
+        excerpts are matched against the catalog to catch other copies of
+        the same recording, such as re-encodes (see find_near_duplicate).
+        With streaming=True the file is decoded and fingerprinted block by
+        block, for recordings too long to hold in memory. Pass the file's
+        SHA-256 as `content_hash` if it is already known.
+
+        Returns a dict whose "status" is one of:
+            "added":          stored with id "song_id"
+            "duplicate":      identical contents are stored as "duplicate_of"
+            "near_duplicate": excerpts match "duplicate_of" with mean
+                              confidence "similarity"; only added when
+                              allow_near_duplicates is set
+            "failed":         nothing stored; "error" says why
+        """
         try:
             print(f"Processing: {title} by {artist or 'Unknown Artist'}")
 
-            # Load and process audio
-            audio_data, sample_rate = self.audio_processor.load_audio(file_path)
-            audio_data = self.audio_processor.normalize_audio(audio_data)
+            if content_hash is None:
+                content_hash = self._content_hash(file_path)
+            existing = self.database.find_song_by_content_hash(content_hash)
+            if existing:
+                print(f"Skipping {title}: same file as '{existing['title']}'")
+                return {"status": "duplicate", "duplicate_of": existing}
 
-            # Generate fingerprints
-            fingerprints = self.fingerprint_generator.generate_fingerprint(
-                audio_data, sample_rate
-            )
+            if not allow_near_duplicates:
+                near_duplicate = self.find_near_duplicate(file_path)
+                if near_duplicate:
+                    song_info, similarity = near_duplicate
+                    print(f"Skipping {title}: same recording as '{song_info['title']}'")
+                    return {
+                        "status": "near_duplicate",
+                        "duplicate_of": song_info,
+                        "similarity": similarity,
+                    }
 
-            if not fingerprints:
-                print(f"Warning: No fingerprints generated for {title}")
-                return False
-
-            # Add to database
-            duration = len(audio_data) / sample_rate
-            song_id = self.database.add_song(title, artist, genre, file_path, duration)
-            if song_id:
-                self.database.add_fingerprints(song_id, fingerprints)
-                print(f"Added {len(fingerprints)} fingerprints for '{title}'")
-                return True
+            if streaming:
+                song_id = self._stream_song(file_path, title, artist, genre, content_hash)
             else:
-                print(f"Failed to add song '{title}' to the database.")
-                return False
+                # Load, process and fingerprint audio
+                hashes, offsets, duration = self.fingerprint_generator.fingerprint_file(
+                    file_path
+                )
+                song_id = self._store_song(
+                    file_path, title, artist, genre, hashes, offsets, duration, content_hash
+                )
 
         except Exception as e:
             print(f"Error processing {title}: {e}")
-            return False
+            return {"status": "failed", "error": str(e)}
+
+        if song_id is None:
+            return {"status": "failed", "error": "No fingerprints could be generated"}
+        return {"status": "added", "song_id": song_id}
+
+    def find_near_duplicate(
+        self,
+        file_path: str,
+        excerpts: int = 3,
+        excerpt_duration: float = 5.0,
+        min_aligned: int = 20,
+        min_confidence: float = 0.1,
+    ) -> Optional[Tuple[Dict, float]]:
+        """Catalog song matched by most sampled excerpts of a file, if any.
+
+        Only the excerpts are decoded and fingerprinted, and they are looked
+        up together in one match_batch call. An excerpt matches when its top
+        song has at least `min_aligned` aligned hashes and `min_confidence`.
+        Returns (song_info, mean confidence of the matching excerpts).
+        """
+        sample_rate = self.audio_processor.sample_rate
+        queries = []
+        for excerpt in self.audio_processor.load_excerpts(
+            file_path, excerpts, excerpt_duration
+        ):
+            excerpt = self.audio_processor.normalize_audio(excerpt, in_place=True)
+            queries.append(
+                self.fingerprint_generator.generate_fingerprint_arrays(excerpt, sample_rate)
+            )
+
+        hits = defaultdict(list)
+        for matches in self.matcher.match_batch(queries, top_n=1):
+            if matches:
+                song_info, confidence, aligned_count = matches[0]
+                if aligned_count >= min_aligned and confidence >= min_confidence:
+                    hits[song_info["id"]].append((song_info, confidence))
+
+        for song_hits in hits.values():
+            if 2 * len(song_hits) > len(queries):
+                return song_hits[0][0], float(np.mean([c for _, c in song_hits]))
+        return None
+
+    def _content_hash(self, file_path: str) -> str:
+        if self.cache is not None:
+            return self.cache.file_hash(file_path)
+        return file_sha256(file_path)
+
+    def _stream_song(
+        self,
+        file_path: str,
+        title: str,
+        artist: str,
+        genre: str,
+        content_hash: Optional[str] = None,
+    ) -> Optional[int]:
+        """Write fingerprints to the database as the streaming pipeline yields them"""
+        max_val, duration = self.audio_processor.scan_audio(file_path)
+
+        song_id = None
+        total = 0
+        try:
+            for hashes, offsets in stream_fingerprint_file(
+                self.audio_processor,
+                self.fingerprint_generator,
+                file_path,
+                max_val=max_val,
+            ):
+                # Only create the song once there is something to store
+                if song_id is None:
+                    song_id = self.database.add_song(
+                        title, artist, genre, file_path, duration, content_hash
+                    )
+                    if not song_id:
+                        print(f"Failed to add song '{title}' to the database.")
+                        return None
+                self.database.add_fingerprints(
+                    song_id, zip(hashes.tolist(), offsets.tolist())
+                )
+                total += len(hashes)
+        except BaseException:
+            # A half-stored song would match with wrong scores and block a
+            # retry through the content hash check
+            if song_id is not None:
+                self.database.remove_song(song_id)
+            raise
+
+        if song_id is None:
+            print(f"Warning: No fingerprints generated for {title}")
+            return None
+
+        print(f"Added {total} fingerprints for '{title}'")
+        return song_id
+
+    def _store_song(
+        self,
+        file_path: str,
+        title: str,
+        artist: str,
+        genre: str,
+        hashes: np.ndarray,
+        offsets: np.ndarray,
+        duration: float,
+        content_hash: Optional[str] = None,
+    ) -> Optional[int]:
+        """Write a fingerprinted song to the database; returns its id"""
+        if len(hashes) == 0:
+            print(f"Warning: No fingerprints generated for {title}")
+            return None
+
+        # Add to database
+        song_id = self.database.add_song(
+            title, artist, genre, file_path, duration, content_hash
+        )
+        if song_id:
+            self.database.add_fingerprints(
+                song_id, zip(hashes.tolist(), offsets.tolist())
+            )
+            print(f"Added {len(hashes)} fingerprints for '{title}'")
+            return song_id
+        else:
+            print(f"Failed to add song '{title}' to the database.")
+            return None
 
     def identify_audio(
         self,
         file_path: str = None,
         audio_data: np.ndarray = None,
         sample_rate: int = None,
+        top_n: Optional[int] = None,
+        early_exit: bool = False,
     ) -> List[Tuple[Dict, float, int]]:
-        """Identify audio from file or audio data"""
+        """Identify audio from file or audio data.
+
+        With early_exit=True the clip is fingerprinted and looked up in short
+        blocks, stopping as soon as one song clearly leads the rest.
+        """
         try:
             if file_path:
-                audio_data, sample_rate = self.audio_processor.load_audio(file_path)
+                # Query clips are not worth caching
+                audio_data, sample_rate = self.audio_processor.load_audio(
+                    file_path, use_cache=False
+                )
             elif audio_data is None:
                 raise ValueError("Either file_path or audio_data must be provided")
 
-            # Normalize audio
-            audio_data = self.audio_processor.normalize_audio(audio_data)
+            # Normalize audio; a caller's array is copied, a decoded one scaled in place
+            audio_data = self.audio_processor.normalize_audio(
+                audio_data, in_place=bool(file_path)
+            )
+
+            if early_exit:
+                return self._identify_incrementally(audio_data, sample_rate, top_n)
 
             # Generate fingerprints
-            query_fingerprints = self.fingerprint_generator.generate_fingerprint(
-                audio_data, sample_rate
+            query_hashes, query_times = (
+                self.fingerprint_generator.generate_fingerprint_arrays(
+                    audio_data, sample_rate
+                )
             )
 
-            if not query_fingerprints:
+            if len(query_hashes) == 0:
                 print("No fingerprints could be generated from the query audio")
                 return []
 
-            print(f"Generated {len(query_fingerprints)} query fingerprints")
+            print(f"Generated {len(query_hashes)} query fingerprints")
 
             # Match against database
-            matches = self.matcher.match_audio(query_fingerprints)
+            matches = self.matcher.match_arrays(query_hashes, query_times, top_n=top_n)
 
             return matches
 
@@ -90,23 +503,312 @@ class FingerprintSystem:
             print(f"Error identifying audio: {e}")
             return []
 
-    def batch_add_songs(self, songs_info: List[Dict]) -> int:
+    def _identify_incrementally(
+        self,
+        audio_data: np.ndarray,
+        sample_rate: int,
+        top_n: Optional[int] = None,
+        block_duration: float = 1.0,
+    ) -> List[Tuple[Dict, float, int]]:
+        """Feed the clip to an IncrementalMatcher block by block until confident"""
+        block_size = int(block_duration * sample_rate)
+        blocks = (
+            audio_data[start : start + block_size]
+            for start in range(0, len(audio_data), block_size)
+        )
+
+        matcher = IncrementalMatcher(self.matcher.database)
+        for hashes, offsets in self.fingerprint_generator.stream_fingerprint(
+            blocks, sample_rate
+        ):
+            matcher.add_batch(hashes, offsets)
+            if matcher.is_confident():
+                print(f"Confident after {matcher.query_count} query fingerprints")
+                break
+
+        if matcher.query_count == 0:
+            print("No fingerprints could be generated from the query audio")
+            return []
+
+        return matcher.results(top_n)
+
+    def monitor_recording(
+        self,
+        file_path: str,
+        window_seconds: float = 10.0,
+        hop_seconds: float = 5.0,
+        min_aligned: int = 20,
+        block_duration: float = 60.0,
+    ) -> List[Dict]:
+        """Find every catalog song playing in a long recording, with timestamps.
+
+        The recording is decoded, fingerprinted and looked up block by block
+        in constant memory, and overlapping windows vote on the postings
+        already fetched (see audioMatcher.RecordingMonitor). Returns one dict
+        per segment, ordered by start: song, start and end (seconds into the
+        recording), song_offset (seconds into the song at `start`), aligned
+        votes and confidence.
+        """
+        frame_seconds = (
+            self.fingerprint_generator.spectrogram_generator.hop_size
+            / self.audio_processor.sample_rate
+        )
+        monitor = RecordingMonitor(
+            self.matcher.database,
+            window=max(1, round(window_seconds / frame_seconds)),
+            hop=max(1, round(hop_seconds / frame_seconds)),
+            min_aligned=min_aligned,
+        )
+        for hashes, offsets in stream_fingerprint_file(
+            self.audio_processor, self.fingerprint_generator, file_path, block_duration
+        ):
+            monitor.add_batch(hashes, offsets)
+
+        segments = monitor.finish()
+        songs = self.matcher.database.get_songs_by_ids(
+            [segment["song_id"] for segment in segments]
+        )
+        return [
+            {
+                "song": songs[segment["song_id"]],
+                "start": segment["start"] * frame_seconds,
+                "end": segment["end"] * frame_seconds,
+                "song_offset": (segment["start"] + segment["delta"]) * frame_seconds,
+                "aligned": segment["aligned"],
+                "confidence": segment["aligned"] / segment["query_count"],
+            }
+            for segment in segments
+            if segment["song_id"] in songs
+        ]
+
+    def identify_batch(
+        self,
+        file_paths: List[str],
+        workers: int = 1,
+        batch_size: int = 64,
+        top_n: Optional[int] = None,
+        max_pending: Optional[int] = None,
+    ) -> List[List[Tuple[Dict, float, int]]]:
+        """Identify many query files; returns one identify_audio result list each.
+
+        Files are fingerprinted in a pool of `workers` processes, and every
+        `batch_size` queries share a single fingerprint lookup. At most
+        `max_pending` files (default batch_size + 2 * workers) are submitted
+        ahead of the lookups, so workers keep busy during a lookup without
+        fingerprints of the whole list piling up. Files that fail to load
+        get an empty result.
+        """
+        executor = None
+        if workers > 1:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_fingerprint_worker,
+                initargs=(self.cache,),
+            )
+            fingerprinted = _bounded_map(
+                executor,
+                _query_worker,
+                file_paths,
+                max_pending or batch_size + 2 * workers,
+            )
+        else:
+            fingerprinted = (
+                try_fingerprint_file(self.fingerprint_generator, file_path)
+                for file_path in file_paths
+            )
+
+        results = []
+        try:
+            for _ in range(0, len(file_paths), batch_size):
+                batch = list(islice(fingerprinted, batch_size))
+                results.extend(self._match_fingerprinted(batch, top_n))
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        return results
+
+    def _match_fingerprinted(
+        self,
+        batch: List[Optional[Tuple[np.ndarray, np.ndarray]]],
+        top_n: Optional[int],
+    ) -> List[List[Tuple[Dict, float, int]]]:
+        """match_batch over the queries that could be fingerprinted"""
+        matches = iter(
+            self.matcher.match_batch(
+                [fingerprints for fingerprints in batch if fingerprints is not None],
+                top_n=top_n,
+            )
+        )
+        return [
+            next(matches) if fingerprints is not None else [] for fingerprints in batch
+        ]
+
+    def batch_add_songs(
+        self,
+        songs_info: List[Dict],
+        workers: int = 1,
+        max_pending: int = None,
+        bulk: Optional[bool] = None,
+    ) -> int:
         """Add multiple songs to the database"""
-        success_count = 0
+        return sum(
+            status["status"] == "added"
+            for _, status in self.iter_batch_add(songs_info, workers, max_pending, bulk)
+        )
 
-        for song_info in songs_info:
-            file_path = song_info.get("file_path")
-            title = song_info.get("title")
-            artist = song_info.get("artist")
+    def iter_batch_add(
+        self,
+        songs_info: List[Dict],
+        workers: int = 1,
+        max_pending: int = None,
+        bulk: Optional[bool] = None,
+    ) -> Iterator[Tuple[Dict, Dict]]:
+        """Add songs, yielding (song_info, status) for each file as it finishes.
+
+        `status` is an ingest_song result dict. For a file repeated within
+        the batch, "duplicate_of" is the song_info of its first occurrence.
+
+        With bulk=True all songs are written in one AudioDatabase.bulk_load()
+        session, which drops and rebuilds the fingerprint indexes. Its
+        statuses are only yielded once the session has committed, so
+        stopping early never rolls back songs already reported as added.
+        With bulk=False each song is committed into the indexed tables and
+        reported as it finishes. By default a bulk load is used only for
+        batches that are large next to the catalog (see BULK_LOAD_FRACTION).
 
-            if not file_path or not title:
+        With workers > 1, decoding and fingerprinting run in a process pool
+        while this process stays the only SQLite writer. At most
+        `max_pending` files (default 2 * workers) are in flight at once.
+
+        Files whose contents are already stored, or appear earlier in the
+        batch, are skipped. Only sequential loads (workers=1) also run
+        ingest_song's near-duplicate check.
+        """
+        if bulk is None:
+            bulk = len(songs_info) >= BULK_LOAD_FRACTION * self.database.count_songs()
+        if not bulk:
+            yield from self._iter_add(songs_info, workers, max_pending)
+            return
+        with self.database.bulk_load():
+            statuses = list(self._iter_add(songs_info, workers, max_pending))
+        yield from statuses
+
+    def _iter_add(
+        self, songs_info: List[Dict], workers: int, max_pending: Optional[int]
+    ) -> Iterator[Tuple[Dict, Dict]]:
+        valid_songs = []
+        # Songs added in a bulk_load are not visible to lookups until it
+        # commits, so repeats within the batch are found by hash here
+        batch_songs = {}
+        for song_info in songs_info:
+            if not song_info.get("file_path") or not song_info.get("title"):
                 print(f"Skipping song: missing file_path or title")
                 continue
+            try:
+                content_hash = self._content_hash(song_info["file_path"])
+            except OSError as e:
+                print(f"Error processing {song_info['title']}: {e}")
+                yield song_info, {"status": "failed", "error": str(e)}
+                continue
+            existing = batch_songs.get(content_hash)
+            if existing is None and workers > 1:
+                existing = self.database.find_song_by_content_hash(content_hash)
+            if existing is not None:
+                print(f"Skipping {song_info['title']}: duplicate file")
+                yield song_info, {"status": "duplicate", "duplicate_of": existing}
+                continue
+            batch_songs[content_hash] = song_info
+            valid_songs.append((song_info, content_hash))
+
+        if workers <= 1:
+            for song_info, content_hash in valid_songs:
+                status = self.ingest_song(
+                    song_info["file_path"],
+                    song_info["title"],
+                    song_info.get("artist"),
+                    song_info.get("genre", "Unknown"),
+                    content_hash=content_hash,
+                )
+                yield song_info, status
+            return
+
+        max_pending = max_pending or 2 * workers
+        pending_songs = iter(valid_songs)
+        in_flight = {}
+
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_fingerprint_worker,
+            initargs=(self.cache,),
+        ) as executor:
+            while True:
+                # Backpressure: only submit while the window has room
+                for song_info, content_hash in pending_songs:
+                    print(
+                        f"Processing: {song_info['title']} by "
+                        f"{song_info.get('artist') or 'Unknown Artist'}"
+                    )
+                    future = executor.submit(_ingest_worker, song_info["file_path"])
+                    in_flight[future] = (song_info, content_hash)
+                    if len(in_flight) >= max_pending:
+                        break
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    song_info, content_hash = in_flight.pop(future)
+                    try:
+                        hashes, offsets, duration = future.result()
+                        song_id = self._store_song(
+                            song_info["file_path"],
+                            song_info["title"],
+                            song_info.get("artist"),
+                            song_info.get("genre", "Unknown"),
+                            hashes,
+                            offsets,
+                            duration,
+                            content_hash,
+                        )
+                    except Exception as e:
+                        print(f"Error processing {song_info['title']}: {e}")
+                        status = {"status": "failed", "error": str(e)}
+                    else:
+                        if song_id is None:
+                            status = {
+                                "status": "failed",
+                                "error": "No fingerprints could be generated",
+                            }
+                        else:
+                            status = {"status": "added", "song_id": song_id}
+                    yield song_info, status
+
+    def migrate_database(self) -> int:
+        """Re-fingerprint all songs after upgrading a legacy hash format"""
+        if not self.database.needs_migration():
+            return 0
+
+        print("Migrating fingerprints to the integer hash format...")
+        self.database.migrate_fingerprints()
 
-            if self.add_song_to_database(file_path, title, artist):
-                success_count += 1
+        migrated = 0
+        with self.database.bulk_load():
+            for song_id, title, _, _, file_path, _, _ in self.database.get_all_songs():
+                try:
+                    hashes, offsets, _ = self.fingerprint_generator.fingerprint_file(
+                        file_path
+                    )
+                    self.database.add_fingerprints(
+                        song_id, zip(hashes.tolist(), offsets.tolist())
+                    )
+                    migrated += 1
+                except Exception as e:
+                    print(f"Could not re-fingerprint '{title}': {e}")
 
-        return success_count
+        print(f"Re-fingerprinted {migrated} songs")
+        return migrated
 
     def list_database_songs(self) -> List[Dict]:
         """List all songs in the database"""
@@ -117,13 +819,13 @@ class FingerprintSystem:
         print(f"\nSearching for: {os.path.basename(query_file_path)}")
         print("-" * 50)
 
-        matches = self.identify_audio(query_file_path)
+        matches = self.identify_audio(query_file_path, top_n=top_n)
 
         if not matches:
             print("No matches found!")
             return
 
-        for i, (song_info, confidence, match_count) in enumerate(matches[:top_n]):
+        for i, (song_info, confidence, match_count) in enumerate(matches):
             print(f"{i+1}. {song_info['title']} by {song_info['artist'] or 'Unknown'}")
             print(f"   Confidence: {confidence:.2%}")
             print(f"   Matches: {match_count}")
@@ -0,0 +1,203 @@
+import queue
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+import soxr
+
+from audio_processor import AudioProcessor
+from audioMatcher import posting_deltas, peak_alignments
+from fingerPrintGenerator import StreamingHasher
+from spectrogram_utils import StreamingSpectrogram, StreamingPeakFinder
+
+
+class FileInputStream:
+    """File-backed stand-in for sounddevice.InputStream.
+
+    Feeds a file to `callback(indata, frames, time_info, status)` in
+    `blocksize` chunks from a background thread, so live identification can
+    be exercised without a microphone. With realtime=True blocks are paced
+    at the sample rate like a real device.
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        callback: Callable,
+        samplerate: int = 44100,
+        blocksize: int = 2048,
+        realtime: bool = False,
+    ):
+        self.file_path = file_path
+        self.callback = callback
+        self.samplerate = samplerate
+        self.blocksize = blocksize
+        self.realtime = realtime
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def close(self):
+        self.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _run(self):
+        audio_data, _ = AudioProcessor(self.samplerate).load_audio(self.file_path)
+        for start in range(0, len(audio_data), self.blocksize):
+            if self._stopped.is_set():
+                break
+            block = audio_data[start : start + self.blocksize, None]
+            self.callback(block, len(block), None, None)
+            if self.realtime:
+                time.sleep(len(block) / self.samplerate)
+
+
+class ContinuousIdentifier:
+    """Identifies a song from a live audio stream as blocks arrive.
+
+    Each block is fingerprinted incrementally (StreamingSpectrogram ->
+    StreamingPeakFinder -> StreamingHasher) and only its new hashes are
+    looked up. The resulting (song, time_delta) votes are kept for a rolling
+    window of `window_seconds`, and a match is reported as soon as one
+    song's aligned vote count reaches `min_aligned`.
+
+    There is no whole-clip normalization on a live stream; blocks are scaled
+    by the loudest sample seen so far instead.
+    """
+
+    def __init__(
+        self,
+        fingerprint_system,
+        input_rate: Optional[int] = None,
+        window_seconds: float = 10.0,
+        min_aligned: int = 15,
+    ):
+        self.database = fingerprint_system.matcher.database
+        self.fingerprint_generator = fingerprint_system.fingerprint_generator
+        self.sample_rate = fingerprint_system.audio_processor.sample_rate
+        self.input_rate = input_rate or self.sample_rate
+        self.window_seconds = window_seconds
+        self.min_aligned = min_aligned
+        self.reset()
+
+    def reset(self):
+        """Forget all buffered audio and votes"""
+        spec_gen = self.fingerprint_generator.spectrogram_generator
+        self.spectrogram = StreamingSpectrogram(spec_gen, self.sample_rate)
+        self.peak_finder = StreamingPeakFinder(spec_gen)
+        self.hasher = StreamingHasher(self.fingerprint_generator)
+        self.resampler = None
+        if self.input_rate != self.sample_rate:
+            self.resampler = soxr.ResampleStream(
+                self.input_rate, self.sample_rate, 1, dtype="float32", quality="HQ"
+            )
+        self.max_val = 0.0
+        self.window_frames = int(
+            self.window_seconds * self.sample_rate / spec_gen.hop_size
+        )
+        # Rolling window of (newest query offset, hash count, songs, deltas) per block
+        self.votes = deque()
+
+    def process_block(self, samples: np.ndarray) -> Optional[Tuple[Dict, float, int]]:
+        """Fingerprint one block of audio; returns a match once one is certain"""
+        samples = np.asarray(samples, dtype=np.float32).reshape(len(samples), -1)
+        samples = samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]
+        if self.resampler is not None:
+            samples = self.resampler.resample_chunk(samples)
+
+        if len(samples):
+            self.max_val = max(self.max_val, float(np.max(np.abs(samples))))
+        if self.max_val > 0:
+            samples = samples / self.max_val
+
+        columns = self.spectrogram.push(samples)
+        if columns.shape[1] == 0:
+            return None
+        hashes, offsets = self.hasher.push(*self.peak_finder.push(columns))
+        if len(hashes) == 0:
+            return None
+
+        # Look up only this block's hashes and keep its votes
+        posting_hashes, posting_songs, posting_times = self.database.query_postings(
+            np.unique(hashes)
+        )
+        songs, deltas = posting_deltas(
+            hashes, offsets, posting_hashes, posting_songs, posting_times
+        )
+        newest = int(offsets.max())
+        self.votes.append((newest, len(hashes), songs, deltas))
+
+        # Drop blocks that fell out of the rolling window
+        while self.votes and self.votes[0][0] < newest - self.window_frames:
+            self.votes.popleft()
+
+        return self._best_match()
+
+    def _best_match(self) -> Optional[Tuple[Dict, float, int]]:
+        songs = np.concatenate([block[2] for block in self.votes])
+        deltas = np.concatenate([block[3] for block in self.votes])
+        song_ids, aligned_counts, _, _ = peak_alignments(songs, deltas)
+        if len(song_ids) == 0:
+            return None
+
+        best = int(np.argmax(aligned_counts))
+        if aligned_counts[best] < self.min_aligned:
+            return None
+
+        song_info = self.database.get_song_by_id(int(song_ids[best]))
+        if not song_info:
+            return None
+        query_count = sum(block[1] for block in self.votes)
+        confidence = float(aligned_counts[best] / query_count)
+        return song_info, confidence, int(aligned_counts[best])
+
+    def listen(
+        self, open_stream: Callable, timeout: float = 30.0
+    ) -> Optional[Tuple[Dict, float, int]]:
+        """Run until a match is found, the stream ends or `timeout` passes.
+
+        `open_stream(callback)` must return an InputStream-like context
+        manager, e.g. MicrophoneRecorder.open_stream or a FileInputStream.
+        The audio callback only queues blocks; fingerprinting and lookups
+        happen on the calling thread.
+        """
+        self.reset()
+        blocks = queue.Queue()
+
+        def callback(indata, frames, time_info, status):
+            blocks.put(np.array(indata, dtype=np.float32, copy=True))
+
+        deadline = time.monotonic() + timeout
+        with open_stream(callback) as stream:
+            while time.monotonic() < deadline:
+                try:
+                    block = blocks.get(timeout=0.1)
+                except queue.Empty:
+                    if not stream.active:
+                        break
+                    continue
+                match = self.process_block(block)
+                if match:
+                    return match
+        return None
@@ -1,24 +1,64 @@
 import streamlit as st
 import os
-from audio_database import AudioDatabase
 from fingerprint_system import FingerprintSystem
+from fingerprint_index import InMemoryFingerprintIndex
+from audioMatcher import AudioMatcher
 import pandas as pd
-from spectrogram_utils import SpectrogramGenerator
+from analysis_cache import AnalysisCache
 from microphone_recorder import MicrophoneRecorder
+from live_identifier import ContinuousIdentifier
+from service import identify_remote, reload_remote
 import numpy as np
 
+
+@st.cache_resource
+def get_fingerprint_system():
+    """One system and database shared by every session and rerun.
+
+    The database's connection pool and writer thread let concurrent
+    sessions identify while another one is adding a song. The analysis
+    cache lets Add Song decode and analyze each upload once for
+    fingerprinting, peaks and the plot.
+    """
+    return FingerprintSystem(cache=AnalysisCache())
+
+
+@st.cache_resource
+def load_fingerprint_index():
+    """In-memory catalog shared by all sessions; cleared when a song is added"""
+    return InMemoryFingerprintIndex.from_database(get_fingerprint_system().database)
+
+
 # Initialize DB + Systems
-db = AudioDatabase()
-fingerprint_system = FingerprintSystem()
-spec_gen = SpectrogramGenerator()
+fingerprint_system = get_fingerprint_system()
+db = fingerprint_system.database
+spec_gen = fingerprint_system.fingerprint_generator.spectrogram_generator
 recorder = MicrophoneRecorder()
 
+# With a running `python service.py`, identification is sent to it instead
+SERVICE_URL = os.environ.get("TUNETRACE_SERVICE_URL")
+
+
+def identify_clip(file_path):
+    if SERVICE_URL:
+        return identify_remote(SERVICE_URL, file_path, top_n=1)
+    return fingerprint_system.identify_audio(file_path, top_n=1, early_exit=True)
+
 
 SONGS_DIR = "songs"
 os.makedirs(SONGS_DIR, exist_ok=True)
 
 st.set_page_config(page_title="TuneTrace", page_icon="🎵", layout="centered")
 
+# Databases from before the integer hash format must be re-fingerprinted
+if fingerprint_system.database.needs_migration():
+    with st.spinner("Upgrading fingerprint database to the new hash format..."):
+        fingerprint_system.migrate_database()
+
+# Identify against the cached in-memory index instead of querying SQLite
+if not SERVICE_URL:
+    fingerprint_system.matcher = AudioMatcher(load_fingerprint_index())
+
 st.title("🎵 TuneTrace")
 st.markdown("### Manage and play your songs")
 
@@ -37,6 +77,10 @@ if menu == "Add Song":
             "Genre", ["Pop", "Rock", "Classical", "Hip-Hop", "Jazz", "Other"]
         )
 
+        allow_near_duplicates = st.checkbox(
+            "Add even if the catalog has another copy of this recording"
+        )
+
         submitted = st.form_submit_button("Save Song")
 
     if submitted and uploaded_file and title and artist:
@@ -45,8 +89,40 @@ if menu == "Add Song":
             f.write(uploaded_file.getbuffer())
 
         # Add song to database and generate fingerprints
-        with st.spinner("Adding song and generating fingerprints..."):
-            fingerprint_system.add_song_to_database(file_path, title, artist, genre)
+        with st.spinner("Checking for duplicates and generating fingerprints..."):
+            status = fingerprint_system.ingest_song(
+                file_path,
+                title,
+                artist,
+                genre,
+                allow_near_duplicates=allow_near_duplicates,
+            )
+
+        if status["status"] != "added":
+            duplicate_of = status.get("duplicate_of")
+            # Don't keep a second copy of a file that is already in the library
+            if duplicate_of and os.path.abspath(duplicate_of["file_path"]) != os.path.abspath(file_path):
+                os.remove(file_path)
+            if status["status"] == "duplicate":
+                st.warning(
+                    f"⚠️ This file is already in the library as "
+                    f"{duplicate_of['title']} by {duplicate_of['artist'] or 'Unknown'}."
+                )
+            elif status["status"] == "near_duplicate":
+                st.warning(
+                    f"⚠️ This sounds like {duplicate_of['title']} by "
+                    f"{duplicate_of['artist'] or 'Unknown'} "
+                    f"({status['similarity']:.0%} match), so it was not added. "
+                    f"Tick the checkbox to add it anyway."
+                )
+            else:
+                st.error(f"Could not add {title}: {status['error']}")
+            st.stop()
+
+        if SERVICE_URL:
+            reload_remote(SERVICE_URL)
+        else:
+            load_fingerprint_index.clear()
 
         st.success(f"✅ {title} by {artist} added successfully!")
         st.info(
@@ -61,8 +137,7 @@ if menu == "Add Song":
         import matplotlib.pyplot as plt
 
         # Use the spectrogram values instead of raw STFT for proper dimensions
-        y, sr = spec_gen.audio_processor.load_audio(file_path)
-        frequencies, times_spect, Sxx_db = spec_gen.generate_spectrogram(y, sr)
+        frequencies, times_spect, Sxx_db, _ = spec_gen.file_spectrogram(file_path)
         fig, ax = plt.subplots(figsize=(12, 6))
         ax.pcolormesh(times_spect, frequencies, Sxx_db, shading="gouraud")
 
@@ -137,7 +212,7 @@ elif menu == "Identify Song":
         # Automatically identify the recorded song
         with st.spinner("Processing audio and identifying song..."):
             try:
-                matches = fingerprint_system.identify_audio(temp_path)
+                matches = identify_clip(temp_path)
                 
                 if matches:
                     st.success("🎉 Song Identified!")
@@ -180,6 +255,24 @@ elif menu == "Identify Song":
         if os.path.exists(temp_path):
             os.remove(temp_path)
 
+    st.markdown("---")
+    st.markdown("### Option 3: Listen Continuously")
+    if st.button("👂 Listen and Identify"):
+        identifier = ContinuousIdentifier(
+            fingerprint_system, input_rate=recorder.sample_rate
+        )
+        with st.spinner("Listening... a match is reported as soon as it is certain"):
+            match = identifier.listen(recorder.open_stream, timeout=30)
+
+        if match:
+            song_info, confidence, match_count = match
+            st.success(
+                f"🎉 {song_info['title']} by {song_info['artist'] or 'Unknown'}"
+            )
+            st.write(f"Matches: {match_count} aligned fingerprints")
+        else:
+            st.warning("No match found within 30 seconds.")
+
     if uploaded_audio:
         # Handle both uploaded files and recorded audio
         if isinstance(uploaded_audio, str):
@@ -197,7 +290,7 @@ elif menu == "Identify Song":
             if st.button("🔍 Identify Song"):
                 with st.spinner("Analyzing audio and searching database..."):
                     try:
-                        matches = fingerprint_system.identify_audio(temp_path)
+                        matches = identify_clip(temp_path)
 
                         if matches:
                             st.success("🎉 Top Match Found!")
@@ -13,4 +13,14 @@ class MicrophoneRecorder:
         recording = sd.rec(int(duration * self.sample_rate), samplerate=self.sample_rate, channels=self.channels, dtype='int16')
         sd.wait()  # Wait until recording is finished
         write(output_filename, self.sample_rate, recording)  # Save as WAV file
-        print(f"Recording finished and saved to {output_filename}")
\ No newline at end of file
+        print(f"Recording finished and saved to {output_filename}")
+
+    def open_stream(self, callback, blocksize: int = 2048) -> sd.InputStream:
+        """Opens a float32 input stream that passes each recorded block to callback."""
+        return sd.InputStream(
+            samplerate=self.sample_rate,
+            channels=self.channels,
+            dtype="float32",
+            blocksize=blocksize,
+            callback=callback,
+        )
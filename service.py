@@ -0,0 +1,382 @@
+# service.py
+"""
+Headless identification service.
+
+Loads the catalog once and identifies clips posted to a local HTTP/JSON
+endpoint:
+
+    python service.py [--db songs.db] [--port 8765] [--workers 4] [--memory-index]
+
+    POST /identify?top_n=3&filename=clip.mp3   body: raw bytes of an audio clip
+    POST /reload             rebuild the in-memory index after songs were added
+    GET  /health
+
+The clip's format is taken from the extension of `filename`, else from its
+magic bytes, else from the Content-Type header. Clips are fingerprinted
+in a process pool. Requests whose fingerprints are
+ready within `batch_window` seconds of each other are matched together with
+AudioMatcher.match_batch, so they share one database lookup.
+"""
+import argparse
+import asyncio
+import json
+import mimetypes
+import os
+import re
+import tempfile
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from fingerprint_system import FingerprintSystem, _init_fingerprint_worker, _query_worker
+
+# Largest request body accepted, in bytes
+MAX_BODY_SIZE = 64 << 20
+
+HTTP_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    411: "Length Required",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+# Extensions accepted from a client's filename
+SUFFIX_PATTERN = re.compile(r"^\.[a-z0-9]{1,5}$")
+
+
+def sniff_suffix(audio: bytes) -> Optional[str]:
+    """File extension of the audio format recognized from a clip's magic bytes"""
+    if audio[:4] == b"RIFF" and audio[8:12] == b"WAVE":
+        return ".wav"
+    if audio[:4] == b"fLaC":
+        return ".flac"
+    if audio[:4] == b"OggS":
+        return ".ogg"
+    if audio[4:8] == b"ftyp":
+        return ".m4a"
+    # An ID3v2 tag, or a bare MPEG audio frame sync with a valid layer
+    if audio[:3] == b"ID3" or (
+        len(audio) > 1 and audio[0] == 0xFF and audio[1] & 0xE0 == 0xE0 and audio[1] & 0x06
+    ):
+        return ".mp3"
+    return None
+
+
+def upload_suffix(filename: Optional[str], content_type: str, audio: bytes) -> str:
+    """Temp file extension for an uploaded clip, so the decoder picks its format"""
+    if filename:
+        suffix = os.path.splitext(os.path.basename(filename))[1].lower()
+        if SUFFIX_PATTERN.match(suffix):
+            return suffix
+    suffix = sniff_suffix(audio)
+    if suffix:
+        return suffix
+    # application/octet-stream maps to .bin, which says nothing about the format
+    suffix = mimetypes.guess_extension(content_type)
+    return suffix if suffix and suffix != ".bin" else ".wav"
+
+
+def _clip_worker(audio: bytes, suffix: str) -> Optional[Tuple]:
+    """Pool task: write an uploaded clip to a temp file and fingerprint it"""
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(audio)
+        return _query_worker(path)
+    finally:
+        os.remove(path)
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class IdentificationService:
+    """Serves FingerprintSystem identifications from one warm process.
+
+    The event loop only parses requests and batches lookups; decoding and
+    fingerprinting run on `workers` processes, and match_batch runs on a
+    thread so the loop keeps accepting requests meanwhile. With
+    `memory_index` the catalog is loaded into an InMemoryFingerprintIndex
+    at startup and on POST /reload; otherwise lookups go to SQLite and see
+    new songs immediately.
+    """
+
+    def __init__(
+        self,
+        fingerprint_system: FingerprintSystem,
+        workers: int = 1,
+        batch_size: int = 64,
+        batch_window: float = 0.005,
+        memory_index: bool = False,
+        min_matches: int = 5,
+    ):
+        self.fingerprint_system = fingerprint_system
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.memory_index = memory_index
+        self.min_matches = min_matches
+        self._executor = None
+        self._queue = None
+        self._batcher = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8765) -> asyncio.AbstractServer:
+        """Load the catalog, start the workers and listen on host:port"""
+        if self.memory_index:
+            await asyncio.to_thread(self.fingerprint_system.use_memory_index)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_fingerprint_worker,
+            initargs=(self.fingerprint_system.cache,),
+        )
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._batch_loop())
+        return await asyncio.start_server(self._handle_connection, host, port)
+
+    async def stop(self):
+        if self._batcher is not None:
+            self._batcher.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+
+    async def identify(
+        self, audio: bytes, suffix: str = ".wav", top_n: Optional[int] = None
+    ) -> List[Tuple[Dict, float, int]]:
+        """Fingerprint a clip in the process pool and match it in the next batch"""
+        loop = asyncio.get_running_loop()
+        # The temp file is written in the pool too, keeping disk I/O off the loop
+        fingerprints = await loop.run_in_executor(
+            self._executor, _clip_worker, audio, suffix
+        )
+        if fingerprints is None:
+            raise HTTPError(400, "Could not decode audio clip")
+
+        future = loop.create_future()
+        await self._queue.put((fingerprints, top_n, future))
+        return await future
+
+    async def _batch_loop(self):
+        """Collect queued queries into batches and match each batch at once"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Give requests that are about to finish fingerprinting a chance to join
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._match_batch(batch)
+
+    async def _match_batch(self, batch: List[Tuple]):
+        limits = [top_n for _, top_n, _ in batch]
+        top_n = None if None in limits else max(limits)
+        try:
+            results = await asyncio.to_thread(
+                self.fingerprint_system.matcher.match_batch,
+                [fingerprints for fingerprints, _, _ in batch],
+                self.min_matches,
+                top_n,
+            )
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, limit, future), matches in zip(batch, results):
+            if not future.done():
+                future.set_result(matches[:limit])
+
+    async def reload(self) -> Dict:
+        """Rebuild the in-memory index so newly added songs can be identified"""
+        if not self.memory_index:
+            return {"reloaded": False}
+        index = await asyncio.to_thread(self.fingerprint_system.use_memory_index)
+        return {"reloaded": True, "fingerprints": len(index)}
+
+    async def _handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                keep_alive = await self._handle_request(request_line, reader, writer)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_request(
+        self,
+        request_line: bytes,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> bool:
+        """Answer one request; returns whether the connection stays open"""
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            parts = request_line.decode("latin-1").split()
+            if len(parts) != 3:
+                raise HTTPError(400, "Malformed request line")
+            method, target, version = parts
+            keep_alive = (
+                version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            )
+
+            if "transfer-encoding" in headers:
+                raise HTTPError(411, "Send the body with a Content-Length")
+            length = int(headers.get("content-length", 0))
+            if length > MAX_BODY_SIZE:
+                raise HTTPError(413, f"Body larger than {MAX_BODY_SIZE} bytes")
+            body = await reader.readexactly(length)
+
+            status, payload = 200, await self._route(method, target, headers, body)
+        except HTTPError as e:
+            status, payload, keep_alive = e.status, {"error": str(e)}, False
+        except ValueError as e:
+            status, payload, keep_alive = 400, {"error": str(e)}, False
+        except Exception as e:
+            print(f"Error handling request: {e}")
+            status, payload, keep_alive = 500, {"error": str(e)}, False
+
+        body = json.dumps(payload).encode()
+        head = (
+            f"HTTP/1.1 {status} {HTTP_REASONS[status]}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        return keep_alive
+
+    async def _route(self, method: str, target: str, headers: Dict, body: bytes) -> Dict:
+        url = urlsplit(target)
+        params = parse_qs(url.query)
+        routes = {
+            "/identify": "POST",
+            "/reload": "POST",
+            "/health": "GET",
+        }
+        if url.path not in routes:
+            raise HTTPError(404, f"Unknown path {url.path}")
+        if method != routes[url.path]:
+            raise HTTPError(405, f"{url.path} expects {routes[url.path]}")
+
+        if url.path == "/health":
+            return {"status": "ok"}
+        if url.path == "/reload":
+            return await self.reload()
+
+        if not body:
+            raise HTTPError(400, "Empty audio clip")
+        top_n = int(params["top_n"][0]) if "top_n" in params else None
+        if top_n is not None and top_n < 1:
+            raise HTTPError(400, "top_n must be at least 1")
+        content_type = headers.get("content-type", "").split(";")[0].strip()
+        filename = params["filename"][0] if "filename" in params else None
+        suffix = upload_suffix(filename, content_type, body)
+        matches = await self.identify(body, suffix, top_n)
+        return {
+            "matches": [
+                {"song": song_info, "confidence": confidence, "aligned": aligned_count}
+                for song_info, confidence, aligned_count in matches
+            ]
+        }
+
+
+def identify_remote(
+    service_url: str, file_path: str, top_n: int = 1, timeout: float = 60.0
+) -> List[Tuple[Dict, float, int]]:
+    """Identify a file through a running service, in identify_audio's format"""
+    with open(file_path, "rb") as f:
+        audio = f.read()
+    content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    query = urlencode({"top_n": top_n, "filename": os.path.basename(file_path)})
+    request = urllib.request.Request(
+        f"{service_url.rstrip('/')}/identify?{query}",
+        data=audio,
+        headers={"Content-Type": content_type},
+        method="POST",
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        payload = json.load(response)
+    return [
+        (match["song"], match["confidence"], match["aligned"])
+        for match in payload["matches"]
+    ]
+
+
+def reload_remote(service_url: str, timeout: float = 300.0) -> Dict:
+    """Ask a running service to pick up newly added songs"""
+    request = urllib.request.Request(
+        f"{service_url.rstrip('/')}/reload", data=b"", method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.load(response)
+
+
+async def serve(service: IdentificationService, host: str, port: int):
+    server = await service.start(host, port)
+    print(f"Serving identifications on http://{host}:{port}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TuneTrace identification service")
+    parser.add_argument("--db", default="songs.db")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument(
+        "--batch-window", type=float, default=0.005, help="seconds to wait for a batch to fill"
+    )
+    parser.add_argument(
+        "--memory-index", action="store_true", help="serve from an in-memory index"
+    )
+    args = parser.parse_args()
+
+    service = IdentificationService(
+        FingerprintSystem(args.db),
+        workers=args.workers,
+        batch_size=args.batch_size,
+        batch_window=args.batch_window,
+        memory_index=args.memory_index,
+    )
+    try:
+        asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -2,42 +2,237 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import signal
-from scipy.ndimage import maximum_filter
-from typing import List, Tuple, Optional
+from scipy import fft as sp_fft
+from scipy.ndimage import maximum_filter1d, uniform_filter1d
+from typing import List, Tuple, Optional, Dict
 from audio_processor import AudioProcessor  # Importing the existing AudioProcessor class 
+from analysis_cache import AnalysisCache
+
+# Frames transformed per FFT call in generate_spectrogram
+STFT_BLOCK_FRAMES = 256
 
 
 class SpectrogramGenerator:
-    """Generates spectrograms and detects peaks, ready for fingerprinting."""
+    """Generates spectrograms and detects peaks, ready for fingerprinting.
+
+    With an AnalysisCache, file_spectrogram/file_peaks (and the decode
+    underneath them) are computed once per file contents and parameter set.
+    """
 
-    def __init__(self, window_size: int = 4096, hop_size: int = 1024):
+    def __init__(
+        self,
+        window_size: int = 4096,
+        hop_size: int = 1024,
+        neighborhood_size: int = 20,
+        min_amplitude: float = -40,
+        peak_prominence: Optional[float] = None,
+        peaks_per_frame: Optional[int] = None,
+        cache: Optional[AnalysisCache] = None,
+    ):
         self.window_size = window_size
         self.hop_size = hop_size
-        self.audio_processor = AudioProcessor()  # Uses existing AudioProcessor
+        self.neighborhood_size = neighborhood_size
+        self.min_amplitude = min_amplitude
+        self.peak_prominence = peak_prominence
+        self.peaks_per_frame = peaks_per_frame
+        self.cache = cache
+        self.audio_processor = AudioProcessor(cache=cache)  # Uses existing AudioProcessor
+
+        # STFT plan reused by every call: the Hann window and the "spectrum"
+        # scale, rounded exactly as scipy.signal.spectrogram rounds them
+        window = signal.get_window("hann", window_size)
+        self.window = window.astype(np.float32)
+        self.scale = np.float32((1.0 / window.astype(np.complex64).sum() ** 2).real)
 
     def generate_spectrogram(
         self, audio_data: np.ndarray, sample_rate: int
     ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
-        """Compute spectrogram in dB scale"""
-        frequencies, times, Sxx = signal.spectrogram(
-            audio_data,
-            fs=sample_rate,
-            window="hann",
-            nperseg=self.window_size,
-            noverlap=self.window_size - self.hop_size,
-            scaling="spectrum",
-        )
-        Sxx_db = 10 * np.log10(Sxx + 1e-12)
+        """Compute spectrogram in dB scale.
+
+        Same result as scipy.signal.spectrogram (Hann window, constant
+        detrend, "spectrum" scaling, one-sided) followed by 10 * log10(Sxx +
+        1e-12), but computed in float32 over blocks of frames, so the
+        float32 output is the only full-size array allocated. Audio shorter
+        than one window is zero-padded to a single frame.
+        """
+        audio_data = np.asarray(audio_data, dtype=np.float32)
+        window_size, hop_size = self.window_size, self.hop_size
+        if 0 < len(audio_data) < window_size:
+            audio_data = np.pad(audio_data, (0, window_size - len(audio_data)))
+        frequencies = sp_fft.rfftfreq(window_size, 1 / sample_rate)
+        times = np.arange(
+            window_size / 2, len(audio_data) - window_size / 2 + 1, hop_size
+        ) / float(sample_rate)
+
+        num_frames = max(0, (len(audio_data) - window_size) // hop_size + 1)
+        Sxx_db = np.empty((window_size // 2 + 1, num_frames), dtype=np.float32)
+        if num_frames == 0:
+            return frequencies, times[:0], Sxx_db
+
+        frames = np.lib.stride_tricks.sliding_window_view(audio_data, window_size)
+        frames = frames[::hop_size]
+        # The Nyquist bin of an even-length frame has no mirror to fold in
+        doubled = slice(1, -1) if window_size % 2 == 0 else slice(1, None)
+        for start in range(0, num_frames, STFT_BLOCK_FRAMES):
+            block = frames[start : start + STFT_BLOCK_FRAMES]
+            block = block - block.mean(axis=-1, keepdims=True)
+            block *= self.window
+
+            # |X|^2 through the same complex product as scipy, so it rounds alike
+            spectrum = sp_fft.rfft(block, axis=-1)
+            spectrum *= np.conjugate(spectrum)
+            power = spectrum.real * self.scale
+            del spectrum
+            power[:, doubled] *= 2
+
+            np.add(power, 1e-12, out=power)
+            np.log10(power, out=power)
+            power *= 10
+            Sxx_db[:, start : start + len(block)] = power.T
+
         return frequencies, times, Sxx_db
 
+    def find_peak_arrays(
+        self,
+        spectrogram: np.ndarray,
+        neighborhood_size: Optional[int] = None,
+        min_amplitude: Optional[float] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Detect local maxima, returned as parallel (freq_bins, time_bins) arrays.
+
+        The neighborhood maximum is one 1-D maximum filter per axis in
+        float32. If set, `peak_prominence` also requires a peak to stand
+        that many dB above the mean level of its neighborhood, and
+        `peaks_per_frame` keeps only the loudest peaks of each time frame.
+        """
+        if neighborhood_size is None:
+            neighborhood_size = self.neighborhood_size
+        if min_amplitude is None:
+            min_amplitude = self.min_amplitude
+        spectrogram = np.asarray(spectrogram, dtype=np.float32)
+
+        local_max = maximum_filter1d(spectrogram, neighborhood_size, axis=0)
+        local_max = maximum_filter1d(local_max, neighborhood_size, axis=1)
+        peaks = (local_max == spectrogram) & (spectrogram > min_amplitude)
+        del local_max
+
+        if self.peak_prominence is not None:
+            # Adaptive threshold: the mean dB level around each bin
+            local_mean = uniform_filter1d(spectrogram, neighborhood_size, axis=0)
+            local_mean = uniform_filter1d(local_mean, neighborhood_size, axis=1)
+            peaks &= spectrogram > local_mean + self.peak_prominence
+
+        freq_bins, time_bins = np.nonzero(peaks)
+        if self.peaks_per_frame is not None:
+            keep = self._loudest_per_frame(
+                spectrogram[freq_bins, time_bins], time_bins, self.peaks_per_frame
+            )
+            freq_bins, time_bins = freq_bins[keep], time_bins[keep]
+        return freq_bins, time_bins
+
+    @staticmethod
+    def _loudest_per_frame(
+        amplitudes: np.ndarray, time_bins: np.ndarray, limit: int
+    ) -> np.ndarray:
+        """Mask keeping the `limit` loudest peaks of every time bin"""
+        order = np.lexsort((-amplitudes, time_bins))
+        sorted_times = time_bins[order]
+        frame_starts = np.flatnonzero(np.r_[True, sorted_times[1:] != sorted_times[:-1]])
+        frame_lengths = np.diff(np.r_[frame_starts, len(order)])
+        ranks = np.arange(len(order)) - np.repeat(frame_starts, frame_lengths)
+
+        keep = np.zeros(len(order), dtype=bool)
+        keep[order] = ranks < limit
+        return keep
+
     def find_peaks(
-        self, spectrogram: np.ndarray, neighborhood_size: int = 20, min_amplitude: float = -40
+        self,
+        spectrogram: np.ndarray,
+        neighborhood_size: Optional[int] = None,
+        min_amplitude: Optional[float] = None,
     ) -> List[Tuple[int, int]]:
         """Detect local maxima in spectrogram"""
-        local_max = maximum_filter(spectrogram, size=neighborhood_size) == spectrogram
-        amplitude_thresh = spectrogram > min_amplitude
-        peaks = np.where(local_max & amplitude_thresh)
-        return list(zip(peaks[0], peaks[1]))  # (freq_bin, time_bin)
+        freq_bins, time_bins = self.find_peak_arrays(
+            spectrogram, neighborhood_size, min_amplitude
+        )
+        return list(zip(freq_bins, time_bins))  # (freq_bin, time_bin)
+
+    def _spectrogram_params(self) -> Dict:
+        return {
+            "sample_rate": self.audio_processor.sample_rate,
+            "window_size": self.window_size,
+            "hop_size": self.hop_size,
+        }
+
+    def file_spectrogram(
+        self, file_path: str, use_cache: bool = True
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, float]:
+        """(frequencies, times, dB spectrogram, duration) of a normalized file"""
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.key(file_path, "spectrogram", **self._spectrogram_params())
+            cached = self.cache.get(key)
+            if cached is not None:
+                return (
+                    cached["frequencies"],
+                    cached["times"],
+                    cached["spectrogram"],
+                    float(cached["duration"]),
+                )
+
+        audio_data, sr = self.audio_processor.load_audio(file_path, use_cache)
+        audio_data = self.audio_processor.normalize_audio(audio_data, in_place=True)
+        frequencies, times, spectrogram = self.generate_spectrogram(audio_data, sr)
+        duration = len(audio_data) / sr
+
+        if key is not None:
+            self.cache.put(
+                key,
+                frequencies=frequencies,
+                times=times,
+                spectrogram=spectrogram,
+                duration=np.float64(duration),
+            )
+        return frequencies, times, spectrogram, duration
+
+    def file_peaks(
+        self, file_path: str, use_cache: bool = True
+    ) -> Tuple[np.ndarray, np.ndarray, float]:
+        """(freq_bins, time_bins, duration) of the peaks of a normalized file.
+
+        use_cache=False bypasses the cache, e.g. for one-off query clips
+        that would only evict catalog entries.
+        """
+        key = None
+        if use_cache and self.cache is not None:
+            key = self.cache.key(
+                file_path,
+                "peaks",
+                neighborhood_size=self.neighborhood_size,
+                min_amplitude=self.min_amplitude,
+                peak_prominence=self.peak_prominence,
+                peaks_per_frame=self.peaks_per_frame,
+                **self._spectrogram_params(),
+            )
+            cached = self.cache.get(key)
+            if cached is not None:
+                return (
+                    cached["freq_bins"],
+                    cached["time_bins"],
+                    float(cached["duration"]),
+                )
+
+        _, _, spectrogram, duration = self.file_spectrogram(file_path, use_cache)
+        freq_bins, time_bins = self.find_peak_arrays(spectrogram)
+
+        if key is not None:
+            self.cache.put(
+                key,
+                freq_bins=freq_bins,
+                time_bins=time_bins,
+                duration=np.float64(duration),
+            )
+        return freq_bins, time_bins, duration
 
     def visualize_spectrogram(
         self,
@@ -73,11 +268,13 @@ class SpectrogramGenerator:
         3. Detect peaks
         4. visualization
         """
-        audio_data, sr = self.audio_processor.load_audio(file_path)
-        audio_data = self.audio_processor.normalize_audio(audio_data)
-
-        frequencies, times, spectrogram = self.generate_spectrogram(audio_data, sr)
-        peaks = self.find_peaks(spectrogram)
+        frequencies, times, spectrogram, _ = self.file_spectrogram(file_path)
+        if self.cache is not None:
+            freq_bins, time_bins, _ = self.file_peaks(file_path)
+        else:
+            # Without a cache file_peaks would decode and transform again
+            freq_bins, time_bins = self.find_peak_arrays(spectrogram)
+        peaks = list(zip(freq_bins, time_bins))
 
         if visualize:
             self.visualize_spectrogram(frequencies, times, spectrogram, peaks, title=file_path)
@@ -92,6 +289,117 @@ class SpectrogramGenerator:
 
 
 
+class StreamingSpectrogram:
+    """Incremental STFT producing the same frames as generate_spectrogram.
+
+    Samples that do not yet fill a whole frame are carried over to the next
+    push(), so frames straddling block boundaries are computed exactly once.
+    """
+
+    def __init__(self, generator: SpectrogramGenerator, sample_rate: int):
+        self.generator = generator
+        self.sample_rate = sample_rate
+        self.carry = np.empty(0, dtype=np.float32)
+        self.num_frames = 0
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        """Add samples; returns the dB spectrogram columns completed by them"""
+        buffer = np.concatenate((self.carry, samples)) if len(self.carry) else samples
+        window_size = self.generator.window_size
+        hop_size = self.generator.hop_size
+
+        if len(buffer) < window_size:
+            self.carry = buffer
+            return np.empty((window_size // 2 + 1, 0), dtype=np.float32)
+
+        num_frames = (len(buffer) - window_size) // hop_size + 1
+        used = (num_frames - 1) * hop_size + window_size
+        _, _, columns = self.generator.generate_spectrogram(
+            buffer[:used], self.sample_rate
+        )
+        self.carry = buffer[num_frames * hop_size :]
+        self.num_frames += num_frames
+        return columns
+
+    def flush(self) -> np.ndarray:
+        """Columns left at end of stream: the zero-padded frame that
+        generate_spectrogram makes of audio shorter than one window"""
+        if self.num_frames or len(self.carry) == 0:
+            return np.empty((self.generator.window_size // 2 + 1, 0), dtype=np.float32)
+        _, _, columns = self.generator.generate_spectrogram(self.carry, self.sample_rate)
+        self.carry = self.carry[:0]
+        self.num_frames += columns.shape[1]
+        return columns
+
+
+class StreamingPeakFinder:
+    """Sliding-window peak detection equivalent to find_peak_arrays.
+
+    A column is only finalized once the halo of neighbouring columns its
+    filters need has arrived, so peaks near block boundaries match the
+    whole-spectrogram result. Time bins are global column indices.
+    """
+
+    def __init__(
+        self,
+        generator: SpectrogramGenerator,
+        neighborhood_size: Optional[int] = None,
+        min_amplitude: Optional[float] = None,
+    ):
+        self.generator = generator
+        self.neighborhood_size = (
+            generator.neighborhood_size if neighborhood_size is None else neighborhood_size
+        )
+        self.min_amplitude = (
+            generator.min_amplitude if min_amplitude is None else min_amplitude
+        )
+        # maximum_filter's window spans [t - size // 2, t + (size - 1) // 2]
+        self.halo_before = self.neighborhood_size // 2
+        self.halo_after = (self.neighborhood_size - 1) // 2
+
+        self.columns = None
+        self.buffer_start = 0  # global index of self.columns[:, 0]
+        self.next_column = 0  # first column whose peaks are not emitted yet
+
+    def push(self, columns: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Add spectrogram columns; returns peaks of the columns now final"""
+        if self.columns is None:
+            self.columns = columns
+        elif columns.shape[1]:
+            self.columns = np.concatenate((self.columns, columns), axis=1)
+        return self._emit(final=False)
+
+    def flush(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the peaks of all remaining columns at end of stream"""
+        if self.columns is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        return self._emit(final=True)
+
+    def _emit(self, final: bool) -> Tuple[np.ndarray, np.ndarray]:
+        buffer_end = self.buffer_start + self.columns.shape[1]
+        ready_end = buffer_end if final else buffer_end - self.halo_after
+        if ready_end <= self.next_column:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        # Filter the ready columns plus their halo; reflection at the window
+        # edges only touches halo columns unless it is the true stream edge
+        window_start = max(self.buffer_start, self.next_column - self.halo_before)
+        window = self.columns[:, window_start - self.buffer_start :]
+        freq_bins, time_bins = self.generator.find_peak_arrays(
+            window, self.neighborhood_size, self.min_amplitude
+        )
+        time_bins = time_bins + window_start
+        keep = (time_bins >= self.next_column) & (time_bins < ready_end)
+
+        # Keep only the columns still needed as halo for later output
+        self.next_column = ready_end
+        drop = max(0, self.next_column - self.halo_before - self.buffer_start)
+        self.columns = self.columns[:, drop:]
+        self.buffer_start += drop
+
+        return freq_bins[keep], time_bins[keep]
+
+
 # if __name__ == "__main__":
 #     generator = SpectrogramGenerator()
 #     freqs, times, peaks = generator.process_file("songs/song_1.mp3", visualize=True)
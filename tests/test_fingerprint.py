@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from fingerPrintGenerator import FingerprintGenerator, pack_hash
+
+
+def legacy_hashes(peaks, target_zone_start, target_zone_length):
+    """The per-pair loop generate_hash_arrays replaced"""
+    hashes = []
+    peaks = sorted(peaks, key=lambda x: x[1])
+    for i, (anchor_freq, anchor_time) in enumerate(peaks):
+        for j in range(
+            i + target_zone_start,
+            min(i + target_zone_start + target_zone_length, len(peaks)),
+        ):
+            target_freq, target_time = peaks[j]
+            time_delta = target_time - anchor_time
+            if time_delta <= 0:
+                continue
+            hashes.append((pack_hash(anchor_freq, target_freq, time_delta), int(anchor_time)))
+    return hashes
+
+
+@pytest.mark.parametrize("target_zone_start", [0, 1, 3])
+@pytest.mark.parametrize("target_zone_length", [1, 5, 12])
+@pytest.mark.parametrize("seed", range(4))
+def test_hash_arrays_match_legacy_loop(target_zone_start, target_zone_length, seed):
+    rng = np.random.default_rng(seed)
+    num_peaks = int(rng.integers(0, 300))
+    # Few distinct times, so many peaks share a frame and sort order matters
+    freq_bins = rng.integers(0, 1025, num_peaks)
+    time_bins = rng.integers(0, max(1, num_peaks // 3), num_peaks)
+
+    generator = FingerprintGenerator(
+        target_zone_length=target_zone_length, target_zone_start=target_zone_start
+    )
+    hashes, offsets = generator.generate_hash_arrays(freq_bins, time_bins)
+
+    expected = legacy_hashes(
+        list(zip(freq_bins.tolist(), time_bins.tolist())),
+        target_zone_start,
+        target_zone_length,
+    )
+    assert list(zip(hashes.tolist(), offsets.tolist())) == expected
+
+
+def test_hash_arrays_of_no_peaks_are_empty():
+    hashes, offsets = FingerprintGenerator().generate_hash_arrays([], [])
+    assert len(hashes) == 0 and len(offsets) == 0
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import soundfile as sf
+
+try:
+    from fingerprint_system import FingerprintSystem
+except OSError:
+    # sounddevice raises OSError when the PortAudio library is missing
+    pytest.skip("sounddevice needs the PortAudio library", allow_module_level=True)
+
+SAMPLE_RATE = 22050
+
+
+def write_songs(tmp_path, count, seconds=6.0, note_seconds=0.25):
+    """Files of random notes with a couple of harmonics each"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(note_seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    songs_info = []
+    for i in range(count):
+        audio = np.concatenate(
+            [
+                sum(np.sin(2 * np.pi * k * freq * t) / k for k in (1, 2, 3))
+                for freq in rng.uniform(200, 2000, int(seconds / note_seconds))
+            ]
+        )
+        path = tmp_path / f"song{i}.wav"
+        sf.write(path, (0.5 * audio / np.max(np.abs(audio))).astype(np.float32), SAMPLE_RATE)
+        songs_info.append({"file_path": str(path), "title": f"song{i}"})
+    return songs_info
+
+
+@pytest.mark.parametrize("bulk", [True, False])
+def test_songs_reported_added_survive_stopping_early(tmp_path, bulk):
+    songs_info = write_songs(tmp_path, 3)
+    system = FingerprintSystem(str(tmp_path / "songs.db"))
+    try:
+        batch = system.iter_batch_add(songs_info, bulk=bulk)
+        for _, status in batch:
+            if status["status"] == "added":
+                break
+        batch.close()
+
+        assert status["status"] == "added"
+        assert system.database.get_song_by_id(status["song_id"]) is not None
+        assert system.database.count_songs() >= 1
+    finally:
+        system.database.close()
@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+from audio_database import AudioDatabase
+from audio_processor import AudioProcessor
+from fingerPrintGenerator import FingerprintGenerator
+from live_identifier import ContinuousIdentifier, FileInputStream
+
+SAMPLE_RATE = 22050
+
+
+def melody(rng, seconds=20.0, note_seconds=0.25):
+    """Random notes with a couple of harmonics each"""
+    note_length = int(note_seconds * SAMPLE_RATE)
+    t = np.arange(note_length) / SAMPLE_RATE
+    notes = []
+    for freq in rng.uniform(200, 2000, int(seconds / note_seconds)):
+        notes.append(sum(np.sin(2 * np.pi * k * freq * t) / k for k in (1, 2, 3)))
+    audio = np.concatenate(notes) + 0.01 * rng.standard_normal(len(notes) * note_length)
+    return (audio / np.max(np.abs(audio))).astype(np.float32)
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    """Database of three synthetic songs, and the system view ContinuousIdentifier uses"""
+    rng = np.random.default_rng(0)
+    database = AudioDatabase(str(tmp_path / "songs.db"))
+    generator = FingerprintGenerator()
+    songs = {}
+    for title in ("first", "second", "third"):
+        audio = melody(rng)
+        path = tmp_path / f"{title}.wav"
+        sf.write(path, audio, SAMPLE_RATE)
+        song_id = database.add_song(title, None, "Test", str(path), len(audio) / SAMPLE_RATE)
+        hashes, offsets = generator.generate_fingerprint_arrays(audio, SAMPLE_RATE)
+        database.add_fingerprints(song_id, zip(hashes.tolist(), offsets.tolist()))
+        songs[title] = audio
+
+    system = SimpleNamespace(
+        matcher=SimpleNamespace(database=database),
+        fingerprint_generator=generator,
+        audio_processor=AudioProcessor(SAMPLE_RATE),
+    )
+    yield system, songs
+    database.close()
+
+
+@pytest.mark.parametrize("input_rate", [SAMPLE_RATE, 44100])
+def test_identifies_excerpt_streamed_from_file(catalog, tmp_path, input_rate):
+    system, songs = catalog
+    excerpt = songs["second"][5 * SAMPLE_RATE : 13 * SAMPLE_RATE]
+    path = tmp_path / "excerpt.wav"
+    sf.write(path, 0.3 * excerpt, SAMPLE_RATE)
+
+    identifier = ContinuousIdentifier(system, input_rate=input_rate, min_aligned=15)
+    match = identifier.listen(
+        lambda callback: FileInputStream(str(path), callback, samplerate=input_rate),
+        timeout=30.0,
+    )
+
+    assert match is not None
+    song_info, confidence, aligned = match
+    assert song_info["title"] == "second"
+    assert aligned >= 15 and 0 < confidence <= 1
+
+
+def test_unknown_audio_is_not_matched(catalog, tmp_path):
+    system, _ = catalog
+    path = tmp_path / "unknown.wav"
+    sf.write(path, melody(np.random.default_rng(1), seconds=8.0), SAMPLE_RATE)
+
+    identifier = ContinuousIdentifier(system, min_aligned=15)
+    match = identifier.listen(
+        lambda callback: FileInputStream(str(path), callback, samplerate=SAMPLE_RATE),
+        timeout=30.0,
+    )
+    assert match is None
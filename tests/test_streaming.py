@@ -0,0 +1,104 @@
+import numpy as np
+import pytest
+
+from fingerPrintGenerator import FingerprintGenerator
+from spectrogram_utils import (
+    SpectrogramGenerator,
+    StreamingSpectrogram,
+    StreamingPeakFinder,
+)
+
+SAMPLE_RATE = 22050
+
+
+def random_audio(rng, seconds=6.0):
+    """Noise with a few random tones, so peaks land all over the spectrogram"""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    audio = 0.05 * rng.standard_normal(len(t))
+    for freq in rng.uniform(100, 8000, 8):
+        start, stop = np.sort(rng.uniform(0, seconds, 2))
+        audio += np.sin(2 * np.pi * freq * t) * ((t >= start) & (t < stop))
+    return (audio / np.max(np.abs(audio))).astype(np.float32)
+
+
+def uneven_chunks(rng, audio):
+    """Blocks from a single sample up to several STFT windows, some empty"""
+    bounds = [0]
+    while bounds[-1] < len(audio):
+        bounds.append(bounds[-1] + int(rng.choice([0, 1, 700, 4095, 4097, 9000, 23456])))
+    return [audio[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+
+
+def sorted_peaks(freq_bins, time_bins):
+    order = np.lexsort((freq_bins, time_bins))
+    return np.asarray(freq_bins)[order], np.asarray(time_bins)[order]
+
+
+@pytest.mark.parametrize(
+    "peak_params",
+    [{}, {"peak_prominence": 6.0}, {"peaks_per_frame": 4}],
+)
+@pytest.mark.parametrize("seed", range(3))
+def test_streaming_matches_batch(seed, peak_params):
+    rng = np.random.default_rng(seed)
+    audio = random_audio(rng)
+    spec_gen = SpectrogramGenerator(**peak_params)
+    generator = FingerprintGenerator(spectrogram_generator=spec_gen)
+
+    _, _, spectrogram = spec_gen.generate_spectrogram(audio, SAMPLE_RATE)
+    batch_freqs, batch_times = spec_gen.find_peak_arrays(spectrogram)
+    batch_hashes, batch_offsets = generator.generate_fingerprint_arrays(
+        audio, SAMPLE_RATE
+    )
+
+    chunks = uneven_chunks(rng, audio)
+    streaming = StreamingSpectrogram(spec_gen, SAMPLE_RATE)
+    peak_finder = StreamingPeakFinder(spec_gen)
+    columns, peaks = [], []
+    for chunk in chunks:
+        block = streaming.push(chunk)
+        columns.append(block)
+        peaks.append(peak_finder.push(block))
+    peaks.append(peak_finder.flush())
+
+    np.testing.assert_array_equal(np.concatenate(columns, axis=1), spectrogram)
+    stream_freqs = np.concatenate([freqs for freqs, _ in peaks])
+    stream_times = np.concatenate([times for _, times in peaks])
+    for expected, actual in zip(
+        sorted_peaks(batch_freqs, batch_times), sorted_peaks(stream_freqs, stream_times)
+    ):
+        np.testing.assert_array_equal(actual, expected)
+
+    blocks = list(generator.stream_fingerprint(chunks, SAMPLE_RATE))
+    assert len(blocks) > 1
+    np.testing.assert_array_equal(np.concatenate([h for h, _ in blocks]), batch_hashes)
+    np.testing.assert_array_equal(np.concatenate([o for _, o in blocks]), batch_offsets)
+
+
+@pytest.mark.parametrize("num_samples", [1, 1000, 4095])
+def test_audio_shorter_than_a_window_gives_one_frame(num_samples):
+    rng = np.random.default_rng(num_samples)
+    audio = rng.uniform(-1, 1, num_samples).astype(np.float32)
+    spec_gen = SpectrogramGenerator()
+    generator = FingerprintGenerator(spectrogram_generator=spec_gen)
+
+    _, times, spectrogram = spec_gen.generate_spectrogram(audio, SAMPLE_RATE)
+    assert spectrogram.shape == (spec_gen.window_size // 2 + 1, 1)
+    assert len(times) == 1
+
+    streaming = StreamingSpectrogram(spec_gen, SAMPLE_RATE)
+    columns = [streaming.push(chunk) for chunk in np.array_split(audio, 3)]
+    columns.append(streaming.flush())
+    np.testing.assert_array_equal(np.concatenate(columns, axis=1), spectrogram)
+
+    batch_hashes, _ = generator.generate_fingerprint_arrays(audio, SAMPLE_RATE)
+    blocks = list(generator.stream_fingerprint(np.array_split(audio, 3), SAMPLE_RATE))
+    stream_hashes = np.concatenate([h for h, _ in blocks]) if blocks else np.empty(0)
+    np.testing.assert_array_equal(stream_hashes, batch_hashes)
+
+
+def test_empty_audio_gives_no_frames():
+    _, _, spectrogram = SpectrogramGenerator().generate_spectrogram(
+        np.empty(0, dtype=np.float32), SAMPLE_RATE
+    )
+    assert spectrogram.shape[1] == 0